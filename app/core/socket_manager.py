@@ -1,24 +1,372 @@
+import os
+import uuid
+import json
+import glob
+import socket
+import time
+import asyncio
+from collections import deque
 from fastapi import WebSocket
-from typing import Dict
+from typing import Dict, Callable, Awaitable
+
+# Tiempo máximo para entregar un mensaje a UNA conexión antes de descartarla
+SEND_TIMEOUT_SEGUNDOS = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+
+# Cola de salida por conexión: tamaño máximo y política cuando se llena
+WS_COLA_MAX = int(os.getenv("WS_COLA_MAX", "100"))
+WS_POLITICA_COLA = os.getenv("WS_POLITICA_COLA", "drop_oldest") # drop_oldest | drop_newest | coalesce
+
+# Heartbeat: cada cuánto se envía PING y tras cuánto silencio se desaloja
+WS_PING_INTERVALO = float(os.getenv("WS_PING_INTERVALO", "25"))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "60"))
+
+# Backend de distribución entre workers: "memory" (un solo proceso), "unix" o "redis"
+WS_PUBSUB = os.getenv("WS_PUBSUB", "memory")
+WS_PUBSUB_DIR = os.getenv("WS_PUBSUB_DIR", "/tmp/colegio_ws")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CANAL = "ws_mensajes"
+
+Callback = Callable[[dict], Awaitable[None]]
+
+
+# --- BACKENDS PUB/SUB (para repartir mensajes entre workers de uvicorn) ---
+
+class PubSubBackend:
+    """Interfaz: publicar un mensaje a todos los workers y recibir los de los demás."""
+
+    async def start(self, callback: Callback):
+        raise NotImplementedError
+
+    async def publish(self, mensaje: dict):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+
+class MemoryPubSub(PubSubBackend):
+    """
+    Bus en memoria. Con un solo worker no hace falta más; en tests varios
+    ConnectionManager pueden compartir la misma instancia para simular workers.
+    """
 
-class ConnectionManager:
     def __init__(self):
-        # Diccionario que mapea id_usuario -> WebSocket
-        self.active_connections: Dict[int, WebSocket] = {}
+        self._suscriptores = []
+
+    async def start(self, callback: Callback):
+        self._suscriptores.append(callback)
+
+    async def publish(self, mensaje: dict):
+        for callback in list(self._suscriptores):
+            await callback(mensaje)
+
+    async def stop(self):
+        self._suscriptores.clear()
+
+
+class UnixSocketPubSub(PubSubBackend):
+    """
+    Bus entre workers del mismo servidor sin dependencias externas: cada worker
+    abre un socket Unix de datagramas en WS_PUBSUB_DIR y publicar es enviar el
+    mensaje a todos los sockets de esa carpeta.
+    """
+
+    def __init__(self, directorio: str = WS_PUBSUB_DIR):
+        self.directorio = directorio
+        self.ruta = os.path.join(directorio, f"worker_{os.getpid()}_{uuid.uuid4().hex[:6]}.sock")
+        self._sock = None
+        self._transport = None
+
+    async def start(self, callback: Callback):
+        os.makedirs(self.directorio, exist_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.ruta)
+        self._sock.setblocking(False)
+
+        class _Protocolo(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                asyncio.ensure_future(callback(json.loads(data)))
+
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(_Protocolo, sock=self._sock)
+
+    async def publish(self, mensaje: dict):
+        data = json.dumps(mensaje, default=str).encode("utf-8")
+        emisor = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        emisor.setblocking(False)
+        try:
+            for ruta in glob.glob(os.path.join(self.directorio, "worker_*.sock")):
+                try:
+                    emisor.sendto(data, ruta)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Socket de un worker que ya no existe
+                    try: os.remove(ruta)
+                    except OSError: pass
+                except BlockingIOError:
+                    print(f"WS: buffer lleno en {ruta}, mensaje descartado")
+        finally:
+            emisor.close()
+
+    async def stop(self):
+        if self._transport:
+            self._transport.close()
+        if os.path.exists(self.ruta):
+            os.remove(self.ruta)
+
+
+class RedisPubSub(PubSubBackend):
+    """Bus entre workers/servidores usando Redis (requiere: pip install redis)."""
+
+    def __init__(self, url: str = REDIS_URL):
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+        self._tarea = None
+
+    async def start(self, callback: Callback):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(CANAL)
 
-    async def connect(self, user_id: int, websocket: WebSocket):
+        async def _escuchar():
+            async for item in pubsub.listen():
+                if item.get("type") == "message":
+                    await callback(json.loads(item["data"]))
+
+        self._tarea = asyncio.create_task(_escuchar())
+
+    async def publish(self, mensaje: dict):
+        await self._redis.publish(CANAL, json.dumps(mensaje, default=str))
+
+    async def stop(self):
+        if self._tarea:
+            self._tarea.cancel()
+        await self._redis.aclose()
+
+
+def crear_backend(nombre: str = WS_PUBSUB) -> PubSubBackend:
+    if nombre == "unix":
+        return UnixSocketPubSub()
+    if nombre == "redis":
+        return RedisPubSub()
+    return MemoryPubSub()
+
+
+# --- CONEXIÓN INDIVIDUAL (cola de salida + tarea escritora) ---
+
+class ConexionWS:
+    """
+    Envuelve un WebSocket con una cola de salida acotada y una tarea que la vacía.
+    Encolar nunca espera a la red del navegador; si la cola se llena se aplica
+    la política: 'drop_oldest' (descarta el más antiguo), 'drop_newest'
+    (descarta el nuevo) o 'coalesce' (reemplaza el pendiente de la misma
+    conversación y, si no hay, descarta el más antiguo).
+    """
+
+    def __init__(self, user_id: int, websocket: WebSocket, al_cerrar: Callable, max_cola: int = WS_COLA_MAX, politica: str = WS_POLITICA_COLA):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.max_cola = max_cola
+        self.politica = politica
+        self._al_cerrar = al_cerrar
+        self._cola = deque()
+        self._hay_datos = asyncio.Event()
+        self._tarea = None
+        self.ultimo_visto = time.monotonic()
+        self.responde_pong = False
+        self.cerrada = False # La cerró el escritor (envío fallido o lento); el endpoint deja de leer
+        # Métricas
+        self.enviados = 0
+        self.descartados = 0
+        self.coalescidos = 0
+        self.max_profundidad = 0
+
+    def iniciar(self):
+        self._tarea = asyncio.create_task(self._escritor())
+
+    def detener(self):
+        if self._tarea and self._tarea is not asyncio.current_task():
+            self._tarea.cancel()
+
+    @property
+    def profundidad(self):
+        return len(self._cola)
+
+    @staticmethod
+    def _clave_coalesce(data: dict):
+        # Mensajes del mismo tipo y conversación se pueden fusionar (el front recarga la conversación)
+        interno = data.get("data") if isinstance(data.get("data"), dict) else {}
+        if "id_conversacion" not in interno:
+            return None
+        return (data.get("tipo"), interno["id_conversacion"])
+
+    def encolar(self, data: dict):
+        if len(self._cola) >= self.max_cola:
+            if self.politica == "drop_newest":
+                self.descartados += 1
+                return
+            if self.politica == "coalesce":
+                clave = self._clave_coalesce(data)
+                if clave is not None:
+                    for idx, pendiente in enumerate(self._cola):
+                        if self._clave_coalesce(pendiente) == clave:
+                            # Sacamos el pendiente y el nuevo va al final para no alterar el orden
+                            del self._cola[idx]
+                            self._cola.append(data)
+                            self.coalescidos += 1
+                            self._hay_datos.set()
+                            return
+            self._cola.popleft()
+            self.descartados += 1
+
+        self._cola.append(data)
+        self.max_profundidad = max(self.max_profundidad, len(self._cola))
+        self._hay_datos.set()
+
+    async def _escritor(self):
+        try:
+            while True:
+                await self._hay_datos.wait()
+                while self._cola:
+                    data = self._cola.popleft()
+                    await asyncio.wait_for(self.websocket.send_json(data), timeout=SEND_TIMEOUT_SEGUNDOS)
+                    self.enviados += 1
+                self._hay_datos.clear()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Conexión muerta o demasiado lenta: la sacamos para no volver a esperarla y la
+            # cerramos, así el navegador ve el cierre y reconecta en lugar de quedar mudo
+            print(f"WS: descartando conexión del usuario {self.user_id}: {e!r}")
+            self.cerrada = True
+            self._al_cerrar(self.user_id, self.websocket)
+            try:
+                await asyncio.wait_for(self.websocket.close(code=1011), timeout=SEND_TIMEOUT_SEGUNDOS)
+            except Exception:
+                pass # Ya estaba cerrada o el cliente no responde; el endpoint sale igual
+
+    def metricas(self):
+        return {
+            "profundidad": self.profundidad,
+            "max_profundidad": self.max_profundidad,
+            "enviados": self.enviados,
+            "descartados": self.descartados,
+            "coalescidos": self.coalescidos
+        }
+
+
+# --- MANAGER DE CONEXIONES ---
+
+class ConnectionManager:
+    def __init__(self, backend: PubSubBackend = None):
+        # id_usuario -> {WebSocket: ConexionWS} (una por pestaña/dispositivo)
+        self.active_connections: Dict[int, Dict[WebSocket, ConexionWS]] = {}
+        self.worker_id = uuid.uuid4().hex
+        self.backend = backend or crear_backend()
+        self._backend_iniciado = False
+        self.desalojados_heartbeat = 0
+        # Contadores de las conexiones que ya se fueron, para que los totales no bajen
+        self._historico = {"enviados": 0, "descartados": 0, "coalescidos": 0}
+
+    async def _asegurar_backend(self):
+        # Se inicia en el primer uso porque necesita el event loop de uvicorn
+        # Si el bus no está disponible (p. ej. Redis caído) seguimos solo con las
+        # conexiones locales y se reintenta en el próximo uso
+        if not self._backend_iniciado:
+            self._backend_iniciado = True
+            try:
+                await self.backend.start(self._recibir_de_bus)
+            except Exception as e:
+                self._backend_iniciado = False
+                print(f"WS: no se pudo iniciar el bus {type(self.backend).__name__}: {e!r}")
+
+    async def connect(self, user_id: int, websocket: WebSocket) -> ConexionWS:
+        await self._asegurar_backend()
         await websocket.accept()
-        self.active_connections[user_id] = websocket
+        conexion = ConexionWS(user_id, websocket, self.disconnect)
+        conexion.iniciar()
+        self.active_connections.setdefault(user_id, {})[websocket] = conexion
+        return conexion
 
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
+    def disconnect(self, user_id: int, websocket: WebSocket = None):
+        """Quita una conexión concreta; sin websocket quita todas las del usuario."""
+        conexiones = self.active_connections.get(user_id)
+        if conexiones is None:
+            return
+        objetivo = list(conexiones) if websocket is None else [websocket]
+        for ws in objetivo:
+            conexion = conexiones.pop(ws, None)
+            if conexion:
+                conexion.detener()
+                self._historico["enviados"] += conexion.enviados
+                self._historico["descartados"] += conexion.descartados
+                self._historico["coalescidos"] += conexion.coalescidos
+        if not conexiones:
             del self.active_connections[user_id]
 
+    def enviar_local(self, user_id: int, data: dict):
+        """Encola el mensaje en todas las conexiones del usuario en ESTE worker (no bloquea)."""
+        for conexion in list(self.active_connections.get(user_id, {}).values()):
+            conexion.encolar(data)
+
+    async def _recibir_de_bus(self, mensaje: dict):
+        # Lo que publicamos nosotros ya se entregó localmente
+        if mensaje.get("origen") == self.worker_id:
+            return
+        self.enviar_local(int(mensaje["user_id"]), mensaje["data"])
+
     async def send_personal_message(self, user_id: int, data: dict):
-        """Envía un mensaje JSON a un usuario específico si está online"""
-        if user_id in self.active_connections:
-            websocket = self.active_connections[user_id]
-            await websocket.send_json(data)
+        """
+        Envía un mensaje JSON a un usuario en todas sus conexiones, en cualquier worker.
+        Nunca lanza: quien llama ya guardó el mensaje en la BD, y un fallo del bus no
+        debe convertirse en un error (el cliente reintentaría y lo duplicaría).
+        """
+        await self._asegurar_backend()
+        self.enviar_local(user_id, data)
+        if not self._backend_iniciado:
+            return
+        try:
+            await self.backend.publish({"origen": self.worker_id, "user_id": user_id, "data": data})
+        except Exception as e:
+            print(f"WS: no se pudo publicar el mensaje para el usuario {user_id}: {e!r}")
+
+    # --- Heartbeat ---
+    def registrar_actividad(self, conexion: ConexionWS, data: dict = None):
+        conexion.ultimo_visto = time.monotonic()
+        if isinstance(data, dict) and data.get("tipo") == "PONG":
+            conexion.responde_pong = True
+
+    def latido(self, conexion: ConexionWS) -> bool:
+        """
+        Se llama cuando la conexión lleva WS_PING_INTERVALO sin enviar nada.
+        Devuelve False si hay que desalojarla. Solo se desaloja por silencio a
+        los clientes que ya respondieron algún PONG; a los demás se les sigue
+        enviando PING y se desalojan cuando el envío falla.
+        """
+        if conexion.cerrada:
+            return False
+        if conexion.responde_pong and time.monotonic() - conexion.ultimo_visto > WS_PING_TIMEOUT:
+            self.desalojados_heartbeat += 1
+            return False
+        conexion.encolar({"tipo": "PING"})
+        return True
+
+    def metricas(self):
+        """Conexiones y colas actuales; enviados/descartados/coalescidos son acumulados desde el arranque."""
+        conexiones = [c for por_usuario in self.active_connections.values() for c in por_usuario.values()]
+        return {
+            "usuarios": len(self.active_connections),
+            "conexiones": len(conexiones),
+            "profundidad_total": sum(c.profundidad for c in conexiones),
+            "profundidad_max": max((c.profundidad for c in conexiones), default=0),
+            "enviados": self._historico["enviados"] + sum(c.enviados for c in conexiones),
+            "descartados": self._historico["descartados"] + sum(c.descartados for c in conexiones),
+            "coalescidos": self._historico["coalescidos"] + sum(c.coalescidos for c in conexiones),
+            "desalojados_heartbeat": self.desalojados_heartbeat
+        }
+
+    async def close(self):
+        for user_id in list(self.active_connections):
+            self.disconnect(user_id)
+        await self.backend.stop()
 
 # Instancia única para ser importada en otros archivos
-socket_manager = ConnectionManager()
\ No newline at end of file
+socket_manager = ConnectionManager()
@@ -9,6 +9,8 @@ from datetime import date
 from app.modules.management.models import CargaAcademica  # <--- Importar CargaAcademica
 from app.modules.users.models import Usuario, RolEnum     # <--- Importar Usuario y RolEnum
 from app.modules.users.docente.models import Docente      # <--- Importar Docente
+from app.modules.virtual.service import permisos_chat, cursos_alumno
+from app.modules.horario.service import horarios_vista
 
 router = APIRouter(prefix="/academic", tags=["Académico"])
 
@@ -32,6 +34,8 @@ def actualizar_estado_anios(db: Session):
     
     if cambios:
         db.commit()
+        permisos_chat.invalidar() # Cambió el año escolar activo
+        cursos_alumno.invalidar()
 
 @router.get("/anios/ultimo", response_model=schemas.AnioEscolarResponse)
 def obtener_ultimo_anio_creado(db: Session = Depends(get_db)):
@@ -126,6 +130,8 @@ def cerrar_anio(anio_id: str, db: Session = Depends(get_db)):
         ).update({Usuario.activo: False}, synchronize_session=False)
 
     db.commit()
+    permisos_chat.invalidar()
+    cursos_alumno.invalidar()
     return {"message": f"Año {anio_id} cerrado manualmente."}
 
 @router.post("/anios/copiar-estructura")
@@ -326,6 +332,7 @@ def actualizar_seccion(seccion_id: int, seccion: schemas.SeccionCreate, db: Sess
         setattr(db_seccion, key, value)
     
     db.commit()
+    horarios_vista.invalidar()
     db.refresh(db_seccion)
     return db_seccion
 
@@ -378,6 +385,8 @@ def actualizar_curso(curso_id: int, curso_data: schemas.CursoCreate, db: Session
         setattr(db_curso, key, value)
     
     db.commit()
+    cursos_alumno.invalidar()
+    horarios_vista.invalidar()
     db.refresh(db_curso)
     return db_curso
 
@@ -405,6 +414,8 @@ def eliminar_curso(
         mensaje = "Curso eliminado por completo del sistema"
     
     db.commit()
+    cursos_alumno.invalidar()
+    horarios_vista.invalidar()
     return {"message": mensaje}
 
 
@@ -426,6 +437,7 @@ def actualizar_plan_estudio_batch(
         db.add(nuevo)
     
     db.commit()
+    cursos_alumno.invalidar()
     return {"message": "Plan de estudio actualizado correctamente"}
 
 @router.post("/plan-estudio/", response_model=schemas.PlanEstudioResponse)
@@ -441,6 +453,7 @@ def asignar_curso_a_grado(plan: schemas.PlanEstudioCreate, db: Session = Depends
     nuevo = models.PlanEstudio(**plan.model_dump())
     db.add(nuevo)
     db.commit()
+    cursos_alumno.invalidar()
     db.refresh(nuevo)
     return nuevo
 
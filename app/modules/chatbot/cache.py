@@ -0,0 +1,217 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from datetime import date
+
+
+# Preguntas distintas cuyo embedding se recuerda (LRU)
+CHATBOT_CACHE_EMBEDDINGS = int(os.getenv("CHATBOT_CACHE_EMBEDDINGS", "512"))
+# Vida de una respuesta cacheada, en segundos (0 desactiva la caché de respuestas)
+CHATBOT_CACHE_TTL = int(os.getenv("CHATBOT_CACHE_TTL", "3600"))
+CHATBOT_CACHE_RESPUESTAS = int(os.getenv("CHATBOT_CACHE_RESPUESTAS", "1000"))
+
+
+def hash_fragmento(texto: str):
+    """Identidad del contenido de un fragmento: mismo texto -> mismo hash, en cualquier documento."""
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def normalizar_pregunta(texto: str):
+    """
+    '¿Cuándo vence la PENSIÓN?' -> 'cuando vence la pension'.
+    MiniLM ya ignora mayúsculas y tildes, así que normalizar no cambia el embedding
+    pero sí junta variantes de la misma pregunta bajo una clave.
+    """
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+class _Estadisticas:
+    def __init__(self):
+        self.aciertos = 0
+        self.fallos = 0
+
+    def como_dict(self, tamano: int, capacidad: int):
+        total = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_acierto": round(self.aciertos / total, 3) if total else 0.0,
+            "tamano": tamano,
+            "capacidad": capacidad
+        }
+
+
+class AlmacenEmbeddings:
+    """
+    Vectores de fragmentos por hash de contenido, persistidos en SQLite
+    (sha256(modelo + hash del fragmento) -> float32). Sobrevive reinicios y lo
+    comparten los workers: re-subir un reglamento con pocos cambios solo embebe
+    los fragmentos nuevos.
+    """
+
+    def __init__(self, ruta: str, modelo: str):
+        self.ruta = ruta
+        self.modelo = modelo
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        self._local = threading.local() # Una conexión por hilo
+        self._conexion().execute("CREATE TABLE IF NOT EXISTS embeddings (clave TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=30)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def clave(self, texto: str):
+        return hashlib.sha256(f"{self.modelo}\0{hash_fragmento(texto)}".encode("utf-8")).hexdigest()
+
+    def obtener(self, claves: list):
+        encontrados = {}
+        conexion = self._conexion()
+        for inicio in range(0, len(claves), 500):
+            tramo = claves[inicio:inicio + 500]
+            filas = conexion.execute(
+                f"SELECT clave, vector FROM embeddings WHERE clave IN ({','.join('?' * len(tramo))})", tramo
+            )
+            for clave, blob in filas:
+                encontrados[clave] = array("f", blob).tolist()
+        return encontrados
+
+    def guardar(self, pares: list):
+        conexion = self._conexion()
+        with conexion:
+            conexion.executemany(
+                "INSERT OR REPLACE INTO embeddings (clave, vector) VALUES (?, ?)",
+                [(clave, array("f", vector).tobytes()) for clave, vector in pares]
+            )
+
+
+class EmbeddingsCacheados:
+    """
+    Envuelve el modelo de embeddings:
+      - embed_query pasa por una LRU de pregunta normalizada -> vector.
+      - embed_documents (ingesta) pasa por el AlmacenEmbeddings, si hay uno:
+        solo se embeben los fragmentos cuyo contenido no se vio antes.
+    """
+
+    def __init__(self, base, capacidad: int = CHATBOT_CACHE_EMBEDDINGS, almacen: AlmacenEmbeddings = None):
+        self.base = base
+        self.capacidad = capacidad
+        self.almacen = almacen
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.estadisticas = _Estadisticas()
+        self.fragmentos_reutilizados = 0
+        self.fragmentos_embebidos = 0
+
+    def embed_query(self, texto: str):
+        clave = normalizar_pregunta(texto)
+        with self._lock:
+            if clave in self._lru:
+                self._lru.move_to_end(clave)
+                self.estadisticas.aciertos += 1
+                return self._lru[clave]
+            self.estadisticas.fallos += 1
+
+        vector = self.base.embed_query(clave)
+        with self._lock:
+            self._lru[clave] = vector
+            self._lru.move_to_end(clave)
+            while len(self._lru) > self.capacidad:
+                self._lru.popitem(last=False)
+        return vector
+
+    def embed_documents(self, textos: list):
+        if self.almacen is None:
+            self.fragmentos_embebidos += len(textos)
+            return self.base.embed_documents(textos)
+
+        claves = [self.almacen.clave(t) for t in textos]
+        vectores = self.almacen.obtener(list(set(claves)))
+        faltan = {}
+        for clave, texto in zip(claves, textos):
+            if clave not in vectores:
+                faltan.setdefault(clave, texto)
+
+        if faltan:
+            nuevos = self.base.embed_documents(list(faltan.values()))
+            pares = list(zip(faltan.keys(), nuevos))
+            self.almacen.guardar(pares)
+            vectores.update(pares)
+        self.fragmentos_embebidos += len(faltan)
+        self.fragmentos_reutilizados += len(textos) - len(faltan)
+        return [vectores[clave] for clave in claves]
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.estadisticas.como_dict(len(self._lru), self.capacidad),
+                "fragmentos_embebidos": self.fragmentos_embebidos,
+                "fragmentos_reutilizados": self.fragmentos_reutilizados
+            }
+
+
+class CacheRespuestas:
+    """
+    Respuestas por (pregunta normalizada, fuente, versión del corpus, fecha).
+    La versión del corpus cambia con cada subida/borrado, así una respuesta vieja
+    no se vuelve a servir; la fecha entra en la clave porque el prompt usa "hoy".
+    """
+
+    def __init__(self, ttl: int = CHATBOT_CACHE_TTL, capacidad: int = CHATBOT_CACHE_RESPUESTAS):
+        self.ttl = ttl
+        self.capacidad = capacidad
+        self._entradas = OrderedDict() # clave -> (expira_en, respuesta)
+        self._lock = threading.Lock()
+        self.estadisticas = _Estadisticas()
+
+    @staticmethod
+    def clave(pregunta: str, fuente, version_corpus):
+        return (normalizar_pregunta(pregunta), fuente, version_corpus, date.today().isoformat())
+
+    def obtener(self, clave: tuple):
+        if self.ttl <= 0:
+            return None
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada and entrada[0] > ahora:
+                self._entradas.move_to_end(clave)
+                self.estadisticas.aciertos += 1
+                return entrada[1]
+            if entrada:
+                del self._entradas[clave]
+            self.estadisticas.fallos += 1
+        return None
+
+    def guardar(self, clave: tuple, respuesta):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, respuesta)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def stats(self):
+        with self._lock:
+            return self.estadisticas.como_dict(len(self._entradas), self.capacidad)
+
+
+# Instancia única para ser importada en otros archivos
+respuestas_cache = CacheRespuestas()
@@ -0,0 +1,127 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Hilos para el trabajo de CPU de las preguntas (embedding de la pregunta, búsqueda, rerank).
+# torch y numpy sueltan el GIL, así que los hilos alcanzan y el modelo se carga una sola vez.
+CHATBOT_HILOS_CPU = int(os.getenv("CHATBOT_HILOS_CPU", "2"))
+# Preguntas que se atienden a la vez y documentos que se ingieren a la vez, por worker.
+# La ingesta tiene su propio pool de CHATBOT_MAX_SUBIDAS hilos: un documento largo
+# no le quita hilos a /ask.
+CHATBOT_MAX_PREGUNTAS = int(os.getenv("CHATBOT_MAX_PREGUNTAS", "4"))
+CHATBOT_MAX_SUBIDAS = int(os.getenv("CHATBOT_MAX_SUBIDAS", "1"))
+# Peticiones que pueden esperar turno; a partir de ahí se responde 503
+CHATBOT_COLA_MAX = int(os.getenv("CHATBOT_COLA_MAX", "50"))
+
+
+class ChatbotOcupado(Exception):
+    pass
+
+
+class _MetricasEtapa:
+    def __init__(self, limite: int):
+        self.limite = limite
+        self.esperando = 0
+        self.en_curso = 0
+        self.completadas = 0
+        self.rechazadas = 0
+        self.esperas_ms = deque(maxlen=500) # Últimos tiempos en cola
+
+    def como_dict(self):
+        esperas = sorted(self.esperas_ms)
+        return {
+            "limite": self.limite,
+            "esperando": self.esperando,
+            "en_curso": self.en_curso,
+            "completadas": self.completadas,
+            "rechazadas": self.rechazadas,
+            "espera_promedio_ms": round(sum(esperas) / len(esperas), 1) if esperas else 0.0,
+            "espera_p95_ms": round(esperas[int(len(esperas) * 0.95) - 1], 1) if esperas else 0.0,
+            "espera_max_ms": round(esperas[-1], 1) if esperas else 0.0
+        }
+
+
+class LimitadorChatbot:
+    """
+    Saca del event loop todo lo bloqueante del chatbot y limita cuántas
+    peticiones se procesan a la vez, midiendo el tiempo en cola:
+      - turno(etapa): semáforo por etapa ('preguntas') con cola acotada.
+      - en_pool(fn, ...): ejecuta fn en el pool de hilos de CPU de las preguntas.
+      - en_pool_ingesta(fn, ...): ejecuta fn en el pool propio de la ingesta.
+    """
+
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=max(CHATBOT_HILOS_CPU, 1), thread_name_prefix="chatbot")
+        self.pool_ingesta = ThreadPoolExecutor(max_workers=max(CHATBOT_MAX_SUBIDAS, 1), thread_name_prefix="chatbot_ingesta")
+        self._limites = {"preguntas": CHATBOT_MAX_PREGUNTAS}
+        self._semaforos = {}
+        self._metricas = {nombre: _MetricasEtapa(limite) for nombre, limite in self._limites.items()}
+        self._metricas["pool"] = _MetricasEtapa(max(CHATBOT_HILOS_CPU, 1))
+        self._metricas["pool_ingesta"] = _MetricasEtapa(max(CHATBOT_MAX_SUBIDAS, 1))
+        self._lock = threading.Lock()
+
+    def _semaforo(self, etapa: str):
+        # Se crea dentro del event loop que lo va a usar
+        if etapa not in self._semaforos:
+            self._semaforos[etapa] = asyncio.Semaphore(self._limites[etapa])
+        return self._semaforos[etapa]
+
+    @asynccontextmanager
+    async def turno(self, etapa: str):
+        metricas = self._metricas[etapa]
+        if metricas.esperando >= CHATBOT_COLA_MAX:
+            metricas.rechazadas += 1
+            raise ChatbotOcupado(etapa)
+
+        semaforo = self._semaforo(etapa)
+        inicio = time.perf_counter()
+        metricas.esperando += 1
+        try:
+            await semaforo.acquire()
+        finally:
+            metricas.esperando -= 1
+        metricas.esperas_ms.append((time.perf_counter() - inicio) * 1000)
+        metricas.en_curso += 1
+        try:
+            yield
+        finally:
+            metricas.en_curso -= 1
+            metricas.completadas += 1
+            semaforo.release()
+
+    async def en_pool(self, fn, *args):
+        return await self._en_executor(self.pool, self._metricas["pool"], fn, *args)
+
+    async def en_pool_ingesta(self, fn, *args):
+        return await self._en_executor(self.pool_ingesta, self._metricas["pool_ingesta"], fn, *args)
+
+    async def _en_executor(self, pool: ThreadPoolExecutor, metricas: _MetricasEtapa, fn, *args):
+        encolado = time.perf_counter()
+        with self._lock:
+            metricas.esperando += 1
+
+        def tarea():
+            with self._lock:
+                metricas.esperando -= 1
+                metricas.esperas_ms.append((time.perf_counter() - encolado) * 1000)
+                metricas.en_curso += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    metricas.en_curso -= 1
+                    metricas.completadas += 1
+
+        return await asyncio.get_running_loop().run_in_executor(pool, tarea)
+
+    def metricas(self):
+        return {nombre: m.como_dict() for nombre, m in self._metricas.items()}
+
+
+# Instancia única para ser importada en otros archivos
+limitador_chatbot = LimitadorChatbot()
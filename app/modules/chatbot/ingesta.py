@@ -0,0 +1,388 @@
+import os
+import time
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from app.core.socket_manager import socket_manager
+from .models import Chatbot, ChatbotVersion
+from .service import ExtraccionService
+from .cache import respuestas_cache
+from .concurrencia import limitador_chatbot, ChatbotOcupado, CHATBOT_MAX_SUBIDAS, CHATBOT_COLA_MAX
+
+
+ESTADO_EN_COLA = "en_cola"
+ESTADO_PROCESANDO = "procesando"
+ESTADO_ENTRENADO = "entrenado"
+ESTADO_ACTUALIZANDO = "actualizando" # Reemplazo en curso; mientras tanto se responde con la versión anterior
+ESTADO_ERROR = "error"
+
+# Versiones anteriores (y sus archivos) que se guardan por documento
+CHATBOT_VERSIONES_GUARDADAS = int(os.getenv("CHATBOT_VERSIONES_GUARDADAS", "12"))
+# Cada cuánto un worker renueva fecha_actualizacion de sus trabajos, y tras cuánto
+# silencio cualquier worker da por perdido un trabajo (p. ej. el worker se reinició)
+CHATBOT_INGESTA_LATIDO_S = float(os.getenv("CHATBOT_INGESTA_LATIDO_S", "60"))
+CHATBOT_INGESTA_ABANDONO_S = float(os.getenv("CHATBOT_INGESTA_ABANDONO_S", "300"))
+
+
+class TrabajoIngesta:
+    __slots__ = ("id_documento", "ruta", "extension", "fuente", "id_usuario", "bind", "encolado", "reemplazo",
+                 "restaurar", "nota")
+
+    def __init__(self, id_documento: int, ruta: str, extension: str, fuente: str, bind, id_usuario: int = None,
+                 reemplazo: bool = False, restaurar: bool = False, nota: str = None):
+        self.id_documento = id_documento
+        self.reemplazo = reemplazo      # True: 'ruta' es la nueva versión de un documento ya indexado
+        self.restaurar = restaurar      # True: 'ruta' es el archivo vigente del documento, a dejar tal cual en el índice
+        self.nota = nota                # Detalle que queda en la fila al terminar una restauración
+        self.ruta = ruta
+        self.extension = extension
+        self.fuente = fuente            # Nombre del archivo, metadato 'source' de los fragmentos
+        self.id_usuario = id_usuario    # A quién avisar el progreso por WebSocket (opcional)
+        self.bind = bind
+        self.encolado = time.perf_counter()
+
+
+class ColaIngesta:
+    """
+    Cola de ingesta de documentos del chatbot. /upload guarda el archivo, crea la
+    fila en 'en_cola' y responde; los trabajadores (CHATBOT_MAX_SUBIDAS) hacen
+    extracción -> fragmentos -> embeddings por lotes -> índice en el pool de ingesta
+    (en tubería: los primeros lotes se embeben mientras se extraen las páginas siguientes),
+    actualizando status/progreso/detalle de la fila y avisando por WebSocket.
+    """
+
+    def __init__(self, obtener_backend, trabajadores: int = CHATBOT_MAX_SUBIDAS, capacidad: int = CHATBOT_COLA_MAX):
+        self._obtener_backend = obtener_backend
+        self.trabajadores = max(trabajadores, 1)
+        self.capacidad = capacidad
+        self._cola = None
+        self._tareas = []
+        self.en_curso = 0
+        self.completados = 0
+        self.fallidos = 0
+        self.recuperados = 0
+        self.esperas_ms = deque(maxlen=500)
+        self._propios = set() # Documentos en cola o en curso en ESTE worker
+
+    @property
+    def backend(self):
+        # El backend (y el modelo de embeddings) se crea recién con el primer trabajo
+        return self._obtener_backend()
+
+    def _asegurar_trabajadores(self):
+        # Se arrancan dentro del event loop, con la primera subida
+        if self._cola is None:
+            self._cola = asyncio.Queue()
+            self._tareas = [asyncio.create_task(self._trabajador()) for _ in range(self.trabajadores)]
+
+    def encolar(self, trabajo: TrabajoIngesta):
+        """Devuelve la posición en la cola; ChatbotOcupado si está llena."""
+        self._asegurar_trabajadores()
+        if self._cola.qsize() >= self.capacidad:
+            raise ChatbotOcupado("ingesta")
+        self._cola.put_nowait(trabajo)
+        self._propios.add(trabajo.id_documento)
+        return self._cola.qsize()
+
+    async def _trabajador(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            trabajo = await self._cola.get()
+            self.esperas_ms.append((time.perf_counter() - trabajo.encolado) * 1000)
+            self.en_curso += 1
+            try:
+                if await limitador_chatbot.en_pool_ingesta(self._procesar, trabajo, loop):
+                    self.completados += 1
+                else:
+                    self.fallidos += 1
+            except Exception as e:
+                self.fallidos += 1
+                print(f"❌ Error en la ingesta del documento {trabajo.id_documento}: {e}")
+            finally:
+                self.en_curso -= 1
+                self._propios.discard(trabajo.id_documento)
+                self._cola.task_done()
+
+    # --- Trabajos perdidos ---
+    # La cola vive en la memoria del worker: si se reinicia o se cae, sus filas quedarían
+    # para siempre en 'en_cola'/'procesando' y el documento no se podría reemplazar.
+    async def vigilar(self, bind):
+        """Tarea de fondo de cada worker (se lanza al arrancar): índice vacío, latido y recuperación."""
+        try:
+            for trabajo in await asyncio.to_thread(self._documentos_sin_indexar, bind):
+                self.encolar(trabajo)
+        except Exception as e:
+            print(f"❌ No se pudo llenar el índice local: {e}")
+        while True:
+            try:
+                for trabajo in await asyncio.to_thread(self._latido, bind):
+                    try:
+                        self.encolar(trabajo)
+                    except ChatbotOcupado:
+                        await asyncio.to_thread(self._marcar_perdido, bind, trabajo.id_documento)
+            except Exception as e:
+                print(f"❌ Error revisando ingestas pendientes: {e}")
+            await asyncio.sleep(CHATBOT_INGESTA_LATIDO_S)
+
+    @staticmethod
+    def _documentos_sin_indexar(bind):
+        """
+        Con el backend local, un índice vacío y documentos 'entrenado' en la BD (p. ej. al
+        pasar de Pinecone al índice local) se llena desde los archivos guardados, sin
+        esperar a un /reindex manual. Varios workers pueden encolarlos a la vez: el
+        índice no duplica fragmentos y los embeddings salen del almacén por hash.
+        """
+        from .vectorstore import CHATBOT_VECTOR_BACKEND, CHATBOT_INDEX_DIR, IndiceVectorialLocal
+        if CHATBOT_VECTOR_BACKEND != "local" or len(IndiceVectorialLocal(CHATBOT_INDEX_DIR)):
+            return []
+        db = Session(bind=bind)
+        try:
+            docs = db.query(Chatbot).filter(Chatbot.status == ESTADO_ENTRENADO).all()
+            return [
+                TrabajoIngesta(doc.id, doc.file_path, f".{doc.file_type}", doc.filename, bind, restaurar=True)
+                for doc in docs if os.path.exists(doc.file_path)
+            ]
+        finally:
+            db.close()
+
+    def _latido(self, bind):
+        """
+        Renueva fecha_actualizacion de los trabajos de este worker y reclama los que
+        llevan más de CHATBOT_INGESTA_ABANDONO_S sin señal. Devuelve los trabajos a
+        reencolar (desde el archivo guardado); si el archivo ya no está, quedan en 'error'.
+        Un reemplazo interrumpido no se retoma: se reencola como restauración de la
+        versión vigente, que además borra el archivo nuevo (archivo_pendiente).
+        """
+        db = Session(bind=bind)
+        try:
+            ahora = datetime.now()
+            propios = list(self._propios)
+            if propios:
+                db.query(Chatbot).filter(Chatbot.id.in_(propios))\
+                    .update({Chatbot.fecha_actualizacion: ahora}, synchronize_session=False)
+                db.commit()
+
+            limite = ahora - timedelta(seconds=CHATBOT_INGESTA_ABANDONO_S)
+            perdidos = or_(Chatbot.fecha_actualizacion == None, Chatbot.fecha_actualizacion < limite)
+            candidatos = db.query(Chatbot).filter(
+                Chatbot.status.in_((ESTADO_EN_COLA, ESTADO_PROCESANDO, ESTADO_ACTUALIZANDO)), perdidos
+            ).all()
+
+            reencolar = []
+            for doc in candidatos:
+                if doc.id in self._propios:
+                    continue
+                restaurar = doc.status == ESTADO_ACTUALIZANDO
+                # Otro worker puede estar viendo la misma fila: la toma quien logra el UPDATE
+                reclamado = db.query(Chatbot).filter(Chatbot.id == doc.id, Chatbot.status == doc.status, perdidos)\
+                    .update({
+                        Chatbot.status: ESTADO_ACTUALIZANDO if restaurar else ESTADO_EN_COLA,
+                        Chatbot.progreso: 0,
+                        Chatbot.detalle: "Restaurando la versión vigente: el reemplazo se interrumpió" if restaurar
+                            else "Reencolado: la ingesta anterior se interrumpió",
+                        Chatbot.fecha_actualizacion: ahora
+                    }, synchronize_session=False)
+                db.commit()
+                if not reclamado:
+                    continue
+                self.recuperados += 1
+                if not os.path.exists(doc.file_path):
+                    self._marcar_perdido(bind, doc.id)
+                    continue
+                reencolar.append(TrabajoIngesta(
+                    doc.id, doc.file_path, f".{doc.file_type}", doc.filename, bind, restaurar=restaurar,
+                    nota="No se pudo reemplazar: la actualización se interrumpió; vuelve a subir la nueva versión."
+                    if restaurar else None
+                ))
+            return reencolar
+        finally:
+            db.close()
+
+    @staticmethod
+    def _marcar_perdido(bind, id_documento: int):
+        db = Session(bind=bind)
+        try:
+            doc = db.get(Chatbot, id_documento)
+            if doc is not None:
+                if doc.archivo_pendiente:
+                    ColaIngesta._descartar_archivo(doc.archivo_pendiente)
+                    doc.archivo_pendiente = None
+                doc.status = ESTADO_ERROR
+                doc.detalle = "La ingesta se interrumpió y no se pudo retomar; vuelve a subir el archivo."
+                db.commit()
+        finally:
+            db.close()
+
+    # --- Trabajo (corre en un hilo del pool de ingesta) ---
+    def _avanzar(self, db: Session, doc: Chatbot, trabajo: TrabajoIngesta, loop, estado: str, progreso: int, detalle: str = None):
+        doc.status = estado
+        doc.progreso = progreso
+        doc.detalle = detalle
+        db.commit()
+        if trabajo.id_usuario:
+            aviso = {
+                "tipo": "CHATBOT_INGESTA",
+                "id": trabajo.id_documento,
+                "filename": trabajo.fuente,
+                "status": estado,
+                "progreso": progreso,
+                "detalle": detalle
+            }
+            asyncio.run_coroutine_threadsafe(socket_manager.send_personal_message(trabajo.id_usuario, aviso), loop)
+
+    def _procesar(self, trabajo: TrabajoIngesta, loop):
+        db = Session(bind=trabajo.bind)
+        indexado = False
+        indice_tocado = False # En un reemplazo: ya empezó a escribir la versión nueva en el índice
+        estado = ESTADO_ACTUALIZANDO if trabajo.reemplazo else ESTADO_PROCESANDO
+        try:
+            doc = db.get(Chatbot, trabajo.id_documento)
+            if doc is None:
+                # Se borró mientras esperaba en la cola
+                if not trabajo.restaurar:
+                    self._descartar_archivo(trabajo.ruta)
+                return False
+
+            if trabajo.restaurar:
+                # Deja en el índice el archivo vigente: tras un reemplazo interrumpido (no sabemos
+                # si el índice alcanzó a recibir la versión nueva) o al llenar un índice local vacío
+                if doc.archivo_pendiente and doc.archivo_pendiente != doc.file_path:
+                    # La versión nueva de un reemplazo interrumpido: nadie más la va a usar
+                    self._descartar_archivo(doc.archivo_pendiente)
+                doc.archivo_pendiente = None
+                try:
+                    cambios = self._restaurar_indice(doc)
+                except Exception as e:
+                    self._avanzar(db, doc, trabajo, loop, ESTADO_ERROR, doc.progreso or 0,
+                                  f"No se pudo indexar el archivo vigente: {e}"[:255])
+                    return False
+                if cambios["total"]:
+                    doc.total_chunks = cambios["total"]
+                self._avanzar(db, doc, trabajo, loop, ESTADO_ENTRENADO, 100, trabajo.nota)
+                return True
+
+            self._avanzar(db, doc, trabajo, loop, estado, 5, "Extrayendo texto")
+            total, paginas = ExtraccionService.paginas(trabajo.ruta, trabajo.extension)
+            if paginas is None:
+                raise ValueError("Formato no soportado.")
+            unidad = "páginas" if trabajo.extension == ".pdf" else "bloques"
+            leidas = 0
+
+            def contar(paginas):
+                nonlocal leidas
+                for texto in paginas:
+                    leidas += 1
+                    yield texto
+
+            def al_avanzar(hechos: int, _total):
+                # Extracción, fragmentos y embeddings van en tubería: el avance se mide por
+                # páginas leídas (5% a 95%) y solo escribimos saltos de 5 puntos
+                progreso = 5 + (90 * leidas) // max(total, 1)
+                if progreso - doc.progreso >= 5:
+                    detalle = f"{leidas}/{total} {unidad} leídas, {hechos} fragmentos procesados"
+                    self._avanzar(db, doc, trabajo, loop, estado, progreso, detalle)
+
+            fragmentos = ExtraccionService.fragmentos_en_flujo(contar(paginas), trabajo.fuente)
+            if trabajo.reemplazo:
+                # Diferencia contra lo indexado y una sola escritura con altas y bajas:
+                # hasta ese momento las preguntas siguen viendo la versión anterior completa
+                indice_tocado = True
+                cambios = self.backend.sincronizar(trabajo.fuente, fragmentos, al_avanzar)
+                total_fragmentos = cambios["total"]
+            else:
+                total_fragmentos = self.backend.agregar(fragmentos, al_avanzar)
+            if not total_fragmentos:
+                raise ValueError("El archivo no contiene texto legible (puede que sea una imagen o esté protegido).")
+            indexado = True
+
+            if trabajo.reemplazo:
+                self._registrar_version(db, doc, trabajo, cambios)
+                doc.archivo_pendiente = None
+            doc.total_chunks = total_fragmentos
+            doc.pinecone_index = self.backend.nombre
+            self._avanzar(db, doc, trabajo, loop, ESTADO_ENTRENADO, 100)
+            respuestas_cache.invalidar()
+            return True
+
+        except Exception as e:
+            db.rollback()
+            doc = db.get(Chatbot, trabajo.id_documento)
+            if doc is None:
+                # Lo borraron durante la ingesta: no dejamos vectores huérfanos
+                if indexado or indice_tocado:
+                    self.backend.eliminar(trabajo.fuente)
+                self._descartar_archivo(trabajo.ruta)
+                return False
+            if trabajo.reemplazo:
+                # La fila sigue en la versión anterior; si el índice ya recibió la nueva
+                # (falló el registro de la versión o el commit) lo volvemos a la anterior
+                detalle = f"No se pudo reemplazar: {e}"
+                if indice_tocado:
+                    try:
+                        self._restaurar_indice(doc)
+                    except Exception as e_restaurar:
+                        detalle += f" (el índice no se pudo restaurar: {e_restaurar})"
+                doc.archivo_pendiente = None
+                self._avanzar(db, doc, trabajo, loop, ESTADO_ENTRENADO, 100, detalle[:255])
+            else:
+                self._avanzar(db, doc, trabajo, loop, ESTADO_ERROR, doc.progreso or 0, str(e)[:255])
+            self._descartar_archivo(trabajo.ruta)
+            return False
+        finally:
+            db.close()
+
+    @staticmethod
+    def _descartar_archivo(ruta: str):
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+    def _restaurar_indice(self, doc: Chatbot):
+        """Deja en el índice los fragmentos del archivo vigente del documento (sus embeddings ya están en el almacén)."""
+        _, paginas = ExtraccionService.paginas(doc.file_path, f".{doc.file_type}")
+        fragmentos = ExtraccionService.fragmentos_en_flujo(paginas, doc.filename) if paginas else []
+        cambios = self.backend.sincronizar(doc.filename, fragmentos)
+        respuestas_cache.invalidar()
+        return cambios
+
+    @staticmethod
+    def _registrar_version(db: Session, doc: Chatbot, trabajo: TrabajoIngesta, cambios: dict):
+        """Pasa la versión vigente al historial y deja el archivo nuevo como actual."""
+        version_actual = doc.version or 1
+        db.add(ChatbotVersion(
+            id_chatbot=doc.id,
+            version=version_actual,
+            archivo_original=doc.unique_filename.split("_", 1)[-1],
+            unique_filename=doc.unique_filename,
+            file_path=doc.file_path,
+            file_type=doc.file_type,
+            total_chunks=doc.total_chunks,
+            fragmentos_agregados=cambios["agregados"],
+            fragmentos_eliminados=cambios["eliminados"]
+        ))
+        doc.unique_filename = os.path.basename(trabajo.ruta)
+        doc.file_path = trabajo.ruta
+        doc.file_type = trabajo.extension.replace(".", "")
+        doc.version = version_actual + 1
+
+        # Solo guardamos las últimas CHATBOT_VERSIONES_GUARDADAS (con sus archivos)
+        viejas = db.query(ChatbotVersion).filter(ChatbotVersion.id_chatbot == doc.id)\
+            .order_by(ChatbotVersion.version.desc()).offset(CHATBOT_VERSIONES_GUARDADAS).all()
+        for vieja in viejas:
+            if os.path.exists(vieja.file_path):
+                os.remove(vieja.file_path)
+            db.delete(vieja)
+
+    def metricas(self):
+        esperas = list(self.esperas_ms)
+        return {
+            "trabajadores": self.trabajadores,
+            "en_cola": self._cola.qsize() if self._cola else 0,
+            "en_curso": self.en_curso,
+            "completados": self.completados,
+            "fallidos": self.fallidos,
+            "recuperados": self.recuperados,
+            "espera_promedio_ms": round(sum(esperas) / len(esperas), 1) if esperas else 0.0,
+            "espera_max_ms": round(max(esperas), 1) if esperas else 0.0
+        }
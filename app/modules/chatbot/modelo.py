@@ -0,0 +1,44 @@
+import os
+import asyncio
+from types import SimpleNamespace
+
+
+# 'gemini' (por defecto) o 'falso': modelo local para pruebas y desarrollo sin API key
+CHATBOT_LLM = os.getenv("CHATBOT_LLM", "gemini").lower()
+# Pausa entre trozos del modelo falso, para ver el streaming en el front
+CHATBOT_LLM_FALSO_RETARDO_MS = int(os.getenv("CHATBOT_LLM_FALSO_RETARDO_MS", "30"))
+
+
+class _ModelosFalsos:
+    def __init__(self, retardo_ms: int):
+        self.retardo_ms = retardo_ms
+
+    @staticmethod
+    def _respuesta(contents: str):
+        """Repite la pregunta y la primera fuente del contexto: suficiente para probar el flujo."""
+        pregunta = contents.rsplit("PREGUNTA DEL USUARIO:", 1)[-1].strip()
+        fuente = next((l.split(":", 1)[1].strip() for l in contents.splitlines() if l.strip().startswith("FUENTE:")), None)
+        if fuente is None:
+            return "Lo siento, no tengo esa información precisa 🏫."
+        return f"Respuesta de prueba a '{pregunta}' según {fuente}."
+
+    async def generate_content(self, model: str, contents: str):
+        await asyncio.sleep(self.retardo_ms / 1000)
+        return SimpleNamespace(text=self._respuesta(contents))
+
+    async def generate_content_stream(self, model: str, contents: str):
+        palabras = self._respuesta(contents).split(" ")
+
+        async def trozos():
+            for i, palabra in enumerate(palabras):
+                await asyncio.sleep(self.retardo_ms / 1000)
+                yield SimpleNamespace(text=palabra if i == 0 else " " + palabra)
+
+        return trozos()
+
+
+class ClienteFalso:
+    """Misma forma que genai.Client para lo que usa el chatbot: cliente.aio.models.generate_content(_stream)."""
+
+    def __init__(self, retardo_ms: int = CHATBOT_LLM_FALSO_RETARDO_MS):
+        self.aio = SimpleNamespace(models=_ModelosFalsos(retardo_ms))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum
+from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey
 from app.db.database import Base
 from datetime import datetime
 
@@ -12,5 +12,31 @@ class Chatbot(Base):
     file_type = Column(String(50))
     pinecone_index = Column(String(100))
     total_chunks = Column(Integer, default=0)
-    status = Column(String(50), default="procesando")
+    status = Column(String(50), default="procesando") # en_cola | procesando | entrenado | actualizando | error
+    progreso = Column(Integer, default=0) # 0-100 durante la ingesta
+    detalle = Column(String(255)) # Etapa actual o motivo del error
+    version = Column(Integer, default=1) # Sube con cada reemplazo del archivo
+    fecha_creacion = Column(DateTime, default=datetime.now)
+    # Última señal de vida de la ingesta (avance o latido del worker que la tiene)
+    fecha_actualizacion = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    # Archivo subido por un reemplazo en curso (aún no es file_path): si el trabajo se pierde,
+    # la restauración lo borra. En MySQL: ALTER TABLE chatbot ADD COLUMN archivo_pendiente VARCHAR(500) NULL;
+    archivo_pendiente = Column(String(500), nullable=True)
+
+
+class ChatbotVersion(Base):
+    """Historial de reemplazos: una fila por versión anterior de un documento."""
+    __tablename__ = "chatbot_version"
+
+    id = Column(Integer, primary_key=True, index=True)
+    id_chatbot = Column(Integer, ForeignKey("chatbot.id", ondelete="CASCADE"), nullable=False, index=True)
+    version = Column(Integer, nullable=False)
+    archivo_original = Column(String(255)) # Nombre con el que se subió esa versión
+    unique_filename = Column(String(255), nullable=False)
+    file_path = Column(String(500), nullable=False)
+    file_type = Column(String(50))
+    total_chunks = Column(Integer, default=0)
+    # Cambios que aplicó en el índice el reemplazo de esta versión por la siguiente
+    fragmentos_agregados = Column(Integer)
+    fragmentos_eliminados = Column(Integer)
     fecha_creacion = Column(DateTime, default=datetime.now)
\ No newline at end of file
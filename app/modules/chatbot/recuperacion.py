@@ -0,0 +1,197 @@
+import os
+import math
+import time
+import heapq
+import threading
+from collections import Counter, defaultdict
+from .cache import normalizar_pregunta
+
+
+# Candidatos que aporta cada buscador antes de fusionar
+CHATBOT_K_DENSO = int(os.getenv("CHATBOT_K_DENSO", "20"))
+CHATBOT_K_LEXICO = int(os.getenv("CHATBOT_K_LEXICO", "20"))
+# Candidatos fusionados que pasan al reranker
+CHATBOT_RERANK_CANDIDATOS = int(os.getenv("CHATBOT_RERANK_CANDIDATOS", "12"))
+# Cross-encoder opcional (p. ej. 'cross-encoder/ms-marco-MiniLM-L-6-v2'); vacío = orden de la fusión
+CHATBOT_RERANKER = os.getenv("CHATBOT_RERANKER", "")
+# Tope de tokens del contexto que se manda a Gemini
+CHATBOT_CONTEXTO_TOKENS = int(os.getenv("CHATBOT_CONTEXTO_TOKENS", "1800"))
+
+RRF_K = 60 # Constante de Reciprocal Rank Fusion
+
+STOPWORDS = {
+    "el", "la", "los", "las", "un", "una", "unos", "unas", "de", "del", "al", "a", "en", "y", "o",
+    "que", "por", "para", "con", "sin", "se", "su", "sus", "es", "son", "lo", "le", "les", "me",
+    "mi", "mis", "como", "cual", "cuales", "hay", "este", "esta", "estos", "estas", "ese", "esa"
+}
+
+
+def tokenizar(texto: str):
+    """Minúsculas y sin tildes; los números se conservan ('15/03/2026' -> 15, 03, 2026)."""
+    return [t for t in normalizar_pregunta(texto).split() if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+def estimar_tokens(texto: str):
+    # ~4 caracteres por token en español; no tenemos el tokenizador de Gemini en local
+    return len(texto) // 4 + 1
+
+
+class IndiceLexico:
+    """BM25 sobre los mismos fragmentos del índice vectorial (listas invertidas en memoria)."""
+
+    def __init__(self, metadatos: list, k1: float = 1.5, b: float = 0.75):
+        self.metadatos = metadatos
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # termino -> [(indice_fragmento, frecuencia)]
+        self.largos = []
+        for i, m in enumerate(metadatos):
+            tokens = tokenizar(m["texto"])
+            self.largos.append(len(tokens))
+            for termino, frecuencia in Counter(tokens).items():
+                self.postings.setdefault(termino, []).append((i, frecuencia))
+
+        n = len(metadatos)
+        self.largo_promedio = (sum(self.largos) / n) if n else 1.0
+        self.idf = {
+            termino: math.log(1 + (n - len(lista) + 0.5) / (len(lista) + 0.5))
+            for termino, lista in self.postings.items()
+        }
+
+    def buscar(self, pregunta: str, k: int, fuente: str = None):
+        """Devuelve [(metadato, puntaje BM25)] de los k mejores."""
+        puntajes = defaultdict(float)
+        for termino in set(tokenizar(pregunta)):
+            idf = self.idf.get(termino)
+            if idf is None:
+                continue
+            for i, frecuencia in self.postings[termino]:
+                if fuente is not None and self.metadatos[i]["source"] != fuente:
+                    continue
+                normalizacion = self.k1 * (1 - self.b + self.b * self.largos[i] / self.largo_promedio)
+                puntajes[i] += idf * frecuencia * (self.k1 + 1) / (frecuencia + normalizacion)
+        mejores = heapq.nlargest(k, puntajes.items(), key=lambda x: x[1])
+        return [(self.metadatos[i], puntaje) for i, puntaje in mejores]
+
+
+class TiemposEtapas:
+    """Promedio y máximo por etapa (ms, y tokens del contexto) de las preguntas respondidas por el modelo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acumulado = defaultdict(lambda: [0, 0.0, 0.0]) # etapa -> [n, suma, max]
+
+    def registrar(self, tiempos: dict):
+        with self._lock:
+            for etapa, ms in tiempos.items():
+                fila = self._acumulado[etapa]
+                fila[0] += 1
+                fila[1] += ms
+                fila[2] = max(fila[2], ms)
+
+    def como_dict(self):
+        with self._lock:
+            return {
+                etapa: {"n": n, "promedio": round(suma / n, 1), "max": round(maximo, 1)}
+                for etapa, (n, suma, maximo) in self._acumulado.items()
+            }
+
+
+class RecuperadorHibrido:
+    """
+    Recuperación para /ask en cuatro etapas, cada una medida:
+      1. denso: similitud de embeddings en el backend vectorial (CHATBOT_K_DENSO).
+      2. léxico: BM25 sobre los mismos fragmentos (CHATBOT_K_LEXICO); las tablas de
+         pagos y fechas ('| N° | PENSIÓN | FECHA |') se encuentran por sus palabras y números.
+      3. fusión + rerank: Reciprocal Rank Fusion de ambas listas y, si está
+         configurado, cross-encoder sobre los mejores CHATBOT_RERANK_CANDIDATOS.
+      4. recorte: fragmentos en orden hasta llenar CHATBOT_CONTEXTO_TOKENS.
+    Con Pinecone no hay copia local de los textos y se usa solo la etapa densa.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._lexico = None
+        self._version_lexico = None
+        self._reranker = None
+
+    def _indice_lexico(self):
+        # Se reconstruye cuando cambia el corpus (subidas/borrados, también de otros workers)
+        version = self.backend.version
+        if self._version_lexico != version:
+            with self._lock:
+                if self._version_lexico != version:
+                    fragmentos = self.backend.fragmentos()
+                    self._lexico = IndiceLexico(fragmentos) if fragmentos is not None else None
+                    self._version_lexico = version
+        return self._lexico
+
+    @property
+    def reranker(self):
+        if self._reranker is None and CHATBOT_RERANKER:
+            with self._lock:
+                if self._reranker is None:
+                    from sentence_transformers import CrossEncoder
+                    self._reranker = CrossEncoder(CHATBOT_RERANKER, device="cpu")
+        return self._reranker
+
+    @staticmethod
+    def _fusionar(densos: list, lexicos: list):
+        from langchain_core.documents import Document as LangDocument
+
+        candidatos = {} # (source, texto) -> [documento, puntaje]
+        for rango, doc in enumerate(densos):
+            clave = (doc.metadata.get("source"), doc.page_content)
+            candidatos.setdefault(clave, [doc, 0.0])[1] += 1 / (RRF_K + rango + 1)
+        for rango, (m, puntaje) in enumerate(lexicos):
+            clave = (m["source"], m["texto"])
+            if clave not in candidatos:
+                candidatos[clave] = [LangDocument(page_content=m["texto"], metadata={"source": m["source"]}), 0.0]
+            candidatos[clave][0].metadata["bm25"] = round(puntaje, 3)
+            candidatos[clave][1] += 1 / (RRF_K + rango + 1)
+
+        ordenados = sorted(candidatos.values(), key=lambda x: -x[1])
+        for doc, puntaje in ordenados:
+            doc.metadata["rrf"] = round(puntaje, 5)
+        return [doc for doc, _ in ordenados]
+
+    @staticmethod
+    def _recortar(documentos: list, presupuesto: int):
+        seleccion, usados = [], 0
+        for doc in documentos:
+            tokens = estimar_tokens(doc.page_content)
+            if seleccion and usados + tokens > presupuesto:
+                continue # Puede entrar uno más corto de menor rango
+            seleccion.append(doc)
+            usados += tokens
+        return seleccion, usados
+
+    def buscar(self, pregunta: str, fuente: str = None, presupuesto: int = CHATBOT_CONTEXTO_TOKENS):
+        """Devuelve (documentos para el contexto, tiempos por etapa en ms)."""
+        tiempos = {}
+        inicio = time.perf_counter()
+        densos = self.backend.buscar(pregunta, CHATBOT_K_DENSO, fuente)
+        tiempos["denso_ms"] = (time.perf_counter() - inicio) * 1000
+
+        inicio = time.perf_counter()
+        lexico = self._indice_lexico()
+        lexicos = lexico.buscar(pregunta, CHATBOT_K_LEXICO, fuente) if lexico else []
+        tiempos["lexico_ms"] = (time.perf_counter() - inicio) * 1000
+
+        inicio = time.perf_counter()
+        candidatos = self._fusionar(densos, lexicos)[:CHATBOT_RERANK_CANDIDATOS]
+        if self.reranker is not None and len(candidatos) > 1:
+            puntajes = self.reranker.predict([(pregunta, d.page_content) for d in candidatos])
+            candidatos = [d for _, d in sorted(zip(puntajes, candidatos), key=lambda x: -x[0])]
+        tiempos["rerank_ms"] = (time.perf_counter() - inicio) * 1000
+
+        inicio = time.perf_counter()
+        seleccion, tokens = self._recortar(candidatos, presupuesto)
+        tiempos["recorte_ms"] = (time.perf_counter() - inicio) * 1000
+        tiempos["contexto_tokens"] = tokens
+        return seleccion, tiempos
+
+
+# Instancia única para ser importada en otros archivos
+tiempos_chatbot = TiemposEtapas()
@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+from .cache import EmbeddingsCacheados, AlmacenEmbeddings
+from .concurrencia import limitador_chatbot
+
+
+CHATBOT_MODELO_EMBEDDINGS = os.getenv("CHATBOT_MODELO_EMBEDDINGS", "sentence-transformers/all-MiniLM-L6-v2")
+# Tamaño de lote interno de sentence-transformers al embeber fragmentos
+CHATBOT_LOTE_ENCODER = int(os.getenv("CHATBOT_LOTE_ENCODER", "32"))
+# '1' carga el modelo y el cliente de Gemini al arrancar el worker, en segundo plano
+CHATBOT_PRECALENTAR = os.getenv("CHATBOT_PRECALENTAR", "0") == "1"
+
+
+class RecursosChatbot:
+    """
+    Dependencias pesadas del chatbot (sentence-transformers, cliente de Gemini,
+    backend vectorial), creadas en el primer uso y no al importar el router:
+    un worker que nunca recibe una pregunta no paga ni el tiempo ni la RAM del modelo.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._embeddings = None
+        self._cliente = None
+        self._backend = None
+        self._recuperador = None
+        self.tiempos_carga_ms = {}
+
+    def _medir(self, nombre: str, inicio: float):
+        self.tiempos_carga_ms[nombre] = round((time.perf_counter() - inicio) * 1000, 1)
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    inicio = time.perf_counter()
+                    from langchain_huggingface import HuggingFaceEmbeddings
+                    from .vectorstore import CHATBOT_INDEX_DIR
+                    # Las preguntas repetidas no se vuelven a embeber (LRU por pregunta normalizada)
+                    # ni los fragmentos ya vistos (almacén por hash de contenido)
+                    self._embeddings = EmbeddingsCacheados(
+                        HuggingFaceEmbeddings(
+                            model_name=CHATBOT_MODELO_EMBEDDINGS,
+                            model_kwargs={'device': 'cpu'},
+                            encode_kwargs={'batch_size': CHATBOT_LOTE_ENCODER}
+                        ),
+                        almacen=AlmacenEmbeddings(
+                            os.path.join(CHATBOT_INDEX_DIR, "embeddings.sqlite"), CHATBOT_MODELO_EMBEDDINGS
+                        )
+                    )
+                    self._medir("embeddings", inicio)
+        return self._embeddings
+
+    @property
+    def cliente(self):
+        if self._cliente is None:
+            with self._lock:
+                if self._cliente is None:
+                    inicio = time.perf_counter()
+                    from .modelo import CHATBOT_LLM, ClienteFalso
+                    if CHATBOT_LLM == "falso":
+                        self._cliente = ClienteFalso()
+                    else:
+                        from google import genai
+                        self._cliente = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+                    self._medir("cliente_gemini", inicio)
+        return self._cliente
+
+    @property
+    def backend(self):
+        # Backend de recuperación (CHATBOT_VECTOR_BACKEND=local|pinecone), uno por proceso
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    embeddings = self.embeddings
+                    inicio = time.perf_counter()
+                    from .vectorstore import crear_backend
+                    self._backend = crear_backend(embeddings)
+                    self._medir("backend", inicio)
+        return self._backend
+
+    @property
+    def recuperador(self):
+        if self._recuperador is None:
+            with self._lock:
+                if self._recuperador is None:
+                    from .recuperacion import RecuperadorHibrido
+                    self._recuperador = RecuperadorHibrido(self.backend)
+        return self._recuperador
+
+    # Para los endpoints async: la primera carga (segundos) va al pool, no al event loop
+    async def obtener_backend(self):
+        return self._backend if self._backend is not None else await limitador_chatbot.en_pool(lambda: self.backend)
+
+    async def obtener_recuperador(self):
+        return self._recuperador if self._recuperador is not None else await limitador_chatbot.en_pool(lambda: self.recuperador)
+
+    async def obtener_cliente(self):
+        return self._cliente if self._cliente is not None else await limitador_chatbot.en_pool(lambda: self.cliente)
+
+    def cargados(self):
+        return {
+            "embeddings": self._embeddings is not None,
+            "cliente_gemini": self._cliente is not None,
+            "backend": self._backend is not None,
+            "tiempos_carga_ms": dict(self.tiempos_carga_ms)
+        }
+
+    def precalentar(self):
+        """Carga todo y hace una inferencia de prueba (los pesos se leen en la primera)."""
+        inicio = time.perf_counter()
+        self.cliente
+        self.backend
+        self.embeddings.base.embed_query("precalentamiento")
+        self._medir("precalentamiento", inicio)
+
+    async def precalentar_en_segundo_plano(self):
+        try:
+            await limitador_chatbot.en_pool(self.precalentar)
+            print(f"🤖 Chatbot precalentado en {self.tiempos_carga_ms['precalentamiento']} ms")
+        except Exception as e:
+            print(f"❌ No se pudo precalentar el chatbot: {e}")
+
+
+# Instancia única para ser importada en otros archivos
+recursos_chatbot = RecursosChatbot()
@@ -2,26 +2,25 @@ import os
 from dotenv import load_dotenv
 from fastapi import APIRouter, Depends, UploadFile, File,Form, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from google import genai
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from docx import Document as DocxDocument  
-from langchain_core.documents import Document as LangDocument
-from typing import List
+from typing import List, Optional
 from datetime import datetime
-from docx import Document as DocxDocument
-from docx.table import Table
-from docx.text.paragraph import Paragraph
 import os
+import json
+import time
 import uuid
 import shutil
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from app.db.database import get_db
-from .models import Chatbot
-from .schemas import ChatbotResponse
+from app.db.database import get_db, SessionLocal
+from .models import Chatbot, ChatbotVersion
+from .schemas import ChatbotResponse, ChatbotVersionResponse, IngestaEstadoResponse
+from .service import ExtraccionService
+from .cache import respuestas_cache
+from .concurrencia import limitador_chatbot, ChatbotOcupado
+from .ingesta import ColaIngesta, TrabajoIngesta, ESTADO_EN_COLA, ESTADO_ENTRENADO, ESTADO_PROCESANDO, ESTADO_ACTUALIZANDO
+from .recursos import recursos_chatbot
+from .recuperacion import tiempos_chatbot
 
 load_dotenv()
 
@@ -37,24 +36,16 @@ MAX_FILE_SIZE_MB = 10
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 ALLOWED_EXTENSIONS = {".pdf", ".docx", ".doc"}
 MAX_DOCUMENTS = 5
+BLOQUE_SUBIDA_BYTES = 1024 * 1024
 
 
-# Configuracion
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-INDEX_NAME = os.getenv("INDEX_NAME", "colegio-knowledge")
-
-# Aplicar al entorno para que LangChain lo detecte automáticamente
-os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
-
 router = APIRouter(prefix="/chatbot", tags=["Chatbot"])
 
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2",
-    model_kwargs={'device': 'cpu'}
-)
+# El modelo de embeddings, el cliente de Gemini y el backend vectorial se crean
+# en el primer uso (recursos_chatbot), no al importar este módulo.
 
-client = genai.Client(api_key=GOOGLE_API_KEY)
+# Instancia única para ser importada en otros archivos
+cola_ingesta = ColaIngesta(lambda: recursos_chatbot.backend)
 
 # --- ENDPOINTS DE CONSULTA Y GESTIÓN ---
 
@@ -77,156 +68,358 @@ def delete_document(doc_id: int, db: Session = Depends(get_db)):
     
 
     try:
-        # 2. ELIMINAR DE PINECONE
-        # Inicializamos el acceso al vectorstore
-        vectorstore = PineconeVectorStore(
-            index_name=INDEX_NAME, 
-            embedding=embeddings
-        )
-        
+        # 2. ELIMINAR DEL ÍNDICE VECTORIAL
         # Borramos todos los vectores que tengan el metadato 'source' igual al nombre del archivo
-        # Importante: Pinecone permite borrar por filtro en planes pagados. 
-        # Si usas el plan gratuito (Starter), LangChain lo maneja internamente.
-        vectorstore.delete(filter={"source": doc.filename})
+        recursos_chatbot.backend.eliminar(doc.filename)
 
-        # 3. ELIMINAR ARCHIVO FÍSICO
+        # 3. ELIMINAR ARCHIVO FÍSICO (y los de sus versiones anteriores)
         if os.path.exists(doc.file_path):
             os.remove(doc.file_path)
+        if doc.archivo_pendiente and os.path.exists(doc.archivo_pendiente):
+            os.remove(doc.archivo_pendiente)
+        for version in db.query(ChatbotVersion).filter(ChatbotVersion.id_chatbot == doc.id).all():
+            if os.path.exists(version.file_path):
+                os.remove(version.file_path)
+            db.delete(version)
         
         # 4. ELIMINAR DE SQL
         db.delete(doc)
         db.commit()
+        respuestas_cache.invalidar()
 
         return {"message": f"'{doc.filename}' Eliminado correctamente."}
 
     except Exception as e:
-        # Si algo falla en la conexión con Pinecone, lanzamos el error
+        # Si algo falla al borrar del índice, lanzamos el error
         raise HTTPException(
             status_code=500, 
             detail=f"Error al eliminar el conocimiento: {str(e)}"
         )
 
+@router.post("/reindex")
+def reindex_documents(db: Session = Depends(get_db)):
+    """
+    Vuelve a indexar en el backend actual los archivos ya subidos
+    (por ejemplo, al pasar de Pinecone al índice local). Solo se embeben y
+    escriben los fragmentos nuevos o cambiados; los demás se reutilizan.
+    Los documentos que están en la cola de ingesta se omiten.
+    """
+    vector_backend = recursos_chatbot.backend
+    resumen = []
+    for doc in db.query(Chatbot).all():
+        if doc.status in (ESTADO_EN_COLA, ESTADO_PROCESANDO, ESTADO_ACTUALIZANDO):
+            # Lo tiene un trabajo de la cola: resincronizar acá pisaría su versión y su estado
+            resumen.append({"id": doc.id, "filename": doc.filename, "status": "omitido: " + doc.status})
+            continue
+        if not os.path.exists(doc.file_path):
+            resumen.append({"id": doc.id, "filename": doc.filename, "status": "archivo no encontrado"})
+            continue
+        _, paginas = ExtraccionService.paginas(doc.file_path, f".{doc.file_type}")
+        fragmentos = ExtraccionService.fragmentos_en_flujo(paginas, doc.filename) if paginas else []
+
+        cambios = vector_backend.sincronizar(doc.filename, fragmentos)
+        doc.total_chunks = cambios["total"]
+        doc.pinecone_index = vector_backend.nombre
+        doc.status = ESTADO_ENTRENADO
+        doc.progreso = 100
+        doc.detalle = None
+        resumen.append({"id": doc.id, "filename": doc.filename, "status": "reindexado", "chunks": cambios["total"], **cambios})
+    db.commit()
+    respuestas_cache.invalidar()
+    return {"backend": vector_backend.nombre, "documentos": resumen}
+
 # --- ENDPOINT DE SUBIDA Y ENTRENAMIENTO ---
 
-@router.post("/upload")
-async def upload(file: UploadFile = File(...), db: Session = Depends(get_db)):
+@router.post("/upload", status_code=status.HTTP_202_ACCEPTED)
+async def upload(file: UploadFile = File(...), id_usuario: Optional[int] = Form(None), db: Session = Depends(get_db)):
+    """
+    Guarda el archivo y lo deja en la cola de ingesta; responde de inmediato con el id.
+    El progreso se consulta en /chatbot/ingestas/{id} o llega por WebSocket a 'id_usuario'.
+    """
+    # La Session es síncrona: sus consultas y commits van al threadpool, no al event loop
     # 1. Validación de cantidad
-    count = db.query(Chatbot).count()
+    count = await run_in_threadpool(db.query(Chatbot).count)
     if count >= MAX_DOCUMENTS:
         raise HTTPException(status_code=400, detail=f"Límite de {MAX_DOCUMENTS} archivos alcanzado.")
     
-    # 2. Validación de extensión (Usando la variable que definiste arriba)
+    file_ext, unique_name, temp_path = await _recibir_archivo(file)
+
+    new_record = Chatbot(
+        filename=file.filename,
+        unique_filename=unique_name,
+        file_path=temp_path,
+        file_type=file_ext.replace(".", ""),
+        total_chunks=0,
+        status=ESTADO_EN_COLA,
+        progreso=0
+    )
+
+    def crear_registro():
+        db.add(new_record)
+        db.commit()
+        db.refresh(new_record)
+
+    await run_in_threadpool(crear_registro)
+
+    try:
+        posicion = cola_ingesta.encolar(TrabajoIngesta(
+            new_record.id, temp_path, file_ext, file.filename, db.get_bind(), id_usuario
+        ))
+    except ChatbotOcupado:
+        def descartar_registro():
+            db.delete(new_record)
+            db.commit()
+
+        await run_in_threadpool(descartar_registro)
+        if os.path.exists(temp_path): os.remove(temp_path)
+        raise HTTPException(status_code=503, detail="Hay demasiados archivos en proceso, intenta en unos minutos.")
+
+    return {
+        "message": f"'{file.filename}' recibido, se está procesando.",
+        "id": new_record.id,
+        "status": ESTADO_EN_COLA,
+        "posicion": posicion
+    }
+
+async def _recibir_archivo(file: UploadFile):
+    """Valida extensión y peso y guarda el archivo en UPLOAD_DIR; devuelve (extensión, nombre único, ruta)."""
+    # Validación de extensión
     file_ext = os.path.splitext(file.filename)[1].lower()
     if file_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Formato no soportado. Usa PDF o DOCX.")
 
-    # 3. Validación de peso (Backend)
-    # Leemos el contenido UNA SOLA VEZ
-    content = await file.read()
-    file_size = len(content)
+    # Validación de peso (Backend)
+    # Si el cliente mandó el tamaño, rechazamos antes de leer nada
+    if file.size is not None and file.size > MAX_FILE_SIZE_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"El archivo excede el límite de {MAX_FILE_SIZE_MB}MB."
+        )
+
+    unique_name = f"{uuid.uuid4().hex[:8]}_{file.filename}"
+    temp_path = os.path.join(UPLOAD_DIR, unique_name)
+    # Copiamos a disco por bloques, controlando el peso mientras llega:
+    # nunca hay más de un bloque del archivo en memoria
+    file_size = await _guardar_por_bloques(file, temp_path)
 
     if file_size > MAX_FILE_SIZE_BYTES:
+        os.remove(temp_path)
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail=f"El archivo excede el límite de {MAX_FILE_SIZE_MB}MB."
         )
     
     if file_size == 0:
+        os.remove(temp_path)
         raise HTTPException(status_code=400, detail="El archivo está vacío.")
-    
-    unique_name = f"{uuid.uuid4().hex[:8]}_{file.filename}"
-    temp_path = os.path.join(UPLOAD_DIR, unique_name)
-    try:
-        # 1. Guardar el archivo físicamente para que docx pueda leerlo
-        with open(temp_path, "wb") as f:
-            f.write(content)
-        
-        full_content = []
-
-        if file.filename.lower().endswith((".docx", ".doc")):
-            doc_file = DocxDocument(temp_path)
-            
-            # 2. Extracción secuencial (Párrafos y Tablas en orden)
-            for element in doc_file.element.body:
-                if element.tag.endswith('p'):
-                    para = Paragraph(element, doc_file)
-                    if para.text.strip():
-                        full_content.append(para.text)
-                
-                elif element.tag.endswith('tbl'):
-                    table = Table(element, doc_file)
-                    # Formateamos la tabla como texto estructurado (Markdown-ish)
-                    table_rows = []
-                    for row in table.rows:
-                        cells = [cell.text.strip().replace("\n", " ") for cell in row.cells]
-                        table_rows.append(f"| {' | '.join(cells)} |")
-                    
-                    # Agregamos un identificador claro para la IA
-                    tabla_texto = "\n[TABLA DETECTADA]\n" + "\n".join(table_rows) + "\n"
-                    full_content.append(tabla_texto)
-            
-            text_to_process = "\n\n".join(full_content)
-        
-        elif file.filename.lower().endswith(".pdf"):
-            loader = PyPDFLoader(temp_path)
-            pdf_docs = loader.load()
-            text_to_process = "\n\n".join([d.page_content for d in pdf_docs])
-        else:
-            os.remove(temp_path)
-            return {"message": "Formato no soportado."}
-
-        if not text_to_process.strip():
-            if os.path.exists(temp_path): os.remove(temp_path)
-            raise HTTPException(status_code=400, detail="El archivo no contiene texto legible (puede que sea una imagen o esté protegido).")
-
-        # 3. Creación de Documentos de LangChain
-        doc_obj = LangDocument(page_content=text_to_process, metadata={"source": file.filename})
-
-        # 4. Chunking Estratégico
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1200, 
-            chunk_overlap=300,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
-        final_docs = text_splitter.split_documents([doc_obj])
-
-        # 5. Subida Garantizada a Pinecone
-        if final_docs:
-            # Forzamos la inicialización del vectorstore con los documentos
-            vectorstore = PineconeVectorStore.from_documents(
-                documents=final_docs,
-                embedding=embeddings,
-                index_name=INDEX_NAME
-            )
-            clean_ext = file_ext.replace(".", "")
-            new_record = Chatbot(
-                filename=file.filename,
-                unique_filename=unique_name,
-                file_path=temp_path,
-                file_type=clean_ext,
-                pinecone_index=INDEX_NAME,
-                total_chunks=len(final_docs),
-                status="entrenado"
-            )
-            db.add(new_record)
-            db.commit()
-            return {"message": f"'{file.filename}' indexado con {len(final_docs)} fragmentos."}
-        else:
-            if os.path.exists(temp_path): os.remove(temp_path)
-            return {"message": "No se extrajo contenido del archivo."}
 
-    except Exception as e:
+    return file_ext, unique_name, temp_path
+
+async def _guardar_por_bloques(file: UploadFile, ruta: str):
+    """Devuelve los bytes escritos; corta apenas se pasa de MAX_FILE_SIZE_BYTES."""
+    escritos = 0
+    with open(ruta, "wb") as f:
+        while True:
+            bloque = await file.read(BLOQUE_SUBIDA_BYTES)
+            if not bloque:
+                break
+            escritos += len(bloque)
+            if escritos > MAX_FILE_SIZE_BYTES:
+                break
+            # Escritura a disco en el threadpool de FastAPI: el pool de CPU queda para embeddings y preguntas
+            await run_in_threadpool(f.write, bloque)
+    return escritos
+
+@router.get("/ingestas/{doc_id}", response_model=IngestaEstadoResponse)
+def estado_ingesta(doc_id: int, db: Session = Depends(get_db)):
+    doc = db.query(Chatbot).filter(Chatbot.id == doc_id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Documento no encontrado.")
+    return doc
+
+@router.put("/documents/{doc_id}", status_code=status.HTTP_202_ACCEPTED)
+async def replace_document(doc_id: int, file: UploadFile = File(...), id_usuario: Optional[int] = Form(None), db: Session = Depends(get_db)):
+    """
+    Reemplaza el archivo de un documento (p. ej. la tabla de pensiones de cada mes).
+    Solo se embeben los fragmentos nuevos y el índice cambia de una vez al final:
+    mientras tanto el chatbot sigue respondiendo con la versión anterior.
+    La versión anterior queda en /chatbot/documents/{id}/versiones.
+    """
+    # La Session es síncrona: sus consultas y commits van al threadpool, no al event loop
+    doc = await run_in_threadpool(lambda: db.query(Chatbot).filter(Chatbot.id == doc_id).first())
+    if not doc:
+        raise HTTPException(status_code=404, detail="Documento no encontrado.")
+    if doc.status in (ESTADO_EN_COLA, ESTADO_PROCESANDO, ESTADO_ACTUALIZANDO):
+        raise HTTPException(status_code=409, detail="El documento todavía se está procesando.")
+
+    file_ext, unique_name, temp_path = await _recibir_archivo(file)
+
+    # Después del commit los atributos expiran y leerlos consultaría la base desde el event loop
+    filename = doc.filename
+    estado_anterior = (doc.status, doc.progreso, doc.detalle, None)
+
+    def marcar(estado, progreso, detalle, archivo_pendiente):
+        doc.status, doc.progreso, doc.detalle = estado, progreso, detalle
+        # Queda en la fila para que, si el trabajo se pierde, la restauración borre el archivo
+        doc.archivo_pendiente = archivo_pendiente
+        db.commit()
+
+    await run_in_threadpool(marcar, ESTADO_ACTUALIZANDO, 0, f"Nueva versión en cola: {file.filename}"[:255], temp_path)
+
+    try:
+        posicion = cola_ingesta.encolar(TrabajoIngesta(
+            doc_id, temp_path, file_ext, filename, db.get_bind(), id_usuario, reemplazo=True
+        ))
+    except ChatbotOcupado:
+        await run_in_threadpool(marcar, *estado_anterior)
         if os.path.exists(temp_path): os.remove(temp_path)
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=503, detail="Hay demasiados archivos en proceso, intenta en unos minutos.")
+
+    return {
+        "message": f"Nueva versión de '{filename}' recibida, se está procesando.",
+        "id": doc_id,
+        "status": ESTADO_ACTUALIZANDO,
+        "posicion": posicion
+    }
+
+@router.get("/documents/{doc_id}/versiones", response_model=List[ChatbotVersionResponse])
+def get_versions(doc_id: int, db: Session = Depends(get_db)):
+    if not db.query(Chatbot.id).filter(Chatbot.id == doc_id).first():
+        raise HTTPException(status_code=404, detail="Documento no encontrado.")
+    return db.query(ChatbotVersion).filter(ChatbotVersion.id_chatbot == doc_id)\
+        .order_by(ChatbotVersion.version.desc()).all()
 
 # --- ENDPOINT DE PREGUNTA (RAG) ---
 
+@router.get("/cache/stats")
+def cache_stats():
+    """Tasa de aciertos de las cachés de embeddings de preguntas y de respuestas."""
+    # No fuerza la carga del modelo si todavía nadie preguntó
+    cargados = recursos_chatbot.cargados()
+    return {
+        "embeddings": recursos_chatbot.embeddings.stats() if cargados["embeddings"] else None,
+        "respuestas": respuestas_cache.stats(),
+        "version_corpus": recursos_chatbot.backend.version if cargados["backend"] else None
+    }
+
+@router.get("/metricas")
+def metricas_chatbot():
+    """Peticiones en curso y en espera, y tiempo en cola de preguntas, ingestas y del pool de CPU."""
+    return {
+        **limitador_chatbot.metricas(),
+        "ingesta": cola_ingesta.metricas(),
+        "etapas_pregunta": tiempos_chatbot.como_dict(),
+        "recursos": recursos_chatbot.cargados()
+    }
+
+INDICE_EN_CONSTRUCCION = "El chatbot está indexando los documentos, intenta en unos minutos."
+
 @router.post("/ask")
-async def ask(question: str = Form(...)):
-    vectorstore = PineconeVectorStore(index_name=INDEX_NAME, embedding=embeddings)
+async def ask(question: str = Form(...), source: Optional[str] = Form(None)):
+    if await _corpus_sin_indexar():
+        raise HTTPException(status_code=503, detail=INDICE_EN_CONSTRUCCION)
+    # La misma pregunta, sobre el mismo corpus y el mismo día, ya tiene respuesta
+    clave_cache = await _clave_cache(question, source)
+    respuesta_cacheada = respuestas_cache.obtener(clave_cache)
+    if respuesta_cacheada is not None:
+        return {"answer": respuesta_cacheada}
+
+    try:
+        async with limitador_chatbot.turno("preguntas"):
+            return await _responder(question, source, clave_cache)
+    except ChatbotOcupado:
+        raise HTTPException(status_code=503, detail="El chatbot está atendiendo muchas consultas, intenta en un momento.")
+
+@router.post("/ask/stream")
+async def ask_stream(question: str = Form(...), source: Optional[str] = Form(None)):
+    """
+    Igual que /ask pero en Server-Sent Events: manda los trozos de la respuesta
+    a medida que Gemini los genera. Eventos (data JSON):
+      {"tipo": "token", "texto": "..."}  varias veces
+      {"tipo": "fin", "tiempos_ms": {...}}  al terminar
+      {"tipo": "error", "detalle": "..."}  si algo falla
+    """
+    inicio = time.perf_counter()
+    sin_indexar = await _corpus_sin_indexar()
+    clave_cache = await _clave_cache(question, source)
+    respuesta_cacheada = respuestas_cache.obtener(clave_cache)
+
+    async def eventos():
+        if sin_indexar:
+            yield _evento_sse({"tipo": "error", "detalle": INDICE_EN_CONSTRUCCION})
+            return
+        if respuesta_cacheada is not None:
+            yield _evento_sse({"tipo": "token", "texto": respuesta_cacheada})
+            yield _evento_sse({"tipo": "fin", "cache": True})
+            return
+        try:
+            async with limitador_chatbot.turno("preguntas"):
+                prompt, tiempos = await _preparar_prompt(question, source)
+                client = await recursos_chatbot.obtener_cliente()
+                inicio_llm = time.perf_counter()
+                partes = []
+                trozos = await client.aio.models.generate_content_stream(
+                    model="gemini-2.5-flash-lite",
+                    contents=prompt
+                )
+                async for trozo in trozos:
+                    if not trozo.text:
+                        continue
+                    if not partes:
+                        # Lo que el padre percibe como velocidad: desde que preguntó hasta la primera palabra
+                        tiempos["primer_token_ms"] = (time.perf_counter() - inicio) * 1000
+                    partes.append(trozo.text)
+                    yield _evento_sse({"tipo": "token", "texto": trozo.text})
+
+                tiempos["llm_ms"] = (time.perf_counter() - inicio_llm) * 1000
+                tiempos_chatbot.registrar(tiempos)
+                respuestas_cache.guardar(clave_cache, "".join(partes))
+                yield _evento_sse({"tipo": "fin", "tiempos_ms": {etapa: round(valor, 1) for etapa, valor in tiempos.items()}})
+        except ChatbotOcupado:
+            yield _evento_sse({"tipo": "error", "detalle": "El chatbot está atendiendo muchas consultas, intenta en un momento."})
+        except Exception:
+            yield _evento_sse({"tipo": "error", "detalle": "Error técnico, intenta de nuevo 🍎"})
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Sin buffer en el proxy
+    )
+
+def _evento_sse(data: dict):
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _corpus_sin_indexar():
+    """
+    True si el índice está vacío pero hay documentos entrenados (p. ej. índice local
+    recién creado que se está llenando): responder 'no tengo esa información' sería falso.
+    """
+    vector_backend = await recursos_chatbot.obtener_backend()
+
+    def consultar():
+        if not vector_backend.vacio():
+            return False
+        db = SessionLocal()
+        try:
+            return db.query(Chatbot.id).filter(Chatbot.status == ESTADO_ENTRENADO).first() is not None
+        finally:
+            db.close()
+
+    return await limitador_chatbot.en_pool(consultar)
+
+async def _clave_cache(question: str, source: Optional[str]):
+    vector_backend = await recursos_chatbot.obtener_backend()
+    # Leer la versión puede recargar el índice (escritura de otro worker) o esperar su lock: va al pool
+    version = await limitador_chatbot.en_pool(lambda: vector_backend.version)
+    return respuestas_cache.clave(question, source, version)
+
+async def _preparar_prompt(question: str, source: Optional[str]):
     hoy = datetime.now().strftime("%d de %B de %Y")
-    # --- MEJORA 3: BÚSQUEDA PROFUNDA (k=20) ---
-    docs = vectorstore.similarity_search(question, k=20)
+    # --- MEJORA 3: BÚSQUEDA HÍBRIDA (densa + BM25, rerank y tope de tokens) ---
+    # 'source' opcional: limita la búsqueda a un solo documento.
+    # El embedding de la pregunta y la búsqueda usan CPU: van al pool, no al event loop
+    recuperador = await recursos_chatbot.obtener_recuperador()
+    docs, tiempos = await limitador_chatbot.en_pool(recuperador.buscar, question, source)
     contexto = "\n\n".join([f"FUENTE: {d.metadata.get('source')}\nCONTENIDO: {d.page_content}" for d in docs])
     
     # --- MEJORA 4: PROMPT ULTRA-ESTRICTO ---
@@ -248,12 +441,22 @@ async def ask(question: str = Form(...)):
 
     PREGUNTA DEL USUARIO: {question}
     """
+    return prompt, tiempos
+
+async def _responder(question: str, source: Optional[str], clave_cache: tuple):
+    prompt, tiempos = await _preparar_prompt(question, source)
 
     try:
-        response = client.models.generate_content(
+        # Cliente asíncrono: la espera a Gemini no ocupa el event loop ni un hilo
+        client = await recursos_chatbot.obtener_cliente()
+        inicio = time.perf_counter()
+        response = await client.aio.models.generate_content(
             model="gemini-2.5-flash-lite", # O usa gemini-1.5-pro si buscas máxima precisión
             contents=prompt
         )
-        return {"answer": response.text}
+        tiempos["llm_ms"] = (time.perf_counter() - inicio) * 1000
+        tiempos_chatbot.registrar(tiempos)
+        respuestas_cache.guardar(clave_cache, response.text)
+        return {"answer": response.text, "tiempos_ms": {etapa: round(valor, 1) for etapa, valor in tiempos.items()}}
     except Exception as e:
         return {"answer": "Error técnico, intenta de nuevo 🍎"}
\ No newline at end of file
@@ -8,6 +8,32 @@ class ChatbotResponse(BaseModel):
     file_type: str
     status: str
     total_chunks: int
+    progreso: Optional[int] = 0
+    detalle: Optional[str] = None
+    version: Optional[int] = 1
     fecha_creacion: datetime
 
+    model_config = ConfigDict(from_attributes=True)
+
+class ChatbotVersionResponse(BaseModel):
+    id: int
+    version: int
+    archivo_original: Optional[str] = None
+    file_type: Optional[str] = None
+    total_chunks: Optional[int] = 0
+    fragmentos_agregados: Optional[int] = None
+    fragmentos_eliminados: Optional[int] = None
+    fecha_creacion: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class IngestaEstadoResponse(BaseModel):
+    id: int
+    filename: str
+    status: str
+    progreso: Optional[int] = 0
+    detalle: Optional[str] = None
+    total_chunks: int
+    version: Optional[int] = 1
+
     model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
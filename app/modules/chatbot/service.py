@@ -0,0 +1,144 @@
+import os
+import threading
+import multiprocessing
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+# Los imports de docx, pypdf y langchain van dentro de cada método: solo se cargan
+# cuando llega el primer archivo, no al arrancar el servidor.
+
+# Procesos para extraer páginas de PDF en paralelo (0 o 1 = en el mismo hilo)
+CHATBOT_PROCESOS_PDF = int(os.getenv("CHATBOT_PROCESOS_PDF", str(os.cpu_count() or 1)))
+PAGINAS_POR_TAREA = 8 # Páginas que extrae cada tarea del pool; un PDF más corto no usa el pool
+
+TAMANO_FRAGMENTO = 1200
+SOLAPAMIENTO_FRAGMENTO = 300
+SEPARADORES = ["\n\n", "\n", ". ", " ", ""]
+
+_pool_pdf = None
+_lock_pool_pdf = threading.Lock()
+
+
+def _pool_procesos():
+    global _pool_pdf
+    if _pool_pdf is None:
+        with _lock_pool_pdf:
+            if _pool_pdf is None:
+                # 'spawn': no copiamos al hijo un proceso con hilos y el modelo de embeddings cargado
+                _pool_pdf = ProcessPoolExecutor(
+                    max_workers=CHATBOT_PROCESOS_PDF,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pool_pdf
+
+
+def _extraer_paginas_pdf(ruta: str, inicio: int, fin: int):
+    """Corre en un proceso del pool: cada uno abre el PDF y extrae su rango de páginas."""
+    from pypdf import PdfReader
+    lector = PdfReader(ruta)
+    return [lector.pages[i].extract_text() or "" for i in range(inicio, fin)]
+
+
+def _divisor():
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=TAMANO_FRAGMENTO,
+        chunk_overlap=SOLAPAMIENTO_FRAGMENTO,
+        separators=SEPARADORES
+    )
+
+
+class ExtraccionService:
+    @staticmethod
+    def bloques_docx(ruta: str):
+        """Párrafos y tablas de Word en orden; las tablas en formato | a | b |."""
+        from docx import Document as DocxDocument
+        from docx.table import Table
+        from docx.text.paragraph import Paragraph
+
+        doc_file = DocxDocument(ruta)
+
+        # Extracción secuencial (Párrafos y Tablas en orden)
+        for element in doc_file.element.body:
+            if element.tag.endswith('p'):
+                para = Paragraph(element, doc_file)
+                if para.text.strip():
+                    yield para.text
+
+            elif element.tag.endswith('tbl'):
+                table = Table(element, doc_file)
+                # Formateamos la tabla como texto estructurado (Markdown-ish)
+                table_rows = []
+                for row in table.rows:
+                    cells = [cell.text.strip().replace("\n", " ") for cell in row.cells]
+                    table_rows.append(f"| {' | '.join(cells)} |")
+
+                # Agregamos un identificador claro para la IA
+                yield "\n[TABLA DETECTADA]\n" + "\n".join(table_rows) + "\n"
+
+    @staticmethod
+    def paginas(ruta: str, extension: str):
+        """
+        Devuelve (total, iterador de textos): páginas del PDF o bloques del DOCX, en orden.
+        Las páginas de un PDF largo se extraen en el pool de procesos por rangos, y el
+        iterador entrega cada rango apenas está listo, sin esperar al resto.
+        """
+        if extension in (".docx", ".doc"):
+            bloques = list(ExtraccionService.bloques_docx(ruta))
+            return len(bloques), iter(bloques)
+
+        if extension == ".pdf":
+            from pypdf import PdfReader
+            total = len(PdfReader(ruta).pages)
+            if total <= PAGINAS_POR_TAREA or CHATBOT_PROCESOS_PDF <= 1:
+                return total, iter(_extraer_paginas_pdf(ruta, 0, total))
+
+            inicios = list(range(0, total, PAGINAS_POR_TAREA))
+            fines = [min(i + PAGINAS_POR_TAREA, total) for i in inicios]
+            rangos = _pool_procesos().map(_extraer_paginas_pdf, repeat(ruta), inicios, fines)
+            return total, (pagina for rango in rangos for pagina in rango)
+
+        return 0, None
+
+    @staticmethod
+    def extraer_texto(ruta: str, extension: str):
+        """Texto plano del archivo (PDF o DOCX); las tablas de Word se conservan en formato | a | b |."""
+        _, paginas = ExtraccionService.paginas(ruta, extension)
+        if paginas is None:
+            return None
+        return "\n\n".join(paginas)
+
+    @staticmethod
+    def dividir_en_fragmentos(texto: str, fuente: str):
+        """Chunking estratégico con el nombre del archivo como metadato 'source'."""
+        from langchain_core.documents import Document as LangDocument
+
+        doc_obj = LangDocument(page_content=texto, metadata={"source": fuente})
+        return _divisor().split_documents([doc_obj])
+
+    @staticmethod
+    def fragmentos_en_flujo(paginas, fuente: str):
+        """
+        Mismo chunking que dividir_en_fragmentos, pero a medida que llegan las páginas:
+        cuando el texto acumulado alcanza para varios fragmentos se entregan todos menos
+        el último, que se queda como comienzo del siguiente tramo (no se corta en la
+        frontera entre páginas). Así los embeddings empiezan antes de terminar la extracción.
+        """
+        from langchain_core.documents import Document as LangDocument
+
+        divisor = _divisor()
+        pendiente = ""
+        for texto in paginas:
+            if not texto or not texto.strip():
+                continue
+            pendiente = f"{pendiente}\n\n{texto}" if pendiente else texto
+            if len(pendiente) < 4 * TAMANO_FRAGMENTO:
+                continue
+            trozos = divisor.split_text(pendiente)
+            for trozo in trozos[:-1]:
+                yield LangDocument(page_content=trozo, metadata={"source": fuente})
+            pendiente = trozos[-1]
+
+        if pendiente.strip():
+            for trozo in divisor.split_text(pendiente):
+                yield LangDocument(page_content=trozo, metadata={"source": fuente})
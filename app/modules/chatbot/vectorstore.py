@@ -0,0 +1,469 @@
+import os
+import json
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.documents import Document as LangDocument
+from .cache import hash_fragmento
+
+
+try:
+    import fcntl
+except ImportError: # Windows: sin bloqueo entre procesos (un solo worker)
+    fcntl = None
+
+
+FILE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(FILE_DIR)))
+
+# 'local' (índice en proceso, por defecto) o 'pinecone'. Al pasar a 'local' el índice vacío
+# se llena solo al arrancar desde los archivos ya subidos (ColaIngesta.vigilar)
+CHATBOT_VECTOR_BACKEND = os.getenv("CHATBOT_VECTOR_BACKEND", "local").lower()
+# Fuera de /media para que el índice no quede publicado como archivo estático
+CHATBOT_INDEX_DIR = os.getenv("CHATBOT_INDEX_DIR", os.path.join(BASE_DIR, "data", "chatbot_index"))
+INDEX_NAME = os.getenv("INDEX_NAME", "colegio-knowledge")
+# Fragmentos por lote al embeber/subir un documento (reporta progreso entre lotes)
+CHATBOT_LOTE_EMBEDDINGS = int(os.getenv("CHATBOT_LOTE_EMBEDDINGS", "64"))
+# Segundos que se reutiliza la versión del corpus leída de la tabla chatbot (backend Pinecone)
+CHATBOT_VERSION_TTL_S = float(os.getenv("CHATBOT_VERSION_TTL_S", "5"))
+
+
+def _lotes(documentos, tamano: int):
+    """Lotes de una lista o de un generador (p. ej. fragmentos que se van extrayendo)."""
+    tamano = max(tamano, 1)
+    lote = []
+    for documento in documentos:
+        lote.append(documento)
+        if len(lote) == tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+class IndiceVectorialLocal:
+    """
+    Índice plano en memoria: matriz float32 (N x D) de embeddings normalizados,
+    así el coseno es un producto punto. Con el límite de MAX_DOCUMENTS el corpus
+    son unos pocos miles de fragmentos, y la búsqueda exacta tarda milisegundos.
+
+    En disco:
+      - vectores_<version>.npy: la matriz, que se abre como memory-map.
+      - indice.json: versión vigente, dimensión y metadatos (texto y 'source').
+    Cada escritura crea una versión nueva y luego cambia indice.json de forma
+    atómica; el archivo anterior se borra cuando ya no está mapeado.
+    Varios workers comparten la carpeta: las escrituras toman además un flock
+    sobre indice.lock y releen el índice dentro del bloqueo, así ninguna pisa
+    los fragmentos que otro worker acaba de escribir.
+    """
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+        self._lock = threading.RLock()
+        self._version = 0
+        self._matriz = None         # np.memmap (N x D) o None si está vacío
+        self._metadatos = []        # [{"texto": str, "source": str}]
+        self._fuentes = np.array([], dtype=object)
+        self._firma = None          # (inodo, mtime) de indice.json al cargarlo
+        self._cargar()
+
+    @property
+    def _ruta_manifiesto(self):
+        return os.path.join(self.directorio, "indice.json")
+
+    @staticmethod
+    def _firma_de(estado: os.stat_result):
+        # os.replace crea un inodo nuevo en cada escritura: no dependemos de la resolución del mtime
+        return (estado.st_ino, estado.st_mtime_ns)
+
+    @contextmanager
+    def _bloqueo_escritura(self):
+        """Lock del proceso + flock entre workers; dentro, el índice en memoria es el último escrito."""
+        with self._lock:
+            if fcntl is None:
+                self.refrescar()
+                yield
+                return
+            with open(os.path.join(self.directorio, "indice.lock"), "a") as archivo_lock:
+                fcntl.flock(archivo_lock, fcntl.LOCK_EX)
+                try:
+                    self._matriz = None
+                    self._cargar()
+                    yield
+                finally:
+                    fcntl.flock(archivo_lock, fcntl.LOCK_UN)
+
+    def _ruta_vectores(self, version: int):
+        return os.path.join(self.directorio, f"vectores_{version}.npy")
+
+    def _cargar(self):
+        if not os.path.exists(self._ruta_manifiesto):
+            return
+        self._firma = self._firma_de(os.stat(self._ruta_manifiesto))
+        with open(self._ruta_manifiesto, encoding="utf-8") as f:
+            manifiesto = json.load(f)
+        self._version = manifiesto["version"]
+        self._metadatos = manifiesto["metadatos"]
+        self._fuentes = np.array([m["source"] for m in self._metadatos], dtype=object)
+        ruta = self._ruta_vectores(self._version)
+        self._matriz = np.load(ruta, mmap_mode="r") if self._metadatos and os.path.exists(ruta) else None
+
+    def _guardar(self, matriz, metadatos: list):
+        version_anterior = self._version
+        version = version_anterior + 1
+        if len(metadatos):
+            np.save(self._ruta_vectores(version), np.ascontiguousarray(matriz, dtype=np.float32))
+
+        temporal = self._ruta_manifiesto + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "dimension": int(matriz.shape[1]) if len(metadatos) else 0,
+                       "metadatos": metadatos}, f, ensure_ascii=False)
+        os.replace(temporal, self._ruta_manifiesto)
+
+        self._matriz = None # Soltamos el memory-map anterior antes de borrarlo
+        self._cargar()
+        try:
+            os.remove(self._ruta_vectores(version_anterior))
+        except OSError:
+            pass # No existía o sigue abierto (Windows); se limpia en la próxima escritura
+
+    def refrescar(self):
+        """Recarga si otro worker cambió el índice en disco (un stat por llamada)."""
+        try:
+            firma = self._firma_de(os.stat(self._ruta_manifiesto))
+        except OSError:
+            return
+        if firma != self._firma:
+            with self._lock:
+                if firma != self._firma:
+                    self._matriz = None
+                    self._cargar()
+
+    @property
+    def version(self):
+        self.refrescar()
+        return self._version
+
+    @staticmethod
+    def normalizar(vectores):
+        vectores = np.asarray(vectores, dtype=np.float32)
+        if vectores.ndim == 1:
+            vectores = vectores[None, :]
+        normas = np.linalg.norm(vectores, axis=1, keepdims=True)
+        normas[normas == 0] = 1.0
+        return vectores / normas
+
+    def __len__(self):
+        self.refrescar()
+        return len(self._metadatos)
+
+    def fuentes(self):
+        self.refrescar()
+        with self._lock:
+            return sorted(set(self._fuentes.tolist()))
+
+    def metadatos(self):
+        self.refrescar()
+        with self._lock:
+            return list(self._metadatos)
+
+    def agregar(self, vectores, metadatos: list):
+        self.aplicar_cambios(None, set(), vectores, metadatos)
+
+    def hashes(self, fuente: str):
+        """Hashes de contenido de los fragmentos de una fuente (los índices viejos no lo guardaban)."""
+        self.refrescar()
+        with self._lock:
+            return {m.get("hash") or hash_fragmento(m["texto"]) for m in self._metadatos if m["source"] == fuente}
+
+    def aplicar_cambios(self, fuente, quitar: set, vectores, metadatos: list):
+        """
+        Quita de 'fuente' los fragmentos con hash en 'quitar' y agrega los nuevos,
+        en una sola escritura: una pregunta ve el corpus anterior o el nuevo, nunca uno intermedio.
+        Si otro worker ya agregó alguno de los fragmentos nuevos, no se duplica.
+        """
+        with self._bloqueo_escritura():
+            actuales = self._metadatos
+            conservar = np.ones(len(actuales), dtype=bool)
+            presentes = set()
+            for i, m in enumerate(actuales):
+                h = m.get("hash") or hash_fragmento(m["texto"])
+                if quitar and m["source"] == fuente and h in quitar:
+                    conservar[i] = False
+                else:
+                    presentes.add((m["source"], h))
+            nuevos = [
+                i for i, m in enumerate(metadatos)
+                if (m["source"], m.get("hash") or hash_fragmento(m["texto"])) not in presentes
+            ]
+            if len(nuevos) < len(metadatos):
+                vectores = [vectores[i] for i in nuevos]
+                metadatos = [metadatos[i] for i in nuevos]
+            if conservar.all() and not len(metadatos):
+                return
+
+            partes = []
+            if self._matriz is not None and conservar.any():
+                partes.append(np.asarray(self._matriz)[conservar])
+            if len(metadatos):
+                partes.append(self.normalizar(vectores))
+            conservados = [m for m, c in zip(actuales, conservar) if c]
+            matriz = np.vstack(partes) if partes else np.zeros((0, 0), dtype=np.float32)
+            self._guardar(matriz, conservados + list(metadatos))
+
+    def eliminar(self, fuente: str):
+        with self._bloqueo_escritura():
+            conservar = self._fuentes != fuente
+            eliminados = int((~conservar).sum())
+            if not eliminados:
+                return 0
+            metadatos = [m for m, c in zip(self._metadatos, conservar) if c]
+            matriz = np.asarray(self._matriz)[conservar] if metadatos else np.zeros((0, 0), dtype=np.float32)
+            self._guardar(matriz, metadatos)
+            return eliminados
+
+    def buscar(self, vector, k: int, fuente: str = None):
+        """Devuelve [(metadato, puntaje)] de los k más similares, opcionalmente de una sola fuente."""
+        self.refrescar()
+        with self._lock:
+            matriz, metadatos, fuentes = self._matriz, self._metadatos, self._fuentes
+        if matriz is None or not len(metadatos):
+            return []
+
+        puntajes = matriz @ self.normalizar(vector)[0]
+        if fuente is not None:
+            puntajes = np.where(fuentes == fuente, puntajes, -np.inf)
+
+        k = min(k, len(puntajes))
+        candidatos = np.argpartition(-puntajes, k - 1)[:k]
+        candidatos = candidatos[np.argsort(-puntajes[candidatos])]
+        return [(metadatos[i], float(puntajes[i])) for i in candidatos if np.isfinite(puntajes[i])]
+
+
+class LocalBackend:
+    """Recuperación en proceso sobre IndiceVectorialLocal (sin red en cada pregunta)."""
+    nombre = "local"
+
+    def __init__(self, embeddings, directorio: str = CHATBOT_INDEX_DIR):
+        self.embeddings = embeddings
+        self.indice = IndiceVectorialLocal(directorio)
+
+    @property
+    def version(self):
+        """Cambia con cada escritura del corpus (también las de otros workers)."""
+        return self.indice.version
+
+    def _embeber_nuevos(self, documentos, ya_indexados, al_avanzar, tamano_lote: int):
+        """
+        Embebe por lotes los documentos cuyo (source, hash) no está en 'ya_indexados'
+        (ni repetido en la misma tanda). ya_indexados(fuente) -> set de hashes.
+        Devuelve (vectores, metadatos, fragmentos procesados, hashes de la tanda).
+        """
+        total = len(documentos) if isinstance(documentos, list) else None
+        vistos = {} # fuente -> hashes presentes (indexados + nuevos)
+        en_tanda = set()
+        vectores, metadatos, procesados = [], [], 0
+        for lote in _lotes(documentos, tamano_lote):
+            nuevos = []
+            for d in lote:
+                fuente = d.metadata.get("source")
+                if fuente not in vistos:
+                    vistos[fuente] = set(ya_indexados(fuente))
+                h = hash_fragmento(d.page_content)
+                en_tanda.add(h)
+                if h not in vistos[fuente]:
+                    vistos[fuente].add(h)
+                    nuevos.append((d, h))
+            if nuevos:
+                vectores.extend(self.embeddings.embed_documents([d.page_content for d, _ in nuevos]))
+                metadatos.extend({"texto": d.page_content, "source": d.metadata.get("source"), "hash": h} for d, h in nuevos)
+            procesados += len(lote)
+            if al_avanzar:
+                al_avanzar(procesados, total)
+        return vectores, metadatos, procesados, en_tanda
+
+    def agregar(self, documentos, al_avanzar=None, tamano_lote: int = CHATBOT_LOTE_EMBEDDINGS):
+        """
+        Embebe por lotes (al_avanzar(hechos, total) después de cada uno; total es None
+        si 'documentos' es un generador) y escribe el índice una sola vez al final:
+        las preguntas nunca ven el documento a medias. Los fragmentos que la fuente
+        ya tiene indexados (mismo contenido) no se vuelven a agregar.
+        """
+        vectores, metadatos, procesados, _ = self._embeber_nuevos(documentos, self.indice.hashes, al_avanzar, tamano_lote)
+        if metadatos:
+            self.indice.agregar(vectores, metadatos)
+        return procesados
+
+    def sincronizar(self, fuente: str, documentos, al_avanzar=None, tamano_lote: int = CHATBOT_LOTE_EMBEDDINGS):
+        """
+        Deja en el índice exactamente 'documentos' para 'fuente': agrega solo los
+        fragmentos nuevos y quita los que ya no están, en una sola escritura.
+        """
+        existentes = self.indice.hashes(fuente)
+        vectores, metadatos, procesados, en_tanda = self._embeber_nuevos(
+            documentos, lambda _: existentes, al_avanzar, tamano_lote
+        )
+        if not procesados:
+            # Un archivo sin texto no vacía el documento indexado
+            return {"total": 0, "agregados": 0, "eliminados": 0, "sin_cambios": len(existentes)}
+        quitar = existentes - en_tanda
+        self.indice.aplicar_cambios(fuente, quitar, vectores, metadatos)
+        return {"total": procesados, "agregados": len(metadatos), "eliminados": len(quitar),
+                "sin_cambios": len(existentes & en_tanda)}
+
+    def buscar(self, pregunta: str, k: int, fuente: str = None):
+        vector = self.embeddings.embed_query(pregunta)
+        return [
+            LangDocument(page_content=m["texto"], metadata={"source": m["source"], "score": puntaje})
+            for m, puntaje in self.indice.buscar(vector, k, fuente)
+        ]
+
+    def eliminar(self, fuente: str):
+        return self.indice.eliminar(fuente)
+
+    def fragmentos(self):
+        """Texto y 'source' de cada fragmento indexado (para el índice léxico)."""
+        return self.indice.metadatos()
+
+    def vacio(self):
+        return len(self.indice) == 0
+
+
+class PineconeBackend:
+    """El vectorstore de Pinecone se crea una sola vez y se reutiliza entre peticiones."""
+    nombre = "pinecone"
+
+    def __init__(self, embeddings, index_name: str = INDEX_NAME):
+        self.embeddings = embeddings
+        self.index_name = index_name
+        self._store = None
+        self._lock = threading.Lock()
+        # Pinecone no expone una versión del índice: la derivamos de la tabla chatbot, que
+        # comparten todos los workers, más las escrituras de este proceso (se ven al instante)
+        self._escrituras = 0
+        self._firma = None
+        self._firmado_en = 0.0
+
+    @staticmethod
+    def _leer_firma():
+        # Import diferido: vectorstore no depende de la base salvo con Pinecone
+        from sqlalchemy import func
+        from app.db.database import SessionLocal
+        from .models import Chatbot
+        db = SessionLocal()
+        try:
+            return tuple(db.query(
+                func.count(Chatbot.id), func.sum(Chatbot.version), func.sum(Chatbot.total_chunks),
+                func.max(Chatbot.fecha_actualizacion)
+            ).filter(Chatbot.status == "entrenado").one())
+        finally:
+            db.close()
+
+    @property
+    def version(self):
+        """Cambia con cada documento entrenado, reemplazado o borrado en cualquier worker.
+
+        Consulta la base (como mucho cada CHATBOT_VERSION_TTL_S): leerla fuera del event loop.
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            firma, escrituras = self._firma, self._escrituras
+        if firma is None or ahora - self._firmado_en > CHATBOT_VERSION_TTL_S:
+            firma = self._leer_firma()
+            with self._lock:
+                self._firma, self._firmado_en = firma, ahora
+        return (escrituras, firma)
+
+    def _registrar_escritura(self):
+        with self._lock:
+            self._escrituras += 1
+            self._firma = None # la próxima lectura ve el estado que dejó esta escritura
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    # Import diferido: con el backend local no hace falta el paquete de Pinecone
+                    from langchain_pinecone import PineconeVectorStore
+                    self._store = PineconeVectorStore(index_name=self.index_name, embedding=self.embeddings)
+        return self._store
+
+    @staticmethod
+    def _prefijo(fuente: str):
+        return hashlib.sha1(fuente.encode("utf-8")).hexdigest()[:16] + "#"
+
+    def _id(self, fuente: str, texto: str):
+        # Id determinístico por contenido: volver a subir un fragmento igual lo sobrescribe, no lo duplica
+        return self._prefijo(fuente) + hash_fragmento(texto)[:40]
+
+    def _ids_existentes(self, fuente: str):
+        """Ids de la fuente en Pinecone (listado por prefijo, índices serverless); None si no se puede listar."""
+        try:
+            indice = getattr(self.store, "index", None) or self.store._index
+            return {i for pagina in indice.list(prefix=self._prefijo(fuente)) for i in pagina}
+        except Exception:
+            return None
+
+    def agregar(self, documentos, al_avanzar=None, tamano_lote: int = CHATBOT_LOTE_EMBEDDINGS, omitir: set = None):
+        total = len(documentos) if isinstance(documentos, list) else None
+        hechos = 0
+        for lote in _lotes(documentos, tamano_lote):
+            ids = [self._id(d.metadata.get("source"), d.page_content) for d in lote]
+            nuevos = [(d, i) for d, i in zip(lote, ids) if not omitir or i not in omitir]
+            if nuevos:
+                self.store.add_documents([d for d, _ in nuevos], ids=[i for _, i in nuevos])
+            hechos += len(lote)
+            if al_avanzar:
+                al_avanzar(hechos, total)
+        if hechos:
+            self._registrar_escritura()
+        return hechos
+
+    def sincronizar(self, fuente: str, documentos, al_avanzar=None, tamano_lote: int = CHATBOT_LOTE_EMBEDDINGS):
+        documentos = list(documentos)
+        if not documentos:
+            return {"total": 0, "agregados": 0, "eliminados": 0, "sin_cambios": None}
+        existentes = self._ids_existentes(fuente)
+        if existentes is None:
+            # Sin listado: reemplazo completo (los embeddings salen del almacén por hash)
+            self.eliminar(fuente)
+            total = self.agregar(documentos, al_avanzar, tamano_lote)
+            return {"total": total, "agregados": total, "eliminados": None, "sin_cambios": 0}
+
+        vigentes = {self._id(fuente, d.page_content) for d in documentos}
+        total = self.agregar(documentos, al_avanzar, tamano_lote, omitir=existentes)
+        quitar = list(existentes - vigentes)
+        if quitar:
+            self.store.delete(ids=quitar)
+        return {"total": total, "agregados": len(vigentes - existentes), "eliminados": len(quitar),
+                "sin_cambios": len(vigentes & existentes)}
+
+    def buscar(self, pregunta: str, k: int, fuente: str = None):
+        filtro = {"source": fuente} if fuente else None
+        return self.store.similarity_search(pregunta, k=k, filter=filtro)
+
+    def eliminar(self, fuente: str):
+        # Borramos todos los vectores que tengan el metadato 'source' igual al nombre del archivo
+        self.store.delete(filter={"source": fuente})
+        self._registrar_escritura()
+        return None
+
+    def vacio(self):
+        # Pinecone es compartido y persistente: no se vacía al cambiar de worker o de versión
+        return False
+
+    def fragmentos(self):
+        # Los textos viven en Pinecone: sin copia local no hay índice léxico (solo denso)
+        return None
+
+
+def crear_backend(embeddings):
+    if CHATBOT_VECTOR_BACKEND == "pinecone":
+        return PineconeBackend(embeddings)
+    if CHATBOT_VECTOR_BACKEND == "local":
+        return LocalBackend(embeddings)
+    raise ValueError(f"CHATBOT_VECTOR_BACKEND no soportado: {CHATBOT_VECTOR_BACKEND}")
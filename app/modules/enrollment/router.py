@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
 from app.db.database import get_db
 from . import models, schemas
+from app.modules.virtual.service import permisos_chat, cursos_alumno
 
 # Importamos modelos de alumno para asegurar relaciones si es necesario
 from app.modules.users.alumno import models as alumno_models
@@ -26,6 +27,8 @@ def crear_matricula(matricula: schemas.MatriculaCreate, db: Session = Depends(ge
     nueva = models.Matricula(**matricula.model_dump())
     db.add(nueva)
     db.commit()
+    permisos_chat.invalidar()
+    cursos_alumno.invalidar()
     db.refresh(nueva)
     return nueva
 
@@ -75,6 +78,8 @@ def actualizar_matricula(
     if datos.id_grado: matricula.id_grado = datos.id_grado
     
     db.commit()
+    permisos_chat.invalidar()
+    cursos_alumno.invalidar()
     db.refresh(matricula)
     return matricula
 
@@ -75,4 +75,25 @@ class Pago(Base):
     # Relaciones para facilitar consultas
     alumno = relationship("Alumno")
     solicitud = relationship("SolicitudTramite", back_populates="pago")
-    matricula = relationship("Matricula")
\ No newline at end of file
+    matricula = relationship("Matricula")
+
+class EjecucionMora(Base):
+    """Auditoría de cada corrida del cálculo de moras (cron diario)."""
+    __tablename__ = "ejecucion_mora"
+    # La tabla se crea a mano (el insert va en la misma transacción que el UPDATE de moras). En MySQL:
+    # CREATE TABLE ejecucion_mora (
+    #     id_ejecucion INT AUTO_INCREMENT PRIMARY KEY,
+    #     fecha_ejecucion DATETIME DEFAULT CURRENT_TIMESTAMP,
+    #     fecha_corte DATE NOT NULL,
+    #     politica TEXT NOT NULL,
+    #     pagos_afectados INT DEFAULT 0,
+    #     duracion_ms INT DEFAULT 0,
+    #     INDEX ix_ejecucion_mora_id_ejecucion (id_ejecucion)
+    # );
+
+    id_ejecucion = Column(Integer, primary_key=True, index=True)
+    fecha_ejecucion = Column(DateTime, server_default=func.now())
+    fecha_corte = Column(Date, nullable=False) # 'hoy' usado para calcular los días de atraso
+    politica = Column(Text, nullable=False) # JSON de la política aplicada
+    pagos_afectados = Column(Integer, default=0)
+    duracion_ms = Column(Integer, default=0)
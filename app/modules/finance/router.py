@@ -12,6 +12,7 @@ from app.modules.academic import models as academic_models
 from app.modules.users.alumno import models as user_models
 from app.modules.enrollment import models as er_models
 from .service import FinanceService
+from app.modules.virtual.service import permisos_chat, cursos_alumno
 router = APIRouter(prefix="/finance", tags=["Finanzas"])
 
 
@@ -388,6 +389,8 @@ def confirmar_pago_manual(id_pago: int, db: Session = Depends(get_db)):
     # 2. Commit para que el TRIGGER de MySQL se ejecute AHORA
     db.commit()
     db.refresh(pago) # Esto asegura que tenemos los datos frescos post-trigger
+    permisos_chat.invalidar() # El trigger pudo crear una matrícula
+    cursos_alumno.invalidar()
 
     # 3. Lógica post-matrícula (Generación de pensión)
     if "VACANTE" in pago.concepto.upper():
@@ -435,44 +438,30 @@ def obtener_historial_alumno(id_alumno: int, db: Session = Depends(get_db)):
 def ejecutar_generacion_mensual(db: Session = Depends(get_db)):
     """
     Endpoint diseñado para ser llamado por un Cron Job el día 1 de cada mes.
+    Devuelve un resumen con los pagos generados, omitidos y con error.
     """
     hoy = datetime.now()
-    
-    # 1. Buscamos años escolares que estén marcados como activos
-    anios_activos = db.query(academic_models.AnioEscolar).filter(
-        academic_models.AnioEscolar.activo == True
-    ).all()
-    
-    if not anios_activos:
-        return {"message": "No hay años escolares activos para generar pensiones."}
-
-    total_generados = 0
-    
-    for anio in anios_activos:
-        # 2. Buscamos todas las matrículas vigentes de ese año
-        matriculas = db.query(er_models.Matricula).filter(
-            er_models.Matricula.id_anio_escolar == anio.id_anio_escolar,
-            er_models.Matricula.estado == "MATRICULADO"
-        ).all()
+    resumen = FinanceService.generar_pensiones_mes(db, mes=hoy.month, anio=hoy.year)
 
-        for m in matriculas:
-            # 3. Usamos el Service para generar la pensión (el service ya evita duplicados)
-            FinanceService.generar_pension_mensual(
-                db=db,
-                id_alumno=m.id_alumno,
-                id_matricula=m.id_matricula,
-                tipo_periodo=m.tipo_matricula, # REGULAR o VERANO
-                mes=hoy.month,
-                anio=hoy.year
-            )
-            total_generados += 1
+    if resumen["revisados"] == 0:
+        return {"message": "No hay matrículas vigentes en años escolares activos.", **resumen}
 
-    return {"message": f"Proceso completado. Se revisaron {total_generados} alumnos."}
+    return {"message": f"Proceso completado. Se revisaron {resumen['revisados']} alumnos.", **resumen}
 
 @router.post("/tareas/actualizar-moras")
-def actualizar_moras_diarias(db: Session = Depends(get_db)):
+def actualizar_moras_diarias(politica: Optional[schemas.PoliticaMora] = None, db: Session = Depends(get_db)):
     """
     Endpoint para ser llamado por un Cron Job diariamente a medianoche.
+    Sin cuerpo aplica la mora fija de 5 soles; se puede enviar una política
+    FIJA, PORCENTAJE o ESCALONADA (por días de atraso).
     """
-    cantidad = FinanceService.aplicar_moras_pagos_vencidos(db)
-    return {"message": f"Se aplicó mora a {cantidad} pagos vencidos."}
\ No newline at end of file
+    cantidad = FinanceService.aplicar_moras_pagos_vencidos(db, politica)
+    return {"message": f"Se aplicó mora a {cantidad} pagos vencidos."}
+
+@router.get("/tareas/actualizar-moras/historial", response_model=List[schemas.EjecucionMoraResponse])
+def listar_ejecuciones_mora(limite: int = 30, db: Session = Depends(get_db)):
+    """Últimas corridas del cálculo de moras (auditoría)."""
+    return db.query(models.EjecucionMora)\
+             .order_by(models.EjecucionMora.fecha_ejecucion.desc())\
+             .limit(limite)\
+             .all()
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
 from decimal import Decimal
-from typing import Optional, Literal
+from typing import Optional, Literal, List
 from datetime import date, datetime
 from enum import Enum as PyEnum
 # =======================
@@ -120,4 +120,32 @@ class ActualizacionCostosMasiva(BaseModel):
 
 class DictamenSolicitud(BaseModel):
     estado: Literal["APROBADO", "RECHAZADO"]
-    respuesta_administrativa: Optional[str] = None
\ No newline at end of file
+    respuesta_administrativa: Optional[str] = None
+
+# =======================
+# 4. MORAS (Cron)
+# =======================
+class TramoMora(BaseModel):
+    dias_min: int = Field(..., ge=1) # Días de atraso a partir de los cuales aplica el tramo
+    monto: Decimal = Field(..., ge=0, decimal_places=2)
+
+class PoliticaMora(BaseModel):
+    tipo: Literal["FIJA", "PORCENTAJE", "ESCALONADA"] = "FIJA"
+    monto: Decimal = Field(default=Decimal("5.00"), ge=0, decimal_places=2) # Para FIJA
+    porcentaje: Decimal = Field(default=Decimal(0), ge=0, le=100, decimal_places=2) # Para PORCENTAJE
+    tramos: List[TramoMora] = [] # Para ESCALONADA
+
+    @model_validator(mode='after')
+    def validar_tramos(self) -> 'PoliticaMora':
+        if self.tipo == "ESCALONADA" and not self.tramos:
+            raise ValueError("La política escalonada requiere al menos un tramo")
+        return self
+
+class EjecucionMoraResponse(BaseModel):
+    id_ejecucion: int
+    fecha_ejecucion: datetime
+    fecha_corte: date
+    politica: str
+    pagos_afectados: int
+    duracion_ms: int
+    model_config = ConfigDict(from_attributes=True)
@@ -1,8 +1,9 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, case
-from datetime import datetime, date
+from sqlalchemy import or_, case, insert, update, func, literal
+from datetime import datetime, date, timedelta
 import calendar
-from . import models
+import time
+from . import models, schemas
 from app.modules.academic import models as academic_models
 from app.modules.enrollment import models as enrollment_models
 from app.modules.users.alumno import models as user_models 
@@ -85,27 +86,167 @@ class FinanceService:
     
 
     @staticmethod
-    def aplicar_moras_pagos_vencidos(db: Session):
+    def generar_pensiones_mes(db: Session, mes: int, anio: int, tamano_lote: int = 500):
         """
-        Busca pagos PENDIENTES que ya pasaron su fecha de vencimiento
-        y les aplica una mora única de 5 soles.
+        Versión masiva de generar_pension_mensual para el cron mensual.
+        Resuelve años activos, tarifas y conceptos ya generados una sola vez por
+        ejecución e inserta los pagos faltantes por lotes en una única transacción.
         """
+        nombre_mes = ["", "ENERO", "FEBRERO", "MARZO", "ABRIL", "MAYO", "JUNIO", 
+                    "JULIO", "AGOSTO", "SEPTIEMBRE", "OCTUBRE", "NOVIEMBRE", "DICIEMBRE"][mes]
+        concepto = f"PENSION {nombre_mes} {anio}"
+        fecha_a_cobrar = date(anio, mes, 1)
+        fecha_vencimiento = date(anio, mes, calendar.monthrange(anio, mes)[1])
+
+        resumen = {"concepto": concepto, "revisados": 0, "generados": 0, "omitidos": 0, "errores": 0, "detalle_errores": []}
+
+        # 1. Años escolares activos cuyo rango de clases incluye el mes a cobrar
+        anios_activos = db.query(academic_models.AnioEscolar).filter(
+            academic_models.AnioEscolar.activo == True
+        ).all()
+        anios_en_clases = [
+            a.id_anio_escolar for a in anios_activos
+            if a.fecha_inicio.replace(day=1) <= fecha_a_cobrar
+            and (a.fecha_fin is None or fecha_a_cobrar <= a.fecha_fin.replace(day=1))
+        ]
+
+        # 2. Matrículas vigentes con el id_usuario del alumno (una sola consulta)
+        matriculas = db.query(
+            enrollment_models.Matricula.id_matricula,
+            enrollment_models.Matricula.id_alumno,
+            enrollment_models.Matricula.id_anio_escolar,
+            enrollment_models.Matricula.tipo_matricula,
+            user_models.Alumno.id_usuario
+        ).outerjoin(
+            user_models.Alumno, user_models.Alumno.id_alumno == enrollment_models.Matricula.id_alumno
+        ).filter(
+            enrollment_models.Matricula.id_anio_escolar.in_([a.id_anio_escolar for a in anios_activos]),
+            enrollment_models.Matricula.estado == "MATRICULADO"
+        ).all()
+
+        # 3. Alumnos que ya tienen el concepto del mes (para no duplicar deudas)
+        ya_generados = {
+            fila.id_alumno for fila in db.query(models.Pago.id_alumno).filter(
+                models.Pago.concepto == concepto
+            ).all()
+        }
+
+        # Tarifas resueltas una vez por tipo de periodo (REGULAR / VERANO)
+        tarifas = {}
+        nuevos_pagos = []
+
+        for m in matriculas:
+            resumen["revisados"] += 1
+
+            if m.id_anio_escolar not in anios_en_clases or m.id_alumno in ya_generados:
+                resumen["omitidos"] += 1
+                continue
+
+            if m.tipo_matricula not in tarifas:
+                tarifas[m.tipo_matricula] = FinanceService.obtener_tipo_tramite_por_periodo(db, "PENSION", m.tipo_matricula)
+            tramite = tarifas[m.tipo_matricula]
+
+            if not tramite:
+                resumen["errores"] += 1
+                resumen["detalle_errores"].append({
+                    "id_matricula": m.id_matricula,
+                    "motivo": f"No hay costo configurado para PENSION - {m.tipo_matricula}"
+                })
+                continue
+
+            nuevos_pagos.append({
+                "id_usuario": m.id_usuario,
+                "id_alumno": m.id_alumno,
+                "id_matricula": m.id_matricula,
+                "concepto": concepto,
+                "monto": tramite.costo,
+                "monto_total": tramite.costo,
+                "estado": "PENDIENTE",
+                "fecha_vencimiento": fecha_vencimiento,
+                "mora": 0
+            })
+            ya_generados.add(m.id_alumno)
+
+        # 4. Inserción por lotes dentro de una sola transacción
+        try:
+            for i in range(0, len(nuevos_pagos), tamano_lote):
+                db.execute(insert(models.Pago), nuevos_pagos[i:i + tamano_lote])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        resumen["generados"] = len(nuevos_pagos)
+        return resumen
+
+    @staticmethod
+    def expresion_mora(politica: schemas.PoliticaMora, hoy: date):
+        """
+        Construye la expresión SQL de la mora que le corresponde a cada pago
+        según la política (FIJA, PORCENTAJE o ESCALONADA por días de atraso).
+        """
+        if politica.tipo == "PORCENTAJE":
+            return func.round(models.Pago.monto * (politica.porcentaje / 100), 2)
+
+        if politica.tipo == "ESCALONADA":
+            # Un pago tiene N o más días de atraso si venció en (hoy - N) o antes.
+            # Se evalúa del tramo más largo al más corto para quedarnos con el mayor.
+            tramos = sorted(politica.tramos, key=lambda t: t.dias_min, reverse=True)
+            return case(
+                *[
+                    (models.Pago.fecha_vencimiento <= hoy - timedelta(days=t.dias_min), t.monto)
+                    for t in tramos
+                ],
+                else_=0
+            )
+
+        return literal(politica.monto)
+
+    @staticmethod
+    def aplicar_moras_pagos_vencidos(db: Session, politica: schemas.PoliticaMora = None):
+        """
+        Aplica la mora a los pagos PENDIENTES vencidos con un único UPDATE
+        (sin cargar los pagos en memoria) y registra la corrida en ejecucion_mora.
+        Por defecto aplica una mora única de 5 soles.
+        Es seguro re-ejecutarlo: solo se tocan pagos cuya mora actual es menor
+        a la que les corresponde, así que una segunda corrida el mismo día no cambia nada.
+        """
+        politica = politica or schemas.PoliticaMora()
         hoy = date.today()
-        
+        inicio = time.perf_counter()
+
+        mora_nueva = FinanceService.expresion_mora(politica, hoy)
+
         # Filtramos:
         # 1. Solo pagos PENDIENTES
         # 2. Donde la fecha de vencimiento sea menor a hoy
-        # 3. Donde la mora sea 0 (para asegurar que es la primera vez que se aplica)
-        pagos_vencidos = db.query(models.Pago).filter(
-            models.Pago.estado == "PENDIENTE",
-            models.Pago.fecha_vencimiento < hoy,
-            models.Pago.mora == 0
-        ).all()
+        # 3. Donde la mora actual sea menor a la que corresponde (idempotencia)
+        try:
+            resultado = db.execute(
+                update(models.Pago)
+                .where(
+                    models.Pago.estado == "PENDIENTE",
+                    models.Pago.fecha_vencimiento < hoy,
+                    func.coalesce(models.Pago.mora, 0) < mora_nueva
+                )
+                .values(
+                    mora=mora_nueva,
+                    # El monto_total ahora refleja la deuda + la multa
+                    monto_total=models.Pago.monto + mora_nueva
+                )
+                .execution_options(synchronize_session=False)
+            )
+            afectados = resultado.rowcount
 
-        for pago in pagos_vencidos:
-            pago.mora = 5.00
-            # El monto_total ahora refleja la deuda + la multa
-            pago.monto_total = pago.monto + 5.00
-        
-        db.commit()
-        return len(pagos_vencidos)
\ No newline at end of file
+            db.add(models.EjecucionMora(
+                fecha_corte=hoy,
+                politica=politica.model_dump_json(),
+                pagos_afectados=afectados,
+                duracion_ms=int((time.perf_counter() - inicio) * 1000)
+            ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        return afectados
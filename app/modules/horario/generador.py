@@ -0,0 +1,285 @@
+"""
+Generador automático de horarios.
+
+Es independiente de la base de datos: recibe las cargas (sección, docente,
+horas semanales), los bloques de clase disponibles y la indisponibilidad de
+los docentes, y devuelve una asignación sin choques.
+
+Algoritmo: asignación voraz "más restringida primero" (la carga con menos
+bloques libres va antes) sobre bitsets de ocupación por docente y por sección,
+con reparación local cuando una carga se queda sin bloques: se intenta mover
+a otro bloque la clase que la bloquea (cadena de expulsión de profundidad 1).
+
+Benchmark con escuelas sintéticas:
+    python -m app.modules.horario.generador 10 50 100
+"""
+import random
+import sys
+import time
+
+
+class CargaGenerador:
+    __slots__ = ("id_carga", "id_seccion", "id_docente", "horas", "permitidos", "asignados")
+
+    def __init__(self, id_carga: int, id_seccion: int, id_docente: int, horas: int, permitidos: int):
+        self.id_carga = id_carga
+        self.id_seccion = id_seccion
+        self.id_docente = id_docente
+        self.horas = horas              # Horas semanales que faltan colocar
+        self.permitidos = permitidos    # Máscara de bloques donde el docente puede dictar
+        self.asignados = []             # Bloques (bits) ya asignados
+
+
+def _bits(mascara: int):
+    while mascara:
+        menor = mascara & -mascara
+        yield menor.bit_length() - 1
+        mascara ^= menor
+
+
+class GeneradorHorario:
+    """
+    Bloques numerados 0..dias*horas_por_dia-1 (bit = dia * horas_por_dia + hora).
+    cargas: dicts con id_carga, id_seccion, id_docente, horas.
+    indisponible: {id_docente: máscara de bloques no disponibles}.
+    fijos: lista de (id_carga, bit) que ya están colocados y no se mueven.
+    """
+
+    def __init__(self, dias: int, horas_por_dia: int, cargas: list, indisponible: dict = None, fijos: list = None):
+        self.dias = dias
+        self.horas_por_dia = horas_por_dia
+        self.total_bloques = dias * horas_por_dia
+        todos = (1 << self.total_bloques) - 1
+        indisponible = indisponible or {}
+
+        self.cargas = {
+            c["id_carga"]: CargaGenerador(
+                c["id_carga"], c["id_seccion"], c["id_docente"], c["horas"],
+                todos & ~indisponible.get(c["id_docente"], 0)
+            )
+            for c in cargas
+        }
+        self.bits_docente = {}
+        self.bits_seccion = {}
+        self.ocupante_docente = {}  # (id_docente, bit) -> id_carga
+        self.ocupante_seccion = {}  # (id_seccion, bit) -> id_carga
+        self.fijos = set()
+        self.reparaciones = 0
+
+        for id_carga, b in fijos or []:
+            carga = self.cargas.get(id_carga)
+            if carga and not self._ocupado(carga, b):
+                self._colocar(carga, b)
+                carga.horas = max(carga.horas - 1, 0)
+                self.fijos.add((id_carga, b))
+
+    # --- Ocupación ---
+    def _libres(self, carga: CargaGenerador):
+        ocupados = self.bits_seccion.get(carga.id_seccion, 0)
+        if carga.id_docente is not None:
+            ocupados |= self.bits_docente.get(carga.id_docente, 0)
+        return carga.permitidos & ~ocupados
+
+    def _ocupado(self, carga: CargaGenerador, b: int):
+        return not (self._libres(carga) >> b) & 1
+
+    def _colocar(self, carga: CargaGenerador, b: int):
+        mascara = 1 << b
+        self.bits_seccion[carga.id_seccion] = self.bits_seccion.get(carga.id_seccion, 0) | mascara
+        self.ocupante_seccion[(carga.id_seccion, b)] = carga.id_carga
+        if carga.id_docente is not None:
+            self.bits_docente[carga.id_docente] = self.bits_docente.get(carga.id_docente, 0) | mascara
+            self.ocupante_docente[(carga.id_docente, b)] = carga.id_carga
+        carga.asignados.append(b)
+
+    def _quitar(self, carga: CargaGenerador, b: int):
+        mascara = ~(1 << b)
+        self.bits_seccion[carga.id_seccion] &= mascara
+        self.ocupante_seccion.pop((carga.id_seccion, b), None)
+        if carga.id_docente is not None:
+            self.bits_docente[carga.id_docente] &= mascara
+            self.ocupante_docente.pop((carga.id_docente, b), None)
+        carga.asignados.remove(b)
+
+    # --- Heurística de elección de bloque ---
+    def _puntaje(self, carga: CargaGenerador, b: int):
+        """Menor es mejor: evita repetir el curso el mismo día y reparte la carga del día."""
+        dia, hora = divmod(b, self.horas_por_dia)
+        mismo_dia = sum(1 for a in carga.asignados if a // self.horas_por_dia == dia)
+        inicio_dia = dia * self.horas_por_dia
+        mascara_dia = ((1 << self.horas_por_dia) - 1) << inicio_dia
+        clases_seccion_dia = bin(self.bits_seccion.get(carga.id_seccion, 0) & mascara_dia).count("1")
+        # Si el docente ya dicta ese día, preferimos horas contiguas (menos huecos)
+        contiguo = 0
+        if carga.id_docente is not None:
+            bits_doc = self.bits_docente.get(carga.id_docente, 0)
+            vecinos = 0
+            if hora > 0:
+                vecinos |= 1 << (b - 1)
+            if hora < self.horas_por_dia - 1:
+                vecinos |= 1 << (b + 1)
+            contiguo = -1 if bits_doc & vecinos else 0
+        return (mismo_dia, clases_seccion_dia, contiguo, hora)
+
+    def _mejor_bloque(self, carga: CargaGenerador, libres: int):
+        return min(_bits(libres), key=lambda b: self._puntaje(carga, b))
+
+    # --- Reparación ---
+    def _reparar(self, carga: CargaGenerador):
+        """
+        Busca un bloque permitido para 'carga' cuyos ocupantes (de la sección y/o
+        del docente) puedan moverse a otro bloque libre. Devuelve True si lo logra.
+        """
+        for b in _bits(carga.permitidos):
+            bloqueadores = set()
+            ocupante = self.ocupante_seccion.get((carga.id_seccion, b))
+            if ocupante is not None:
+                bloqueadores.add(ocupante)
+            if carga.id_docente is not None:
+                ocupante = self.ocupante_docente.get((carga.id_docente, b))
+                if ocupante is not None:
+                    bloqueadores.add(ocupante)
+            if not bloqueadores or any((o, b) in self.fijos for o in bloqueadores):
+                continue
+
+            movidos = []
+            for id_otra in bloqueadores:
+                otra = self.cargas[id_otra]
+                self._quitar(otra, b)
+                # Reservamos b para 'carga' mientras buscamos destino al bloqueador
+                libres = self._libres(otra) & ~(1 << b)
+                if not libres:
+                    self._colocar(otra, b)
+                    break
+                destino = self._mejor_bloque(otra, libres)
+                self._colocar(otra, destino)
+                movidos.append((otra, destino))
+            else:
+                if not self._ocupado(carga, b):
+                    self._colocar(carga, b)
+                    self.reparaciones += 1
+                    return True
+
+            # Deshacer los movimientos parciales
+            for otra, destino in movidos:
+                self._quitar(otra, destino)
+                self._colocar(otra, b)
+        return False
+
+    # --- Resolución ---
+    def resolver(self):
+        inicio = time.perf_counter()
+        pendientes = {c.id_carga: c for c in self.cargas.values() if c.horas > 0}
+        no_colocadas = {}
+
+        while pendientes:
+            # Más restringida primero: menos bloques libres por hora que le falta
+            carga = min(
+                pendientes.values(),
+                key=lambda c: (bin(self._libres(c)).count("1") - c.horas, -c.horas, c.id_carga)
+            )
+            libres = self._libres(carga)
+            if libres:
+                self._colocar(carga, self._mejor_bloque(carga, libres))
+            elif not self._reparar(carga):
+                no_colocadas[carga.id_carga] = carga.horas
+                del pendientes[carga.id_carga]
+                continue
+
+            carga.horas -= 1
+            if carga.horas == 0:
+                del pendientes[carga.id_carga]
+
+        return {
+            "asignaciones": [
+                (c.id_carga, b) for c in self.cargas.values() for b in sorted(c.asignados)
+                if (c.id_carga, b) not in self.fijos
+            ],
+            "no_colocadas": no_colocadas,
+            "metricas": self.metricas(time.perf_counter() - inicio, no_colocadas)
+        }
+
+    def metricas(self, segundos: float, no_colocadas: dict):
+        total = sum(len(c.asignados) for c in self.cargas.values()) + sum(no_colocadas.values())
+
+        # Huecos del docente: horas libres entre su primera y última clase de cada día
+        huecos = 0
+        mascara_dia = (1 << self.horas_por_dia) - 1
+        for bits in self.bits_docente.values():
+            for dia in range(self.dias):
+                horas_dia = (bits >> (dia * self.horas_por_dia)) & mascara_dia
+                if horas_dia:
+                    primera = (horas_dia & -horas_dia).bit_length() - 1
+                    ultima = horas_dia.bit_length() - 1
+                    huecos += (ultima - primera + 1) - bin(horas_dia).count("1")
+
+        # Clases de un mismo curso que caen el mismo día más de lo necesario
+        repetidas = 0
+        for c in self.cargas.values():
+            por_dia = {}
+            for b in c.asignados:
+                dia = b // self.horas_por_dia
+                por_dia[dia] = por_dia.get(dia, 0) + 1
+            ideal = -(-len(c.asignados) // self.dias) # ceil
+            repetidas += sum(max(n - ideal, 0) for n in por_dia.values())
+
+        return {
+            "tiempo_ms": round(segundos * 1000, 1),
+            "lecciones_total": total,
+            "lecciones_colocadas": total - sum(no_colocadas.values()),
+            "lecciones_sin_colocar": sum(no_colocadas.values()),
+            "reparaciones": self.reparaciones,
+            "huecos_docente": huecos,
+            "clases_repetidas_mismo_dia": repetidas
+        }
+
+
+def escuela_sintetica(secciones: int, cursos: int = 10, dias: int = 5, horas_por_dia: int = 7,
+                      carga_max_docente: int = 26, indisponibles: float = 0.1, ocupacion: float = 0.85,
+                      semilla: int = 7):
+    """
+    Escuela ficticia para medir el generador: cada sección lleva 'cursos' cursos
+    que suman 'ocupacion' de sus bloques; cada curso tiene su grupo de docentes y una
+    fracción de docentes no puede dictar un día completo.
+    Devuelve (cargas, indisponible).
+    """
+    rnd = random.Random(semilla)
+    bloques = dias * horas_por_dia
+    objetivo = int(bloques * ocupacion)
+    horas_curso = [objetivo // cursos + (1 if i < objetivo % cursos else 0) for i in range(cursos)]
+
+    cargas = []
+    indisponible = {}
+    id_docente = 0
+    for curso, horas in enumerate(horas_curso):
+        por_docente = max(carga_max_docente // horas, 1)
+        docentes = []
+        for _ in range(-(-secciones // por_docente)):
+            id_docente += 1
+            docentes.append(id_docente)
+            if rnd.random() < indisponibles:
+                dia = rnd.randrange(dias)
+                indisponible[id_docente] = ((1 << horas_por_dia) - 1) << (dia * horas_por_dia)
+        for s in range(secciones):
+            cargas.append({
+                "id_carga": len(cargas) + 1,
+                "id_seccion": s + 1,
+                "id_docente": docentes[s // por_docente],
+                "horas": horas
+            })
+    return cargas, indisponible
+
+
+def benchmark(tamanos=(10, 25, 50, 100), dias: int = 5, horas_por_dia: int = 7):
+    resultados = []
+    for secciones in tamanos:
+        cargas, indisponible = escuela_sintetica(secciones, dias=dias, horas_por_dia=horas_por_dia)
+        resultado = GeneradorHorario(dias, horas_por_dia, cargas, indisponible).resolver()
+        resultados.append({"secciones": secciones, "cargas": len(cargas), **resultado["metricas"]})
+    return resultados
+
+
+if __name__ == "__main__":
+    tamanos = [int(x) for x in sys.argv[1:]] or [10, 25, 50, 100]
+    for fila in benchmark(tamanos):
+        print(fila)
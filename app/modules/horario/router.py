@@ -5,7 +5,10 @@ from datetime import time
 from app.db.database import get_db
 from app.modules.horario.models import HorarioEscolar, HoraLectiva
 from app.modules.management.models import CargaAcademica
-from app.modules.horario.schemas import HorarioCreate, HorarioResponse, HoraLectivaResponse
+from app.modules.horario.schemas import (
+    HorarioCreate, HorarioSemanaCreate, HorarioResponse, HoraLectivaResponse, GeneradorHorarioRequest
+)
+from app.modules.horario.service import HorarioService, HorarioVistaService
 from app.modules.academic.models import Seccion
 from app.modules.enrollment.models import Matricula
 from app.modules.users.alumno.models import Alumno
@@ -23,83 +26,73 @@ def obtener_horas_lectivas(db: Session = Depends(get_db)):
 # --- HORARIO POR SECCIÓN ---
 @router.get("/seccion/{id_seccion}", response_model=List[HorarioResponse])
 def obtener_horario_seccion(id_seccion: int, db: Session = Depends(get_db)):
-    # Join explícito para evitar el error de Mapper
-    horarios = db.query(HorarioEscolar).join(
-        CargaAcademica, HorarioEscolar.id_carga_academica == CargaAcademica.id_carga_academica
-    ).filter(CargaAcademica.id_seccion == id_seccion).all()
-    
-    resultado = []
-    for h in horarios:
-        # Importante: Manejar si dia_semana es un Enum o String
-        dia = h.dia_semana.value if hasattr(h.dia_semana, 'value') else h.dia_semana
-        
-        resultado.append({
-            "id_horario": h.id_horario,
-            "id_hora": h.id_hora,
-            "dia_semana": dia,
-            "id_carga_academica": h.id_carga_academica,
-            "curso_nombre": h.carga.curso.nombre,
-            "docente_nombre": f"{h.carga.docente.nombres} {h.carga.docente.apellidos}",
-            "seccion_nombre": h.carga.seccion.nombre
-        })
-    return resultado
+    # Una sola consulta con curso/docente/sección unidos, cacheada hasta que cambie el horario
+    return HorarioVistaService.por_seccion(db, id_seccion)
 
 # --- GUARDAR / ACTUALIZAR BLOQUE ---
 @router.post("/", status_code=status.HTTP_201_CREATED)
 def asignar_bloque_horario(horario_in: HorarioCreate, db: Session = Depends(get_db)):
-    # 1. Validar bloque de hora
-    bloque_hora = db.query(HoraLectiva).filter(HoraLectiva.id_hora == horario_in.id_hora).first()
-    if not bloque_hora:
-        raise HTTPException(status_code=404, detail="Bloque de hora no encontrado")
-
-    # 2. Validar que no sea receso (No se puede dictar clases en recreo)
-    if bloque_hora.tipo.lower() == "receso":
-        raise HTTPException(status_code=400, detail="No se pueden asignar materias en horas de receso")
-
-    # 3. Obtener carga académica
-    carga_actual = db.query(CargaAcademica).filter(
-        CargaAcademica.id_carga_academica == horario_in.id_carga_academica
-    ).first()
-    
-    if not carga_actual:
+    # Los conflictos (receso, docente ocupado, sección ocupada) se validan contra
+    # el índice de ocupación del año de la carga, sin consultas por bloque
+    id_anio = HorarioService.anio_de_carga(db, horario_in.id_carga_academica)
+    if not id_anio:
         raise HTTPException(status_code=404, detail="La carga académica no existe")
 
-    # 4. VALIDACIÓN DE CONFLICTO DOCENTE (Join explícito)
-    conflicto = db.query(HorarioEscolar).join(
-        CargaAcademica, HorarioEscolar.id_carga_academica == CargaAcademica.id_carga_academica
-    ).filter(
-        CargaAcademica.id_docente == carga_actual.id_docente,
-        HorarioEscolar.dia_semana == horario_in.dia_semana,
-        HorarioEscolar.id_hora == horario_in.id_hora
-    ).first()
+    errores, _, _ = HorarioService.guardar_bloques(db, id_anio, [horario_in])
+    if errores:
+        raise HTTPException(status_code=errores[0]["status_code"], detail=errores[0]["detail"])
+    return {"message": "Horario asignado correctamente"}
+
 
-    if conflicto:
+# --- GUARDAR GRILLA SEMANAL COMPLETA ---
+@router.put("/seccion/{id_seccion}/semana")
+def guardar_semana_seccion(id_seccion: int, semana: HorarioSemanaCreate, db: Session = Depends(get_db)):
+    """
+    Reemplaza toda la grilla semanal de la sección en una sola transacción.
+    Si algún bloque no es válido no se guarda nada y se devuelven todos los errores.
+    """
+    seccion = db.query(Seccion.id_anio_escolar).filter(Seccion.id_seccion == id_seccion).first()
+    if not seccion:
+        raise HTTPException(status_code=404, detail="Sección no encontrada")
+
+    errores, creados, eliminados = HorarioService.guardar_bloques(
+        db, seccion.id_anio_escolar, semana.bloques, id_seccion_reemplazada=id_seccion
+    )
+    if errores and errores[0]["indice"] is None:
+        # No es un error de la grilla: otro worker tiene tomado el año
+        raise HTTPException(status_code=errores[0]["status_code"], detail=errores[0]["detail"])
+    if errores:
         raise HTTPException(
             status_code=400,
-            detail=f"Conflicto: El docente ya dicta clases en {conflicto.carga.seccion.nombre} en este horario."
+            detail={
+                "message": "La grilla tiene conflictos, no se guardó ningún bloque",
+                "errores": [{"indice": e["indice"], "detail": e["detail"]} for e in errores]
+            }
         )
+    return {"message": "Horario semanal guardado", "creados": creados, "eliminados": eliminados}
 
-    # 5. Evitar aula ocupada (Faltaba el join explícito aquí)
-    aula_ocupada = db.query(HorarioEscolar).join(
-        CargaAcademica, HorarioEscolar.id_carga_academica == CargaAcademica.id_carga_academica
-    ).filter(
-        CargaAcademica.id_seccion == carga_actual.id_seccion,
-        HorarioEscolar.dia_semana == horario_in.dia_semana,
-        HorarioEscolar.id_hora == horario_in.id_hora
-    ).first()
-
-    if aula_ocupada:
-        raise HTTPException(status_code=400, detail="Esta sección ya tiene una materia asignada en este bloque")
-
-    # 6. Guardar (Asegúrate de que los nombres de campos coincidan con tu Model)
-    nuevo_horario = HorarioEscolar(
-        id_carga_academica=horario_in.id_carga_academica,
-        id_hora=horario_in.id_hora,
-        dia_semana=horario_in.dia_semana
-    )
-    db.add(nuevo_horario)
-    db.commit()
-    return {"message": "Horario asignado correctamente"}
+
+# --- GENERADOR AUTOMÁTICO ---
+@router.post("/generar/{id_anio_escolar}")
+def generar_horario_anio(id_anio_escolar: str, parametros: GeneradorHorarioRequest, db: Session = Depends(get_db)):
+    """
+    Genera el horario de todas las secciones del año a partir de sus cargas
+    académicas. Por defecto solo previsualiza; con 'guardar' reemplaza los
+    horarios del año en bloque (únicamente si se pudieron colocar todas las horas).
+    """
+    resultado = HorarioService.generar(db, id_anio_escolar, parametros)
+    if parametros.guardar and not resultado["guardado"] and not resultado["no_asignadas"]:
+        raise HTTPException(status_code=409, detail="Se están guardando otros horarios de este año, intenta de nuevo.")
+    if parametros.guardar and not resultado["guardado"]:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": "No se pudieron colocar todas las horas; el horario no se guardó",
+                "metricas": resultado["metricas"],
+                "no_asignadas": resultado["no_asignadas"]
+            }
+        )
+    return resultado
 
 
 @router.delete("/{id_horario}")
@@ -107,8 +100,7 @@ def eliminar_bloque_horario(id_horario: int, db: Session = Depends(get_db)):
     db_horario = db.query(HorarioEscolar).filter(HorarioEscolar.id_horario == id_horario).first()
     if not db_horario:
         raise HTTPException(status_code=404, detail="No se encontró el bloque")
-    db.delete(db_horario)
-    db.commit()
+    HorarioService.eliminar_bloque(db, db_horario)
     return {"message": "Bloque eliminado"}
 
 
@@ -138,7 +130,6 @@ def obtener_horario_por_usuario(
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    horarios = []
     rol = usuario.rol.upper()  # Aseguramos consistencia
 
     # 2. Lógica según el rol del usuario
@@ -163,38 +154,15 @@ def obtener_horario_por_usuario(
                 detail="El alumno no tiene una matrícula registrada para el año escolar seleccionado"
             )
 
-        # 3. Lógica para obtener los horarios (se mantiene igual)
-        id_seccion = matricula.id_seccion
-        
-        horarios = db.query(HorarioEscolar).join(
-            CargaAcademica, HorarioEscolar.id_carga_academica == CargaAcademica.id_carga_academica
-        ).filter(CargaAcademica.id_seccion == id_seccion).all()
+        # 3. Horario de su sección (cacheado)
+        return HorarioVistaService.por_seccion(db, matricula.id_seccion)
     elif rol == "DOCENTE":
         docente = db.query(Docente).filter(Docente.id_usuario == id_usuario).first()
         if not docente:
             raise HTTPException(status_code=404, detail="Docente no vinculado a este usuario")
 
-        # Filtramos horarios donde el docente tiene carga en el año escolar dado
-        horarios = db.query(HorarioEscolar).join(CargaAcademica).join(Seccion).filter(
-            CargaAcademica.id_docente == docente.id_docente,
-            Seccion.id_anio_escolar == id_anio_escolar
-        ).all()
+        # Horarios donde el docente tiene carga en el año escolar dado (cacheado)
+        return HorarioVistaService.por_docente(db, docente.id_docente, id_anio_escolar)
     
     else:
         raise HTTPException(status_code=400, detail=f"Rol '{rol}' no soportado para consulta de horarios")
-
-    # 3. Mapeo común a la respuesta
-    resultado = []
-    for h in horarios:
-        dia = h.dia_semana.value if hasattr(h.dia_semana, 'value') else h.dia_semana
-        resultado.append({
-            "id_horario": h.id_horario,
-            "id_hora": h.id_hora,
-            "dia_semana": dia,
-            "id_carga_academica": h.id_carga_academica,
-            "curso_nombre": h.carga.curso.nombre,
-            "docente_nombre": f"{h.carga.docente.nombres} {h.carga.docente.apellidos}",
-            "seccion_nombre": h.carga.seccion.nombre
-        })
-    
-    return resultado
\ No newline at end of file
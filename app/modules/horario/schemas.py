@@ -1,6 +1,6 @@
 from pydantic import BaseModel, ConfigDict,Field, model_validator, field_validator
 from datetime import time
-from typing import Optional, List, Literal
+from typing import Optional, List, Literal, Dict
 
 # --- Hora Lectiva (Los bloques de tiempo) ---
 class HoraLectivaBase(BaseModel):
@@ -23,6 +23,10 @@ class HorarioCreate(BaseModel):
     id_hora: int
     dia_semana: Literal["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
 
+# Grilla semanal completa de una sección (reemplaza la actual)
+class HorarioSemanaCreate(BaseModel):
+    bloques: List[HorarioCreate]
+
 class HorarioResponse(BaseModel):
     id_horario: int
     id_hora: int
@@ -43,4 +47,19 @@ class MateriaDisponibleResponse(BaseModel):
     docente_nombre: str = Field(..., min_length=2, max_length=250)
     horas_semanales: int = Field(default=0, ge=0, le=100)
     
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+# --- Generador automático ---
+class IndisponibilidadDocente(BaseModel):
+    id_docente: int
+    dia_semana: Literal["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado"]
+    id_hora: Optional[int] = None # Sin hora = todo el día
+
+class GeneradorHorarioRequest(BaseModel):
+    dias: List[Literal["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado"]] = [
+        "Lunes", "Martes", "Miércoles", "Jueves", "Viernes"
+    ]
+    horas_por_defecto: int = Field(default=2, ge=0, le=40) # Horas semanales si el curso no está en el mapa
+    horas_por_curso: Dict[int, int] = {} # id_curso -> horas semanales
+    indisponibilidad: List[IndisponibilidadDocente] = []
+    conservar_existentes: bool = False # True: los bloques ya guardados se respetan y cuentan como horas
+    guardar: bool = False # False: solo previsualiza
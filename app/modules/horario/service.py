@@ -0,0 +1,527 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import func, insert, text
+from sqlalchemy.orm import Session
+from app.modules.management.models import CargaAcademica
+from app.modules.academic.models import Seccion, Curso
+from app.modules.users.docente.models import Docente
+from .models import HorarioEscolar, HoraLectiva, DiaSemana
+from .generador import GeneradorHorario
+
+
+DIAS = [d.value for d in DiaSemana]
+# Segundos que una escritura espera el lock del año tomado por otro worker (MySQL GET_LOCK)
+HORARIO_LOCK_ESPERA_S = int(os.getenv("HORARIO_LOCK_ESPERA_S", "10"))
+
+
+class IndiceOcupacionAnio:
+    """
+    Ocupación de un año escolar como bitsets (un int de Python por docente y
+    por sección). El bit de (día, hora) es: índice_día * horas_por_dia + posición_hora.
+    """
+
+    def __init__(self, id_anio: str, horas: list, cargas: list, secciones: list, horarios: list):
+        self.id_anio = id_anio
+        self.tipo_hora = {h.id_hora: (h.tipo or "clase").lower() for h in horas}
+        self.posicion_hora = {h.id_hora: i for i, h in enumerate(horas)}
+        self.horas_por_dia = max(len(horas), 1)
+        self.carga = {c.id_carga_academica: (c.id_docente, c.id_seccion) for c in cargas}
+        self.nombre_seccion = {s.id_seccion: s.nombre for s in secciones}
+
+        self.bits_docente = {}      # id_docente -> int
+        self.bits_seccion = {}      # id_seccion -> int
+        self.seccion_de_docente = {}  # (id_docente, bit) -> id_seccion (para el mensaje de conflicto)
+        self.bloques = {}           # id_horario -> (id_carga, bit)
+        for h in horarios:
+            self.marcar(h.id_horario, h.id_carga_academica, h.dia_semana, h.id_hora)
+
+    def bit(self, dia, id_hora: int):
+        dia = dia.value if hasattr(dia, "value") else dia
+        return DIAS.index(dia) * self.horas_por_dia + self.posicion_hora[id_hora]
+
+    def marcar(self, id_horario: int, id_carga: int, dia, id_hora: int):
+        if id_carga not in self.carga or id_hora not in self.posicion_hora:
+            return
+        id_docente, id_seccion = self.carga[id_carga]
+        b = self.bit(dia, id_hora)
+        mascara = 1 << b
+        if id_docente is not None:
+            self.bits_docente[id_docente] = self.bits_docente.get(id_docente, 0) | mascara
+            self.seccion_de_docente[(id_docente, b)] = id_seccion
+        self.bits_seccion[id_seccion] = self.bits_seccion.get(id_seccion, 0) | mascara
+        self.bloques[id_horario] = (id_carga, b)
+
+    def desmarcar(self, id_horario: int):
+        bloque = self.bloques.pop(id_horario, None)
+        if not bloque:
+            return
+        id_carga, b = bloque
+        id_docente, id_seccion = self.carga[id_carga]
+        mascara = ~(1 << b)
+        if id_docente is not None:
+            self.bits_docente[id_docente] = self.bits_docente.get(id_docente, 0) & mascara
+            self.seccion_de_docente.pop((id_docente, b), None)
+        self.bits_seccion[id_seccion] = self.bits_seccion.get(id_seccion, 0) & mascara
+
+    def validar(self, bloques: list, id_seccion_reemplazada: int = None):
+        """
+        Valida una lista de bloques (HorarioCreate) contra la ocupación actual y
+        entre sí. Si se indica id_seccion_reemplazada, la grilla actual de esa
+        sección no cuenta (se va a reemplazar por 'bloques').
+        Devuelve la lista de errores: {"indice", "status_code", "detail"}.
+        """
+        bits_docente = dict(self.bits_docente)
+        bits_seccion = dict(self.bits_seccion)
+        seccion_de_docente = dict(self.seccion_de_docente)
+
+        if id_seccion_reemplazada is not None:
+            bits_seccion[id_seccion_reemplazada] = 0
+            for id_carga, b in self.bloques.values():
+                id_docente, id_seccion = self.carga[id_carga]
+                if id_seccion == id_seccion_reemplazada and id_docente is not None:
+                    bits_docente[id_docente] &= ~(1 << b)
+                    seccion_de_docente.pop((id_docente, b), None)
+
+        errores = []
+
+        def error(i, status_code, detail):
+            errores.append({"indice": i, "status_code": status_code, "detail": detail})
+
+        for i, bloque in enumerate(bloques):
+            if bloque.id_hora not in self.tipo_hora:
+                error(i, 404, "Bloque de hora no encontrado")
+                continue
+            if self.tipo_hora[bloque.id_hora] == "receso":
+                error(i, 400, "No se pueden asignar materias en horas de receso")
+                continue
+            if bloque.id_carga_academica not in self.carga:
+                error(i, 404, "La carga académica no existe")
+                continue
+            if bloque.dia_semana not in DIAS:
+                error(i, 400, f"Día no válido: {bloque.dia_semana}")
+                continue
+
+            id_docente, id_seccion = self.carga[bloque.id_carga_academica]
+            if id_seccion_reemplazada is not None and id_seccion != id_seccion_reemplazada:
+                error(i, 400, "La carga académica no pertenece a esta sección")
+                continue
+
+            b = self.bit(bloque.dia_semana, bloque.id_hora)
+            mascara = 1 << b
+            if id_docente is not None and bits_docente.get(id_docente, 0) & mascara:
+                otra = self.nombre_seccion.get(seccion_de_docente.get((id_docente, b)), "otra sección")
+                error(i, 400, f"Conflicto: El docente ya dicta clases en {otra} en este horario.")
+                continue
+            if bits_seccion.get(id_seccion, 0) & mascara:
+                error(i, 400, "Esta sección ya tiene una materia asignada en este bloque")
+                continue
+
+            # Ocupamos el bloque para detectar choques dentro del mismo lote
+            if id_docente is not None:
+                bits_docente[id_docente] = bits_docente.get(id_docente, 0) | mascara
+                seccion_de_docente[(id_docente, b)] = id_seccion
+            bits_seccion[id_seccion] = bits_seccion.get(id_seccion, 0) | mascara
+
+        return errores
+
+
+class OcupacionHorarioIndex:
+    """
+    Índices de ocupación por año escolar, cargados una vez y actualizados al
+    confirmar cada escritura. Dentro de un worker las escrituras se serializan
+    con self.lock; entre workers, con bloqueo_anio() (validar + commit + marcar),
+    así dos asignaciones simultáneas no pueden ocupar el mismo bloque.
+    Para detectar escrituras de otros workers se guarda, por año, una firma
+    barata de sus horarios (COUNT, MAX(id)) y de sus cargas (COUNT y sumas de
+    docente y sección ponderadas por id, que cambian si a una carga le cambian
+    el docente); si no coincide, se reconstruye ese año. Como red de seguridad
+    los índices expiran cada TTL_SEGUNDOS.
+    """
+    TTL_SEGUNDOS = 300
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._indices = {}   # id_anio -> IndiceOcupacionAnio
+        self._firmas = {}    # id_anio -> (((count, max) de horarios, firma de cargas), instante)
+
+    def invalidar(self, id_anio: str = None):
+        with self.lock:
+            if id_anio is None:
+                self._indices.clear()
+                self._firmas.clear()
+            else:
+                self._indices.pop(id_anio, None)
+                self._firmas.pop(id_anio, None)
+
+    @staticmethod
+    def _leer_firma(db: Session, id_anio: str):
+        C = CargaAcademica
+        horario = db.query(func.count(HorarioEscolar.id_horario), func.max(HorarioEscolar.id_horario)).join(
+            C, HorarioEscolar.id_carga_academica == C.id_carga_academica
+        ).filter(C.id_anio_escolar == id_anio).one()
+        cargas = db.query(
+            func.count(C.id_carga_academica),
+            func.sum(C.id_carga_academica * func.coalesce(C.id_docente, 0)),
+            func.sum(C.id_carga_academica * func.coalesce(C.id_seccion, 0))
+        ).filter(C.id_anio_escolar == id_anio).one()
+        return ((horario[0], horario[1]), tuple(cargas))
+
+    @contextmanager
+    def bloqueo_anio(self, db: Session, id_anio: str):
+        """
+        Serializa las escrituras de un año entre workers con GET_LOCK de MySQL.
+        Va en una conexión aparte: el commit de la Session devuelve la suya al
+        pool y el lock quedaría tomado en ella. Cede False si no se obtuvo a tiempo.
+        """
+        with self.lock:
+            bind = db.get_bind()
+            if bind.dialect.name != "mysql":
+                yield True # Sin GET_LOCK (p. ej. SQLite en desarrollo): un solo worker
+                return
+            nombre = f"horario_{id_anio}"
+            with bind.connect() as conexion:
+                obtenido = conexion.execute(
+                    text("SELECT GET_LOCK(:nombre, :espera)"), {"nombre": nombre, "espera": HORARIO_LOCK_ESPERA_S}
+                ).scalar() == 1
+                try:
+                    yield obtenido
+                finally:
+                    if obtenido:
+                        conexion.execute(text("SELECT RELEASE_LOCK(:nombre)"), {"nombre": nombre})
+
+    def anio_conocido(self, id_carga: int):
+        """Año de la carga si algún índice cargado la conoce (sin consultar la base)."""
+        with self.lock:
+            for id_anio, indice in self._indices.items():
+                if id_carga in indice.carga:
+                    return id_anio
+        return None
+
+    def _construir(self, db: Session, id_anio: str):
+        horas = db.query(HoraLectiva).order_by(HoraLectiva.hora_inicio, HoraLectiva.id_hora).all()
+        cargas = db.query(
+            CargaAcademica.id_carga_academica, CargaAcademica.id_docente, CargaAcademica.id_seccion
+        ).filter(CargaAcademica.id_anio_escolar == id_anio).all()
+        secciones = db.query(Seccion.id_seccion, Seccion.nombre).filter(Seccion.id_anio_escolar == id_anio).all()
+        horarios = db.query(
+            HorarioEscolar.id_horario, HorarioEscolar.id_carga_academica,
+            HorarioEscolar.dia_semana, HorarioEscolar.id_hora
+        ).join(
+            CargaAcademica, HorarioEscolar.id_carga_academica == CargaAcademica.id_carga_academica
+        ).filter(CargaAcademica.id_anio_escolar == id_anio).all()
+        return IndiceOcupacionAnio(id_anio, horas, cargas, secciones, horarios)
+
+    def obtener(self, db: Session, id_anio: str, forzar: bool = False):
+        """Índice del año, al día con la base. Para escribir, tomar antes self.lock."""
+        with self.lock:
+            firma = self._leer_firma(db, id_anio)
+            anterior, firmado_en = self._firmas.get(id_anio, (None, None))
+            vencido = firmado_en is None or time.monotonic() - firmado_en > self.TTL_SEGUNDOS
+            if firma != anterior or vencido:
+                self._indices.pop(id_anio, None)
+                self._firmas[id_anio] = (firma, time.monotonic())
+            if forzar or id_anio not in self._indices:
+                self._indices[id_anio] = self._construir(db, id_anio)
+            return self._indices[id_anio]
+
+    def obtener_para(self, db: Session, id_anio: str, bloques: list):
+        """
+        Como obtener(), pero si algún bloque referencia una hora o carga que el
+        índice no conoce (creada después de construirlo), lo reconstruye una vez.
+        """
+        indice = self.obtener(db, id_anio)
+        if any(b.id_hora not in indice.tipo_hora or b.id_carga_academica not in indice.carga for b in bloques):
+            indice = self.obtener(db, id_anio, forzar=True)
+        return indice
+
+    def registrar_cambios(self, id_anio: str, insertados: list, eliminados: list):
+        """
+        Aplica al índice lo que ya se confirmó en la base y actualiza la firma.
+        insertados: tuplas (id_horario, id_carga, dia, id_hora); eliminados: ids.
+        """
+        with self.lock:
+            if id_anio not in self._firmas:
+                return
+            ((total, maximo), firma_cargas), firmado_en = self._firmas[id_anio]
+            if maximo is not None and maximo in eliminados:
+                # Ya no sabemos el nuevo máximo: la próxima lectura reconstruye
+                self.invalidar(id_anio)
+                return
+
+            indice = self._indices.get(id_anio)
+            if indice:
+                for id_horario in eliminados:
+                    indice.desmarcar(id_horario)
+                for bloque in insertados:
+                    indice.marcar(*bloque)
+
+            ids = [b[0] for b in insertados] + ([maximo] if maximo is not None else [])
+            self._firmas[id_anio] = (
+                ((total + len(insertados) - len(eliminados), max(ids, default=None)), firma_cargas), firmado_en
+            )
+
+
+# Instancia única para ser importada en otros archivos
+ocupacion_horario = OcupacionHorarioIndex()
+
+
+class HorarioVistaCache:
+    """
+    Horarios ya armados (filas de HorarioResponse) por ('seccion', id_seccion) y
+    ('docente', id_docente, id_anio). Se limpia completo ante cualquier escritura
+    de HorarioEscolar o de las cargas; el TTL cubre escrituras de otros workers.
+    """
+    TTL_SEGUNDOS = 300
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = {} # clave -> (instante, filas)
+
+    def invalidar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def obtener(self, clave: tuple, cargar):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada and time.monotonic() - entrada[0] <= self.TTL_SEGUNDOS:
+                return entrada[1]
+        filas = cargar()
+        with self._lock:
+            self._entradas[clave] = (time.monotonic(), filas)
+        return filas
+
+
+# Instancia única para ser importada en otros archivos
+horarios_vista = HorarioVistaCache()
+
+
+class HorarioVistaService:
+    @staticmethod
+    def _consultar(db: Session, *filtros):
+        """Una sola consulta con curso, docente y sección ya unidos (sin lazy loads)."""
+        filas = db.query(
+            HorarioEscolar.id_horario,
+            HorarioEscolar.id_hora,
+            HorarioEscolar.dia_semana,
+            HorarioEscolar.id_carga_academica,
+            Curso.nombre.label("curso_nombre"),
+            Docente.nombres.label("docente_nombres"),
+            Docente.apellidos.label("docente_apellidos"),
+            Seccion.nombre.label("seccion_nombre")
+        ).join(
+            CargaAcademica, HorarioEscolar.id_carga_academica == CargaAcademica.id_carga_academica
+        ).join(Seccion, Seccion.id_seccion == CargaAcademica.id_seccion)\
+            .outerjoin(Curso, Curso.id_curso == CargaAcademica.id_curso)\
+            .outerjoin(Docente, Docente.id_docente == CargaAcademica.id_docente)\
+            .filter(*filtros)\
+            .order_by(HorarioEscolar.id_horario).all()
+
+        return [
+            {
+                "id_horario": f.id_horario,
+                "id_hora": f.id_hora,
+                # Manejar si dia_semana es un Enum o String
+                "dia_semana": f.dia_semana.value if hasattr(f.dia_semana, "value") else f.dia_semana,
+                "id_carga_academica": f.id_carga_academica,
+                "curso_nombre": f.curso_nombre,
+                "docente_nombre": f"{f.docente_nombres or ''} {f.docente_apellidos or ''}".strip(),
+                "seccion_nombre": f.seccion_nombre
+            }
+            for f in filas
+        ]
+
+    @staticmethod
+    def por_seccion(db: Session, id_seccion: int):
+        # La sección ya pertenece a un único año escolar
+        return horarios_vista.obtener(
+            ("seccion", id_seccion),
+            lambda: HorarioVistaService._consultar(db, CargaAcademica.id_seccion == id_seccion)
+        )
+
+    @staticmethod
+    def por_docente(db: Session, id_docente: int, id_anio: str):
+        return horarios_vista.obtener(
+            ("docente", id_docente, id_anio),
+            lambda: HorarioVistaService._consultar(
+                db, CargaAcademica.id_docente == id_docente, Seccion.id_anio_escolar == id_anio
+            )
+        )
+
+
+class HorarioService:
+    @staticmethod
+    def anio_de_carga(db: Session, id_carga: int):
+        # Si algún índice ya conoce la carga, no hace falta consultarla
+        id_anio = ocupacion_horario.anio_conocido(id_carga)
+        if id_anio is not None:
+            return id_anio
+        fila = db.query(CargaAcademica.id_anio_escolar).filter(
+            CargaAcademica.id_carga_academica == id_carga
+        ).first()
+        return fila.id_anio_escolar if fila else None
+
+    @staticmethod
+    def guardar_bloques(db: Session, id_anio: str, bloques: list, id_seccion_reemplazada: int = None):
+        """
+        Valida y guarda bloques en una sola transacción. Con id_seccion_reemplazada
+        reemplaza la grilla semanal completa de esa sección.
+        Devuelve (errores, creados, eliminados); si hay errores no se guarda nada.
+        """
+        with ocupacion_horario.bloqueo_anio(db, id_anio) as obtenido:
+            if not obtenido:
+                return [{"indice": None, "status_code": 409,
+                         "detail": "Se están guardando otros horarios de este año, intenta de nuevo."}], 0, 0
+            indice = ocupacion_horario.obtener_para(db, id_anio, bloques)
+            errores = indice.validar(bloques, id_seccion_reemplazada)
+            if errores:
+                return errores, 0, 0
+
+            eliminados = []
+            if id_seccion_reemplazada is not None:
+                eliminados = [
+                    id_horario for id_horario, (id_carga, _) in indice.bloques.items()
+                    if indice.carga[id_carga][1] == id_seccion_reemplazada
+                ]
+
+            nuevos = [
+                HorarioEscolar(
+                    id_carga_academica=b.id_carga_academica,
+                    id_hora=b.id_hora,
+                    dia_semana=b.dia_semana
+                )
+                for b in bloques
+            ]
+            try:
+                if eliminados:
+                    db.query(HorarioEscolar).filter(
+                        HorarioEscolar.id_horario.in_(eliminados)
+                    ).delete(synchronize_session=False)
+                db.add_all(nuevos)
+                db.flush() # Obtenemos los id_horario antes de que el commit expire los objetos
+                insertados = [
+                    (n.id_horario, n.id_carga_academica, n.dia_semana, n.id_hora) for n in nuevos
+                ]
+                db.commit()
+            except Exception:
+                db.rollback()
+                ocupacion_horario.invalidar(id_anio)
+                raise
+
+            ocupacion_horario.registrar_cambios(id_anio, insertados, eliminados)
+            horarios_vista.invalidar()
+            return [], len(nuevos), len(eliminados)
+
+    @staticmethod
+    def eliminar_bloque(db: Session, db_horario: HorarioEscolar):
+        with ocupacion_horario.lock:
+            id_horario = db_horario.id_horario
+            id_anio = HorarioService.anio_de_carga(db, db_horario.id_carga_academica)
+            db.delete(db_horario)
+            db.commit()
+            ocupacion_horario.registrar_cambios(id_anio, [], [id_horario])
+            horarios_vista.invalidar()
+
+    @staticmethod
+    def generar(db: Session, id_anio: str, parametros):
+        """
+        Genera el horario de todas las cargas del año con GeneradorHorario.
+        Con parametros.guardar y sin lecciones pendientes, reemplaza en bloque los
+        horarios del año (o solo completa, si conservar_existentes).
+        """
+        horas_clase = [
+            h.id_hora for h in db.query(HoraLectiva).order_by(HoraLectiva.hora_inicio, HoraLectiva.id_hora).all()
+            if (h.tipo or "clase").lower() != "receso"
+        ]
+        cargas = db.query(
+            CargaAcademica.id_carga_academica, CargaAcademica.id_seccion,
+            CargaAcademica.id_docente, CargaAcademica.id_curso
+        ).filter(CargaAcademica.id_anio_escolar == id_anio).all()
+
+        dias = list(parametros.dias)
+        posicion = {id_hora: i for i, id_hora in enumerate(horas_clase)}
+        n_horas = len(horas_clase)
+
+        def bit(dia, id_hora):
+            dia = dia.value if hasattr(dia, "value") else dia
+            if dia not in dias or id_hora not in posicion:
+                return None
+            return dias.index(dia) * n_horas + posicion[id_hora]
+
+        indisponible = {}
+        for ind in parametros.indisponibilidad:
+            horas = [ind.id_hora] if ind.id_hora is not None else horas_clase
+            for id_hora in horas:
+                b = bit(ind.dia_semana, id_hora)
+                if b is not None:
+                    indisponible[ind.id_docente] = indisponible.get(ind.id_docente, 0) | (1 << b)
+
+        fijos = []
+        ids_cargas = [c.id_carga_academica for c in cargas]
+        if parametros.conservar_existentes and ids_cargas:
+            existentes = db.query(
+                HorarioEscolar.id_carga_academica, HorarioEscolar.dia_semana, HorarioEscolar.id_hora
+            ).filter(HorarioEscolar.id_carga_academica.in_(ids_cargas)).all()
+            fijos = [
+                (e.id_carga_academica, bit(e.dia_semana, e.id_hora)) for e in existentes
+                if bit(e.dia_semana, e.id_hora) is not None
+            ]
+
+        generador = GeneradorHorario(
+            len(dias), n_horas,
+            [
+                {
+                    "id_carga": c.id_carga_academica,
+                    "id_seccion": c.id_seccion,
+                    "id_docente": c.id_docente,
+                    "horas": parametros.horas_por_curso.get(c.id_curso, parametros.horas_por_defecto)
+                }
+                for c in cargas
+            ],
+            indisponible, fijos
+        )
+        resultado = generador.resolver()
+
+        bloques = [
+            {
+                "id_carga_academica": id_carga,
+                "id_hora": horas_clase[b % n_horas],
+                "dia_semana": dias[b // n_horas]
+            }
+            for id_carga, b in resultado["asignaciones"]
+        ]
+        no_asignadas = [
+            {"id_carga_academica": id_carga, "horas_faltantes": faltan}
+            for id_carga, faltan in resultado["no_colocadas"].items()
+        ]
+
+        guardado = False
+        if parametros.guardar and not no_asignadas:
+            with ocupacion_horario.bloqueo_anio(db, id_anio) as obtenido:
+                # Sin el lock del año no se guarda: el router lo informa como conflicto
+                if obtenido:
+                    try:
+                        if not parametros.conservar_existentes and ids_cargas:
+                            db.query(HorarioEscolar).filter(
+                                HorarioEscolar.id_carga_academica.in_(ids_cargas)
+                            ).delete(synchronize_session=False)
+                        if bloques:
+                            db.execute(insert(HorarioEscolar), bloques)
+                        db.commit()
+                    except Exception:
+                        db.rollback()
+                        raise
+                    finally:
+                        ocupacion_horario.invalidar(id_anio)
+                        horarios_vista.invalidar()
+                    guardado = True
+
+        return {
+            "id_anio_escolar": id_anio,
+            "guardado": guardado,
+            "metricas": resultado["metricas"],
+            "no_asignadas": no_asignadas,
+            "bloques": bloques
+        }
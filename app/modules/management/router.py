@@ -2,7 +2,6 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func
 from typing import List
-from datetime import datetime, date
 from app.db.database import get_db
 from app.modules.academic import models as models_ac
 from app.modules.users.alumno import models as models_al
@@ -10,10 +9,10 @@ from app.modules.users.docente import models as models_doc
 from app.modules.enrollment import models as models_en
 from app.modules.virtual import models as models_vr
 from app.modules.management import models as models_mn
-from app.modules.finance import models as models_fi
-from app.modules.web import models as models_web
-from app.modules.behavior import models as models_psi
 from . import models, schemas
+from .service import NotificacionesService, VinculosAcademicosService
+from app.modules.virtual.service import permisos_chat, cursos_alumno
+from app.modules.horario.service import ocupacion_horario, horarios_vista
 
 
 router = APIRouter(prefix="/gestion", tags=["Gestión Académica"])
@@ -24,6 +23,10 @@ def asignar_carga(carga: schemas.CargaCreate, db: Session = Depends(get_db)):
     nueva = models.CargaAcademica(**carga.model_dump())
     db.add(nueva)
     db.commit()
+    permisos_chat.invalidar()
+    cursos_alumno.invalidar()
+    ocupacion_horario.invalidar()
+    horarios_vista.invalidar()
     db.refresh(nueva)
     return nueva
 
@@ -223,39 +226,15 @@ def listar_vinculos_para_asignacion(anio_id: str, db: Session = Depends(get_db))
     Obtiene todos los cursos por sección de un año escolar 
     y muestra qué docente tienen asignado (si lo hay).
     """
-    # 1. Buscamos todas las secciones del año escolar
-    secciones = db.query(models_ac.Seccion).filter(models_ac.Seccion.id_anio_escolar == anio_id).all()
-    
-    resultado = []
-    for seccion in secciones:
-        # 2. Por cada sección, vemos qué cursos le corresponden según su grado (Plan de Estudio)
-        cursos_plan = db.query(models_ac.Curso).join(
-            models_ac.PlanEstudio, models_ac.PlanEstudio.id_curso == models_ac.Curso.id_curso
-        ).filter(models_ac.PlanEstudio.id_grado == seccion.id_grado).all()
-
-        for curso in cursos_plan:
-            # 3. Buscamos si ya existe una carga académica (docente asignado)
-            carga = db.query(models.CargaAcademica).filter(
-                models.CargaAcademica.id_seccion == seccion.id_seccion,
-                models.CargaAcademica.id_curso == curso.id_curso,
-                models.CargaAcademica.id_anio_escolar == anio_id
-            ).first()
-
-            docente = None
-            if carga and carga.id_docente:
-                docente = db.query(models_doc.Docente).filter(models_doc.Docente.id_docente == carga.id_docente).first()
-
-            resultado.append({
-                "id_seccion": seccion.id_seccion,
-                "seccion_nombre": seccion.nombre,
-                "grado_nombre": seccion.grado.nombre, # Asumiendo relación en el modelo
-                "id_curso": curso.id_curso,
-                "curso_nombre": curso.nombre,
-                "id_carga_academica": carga.id_carga_academica if carga else None,
-                "docente": docente # Puede ser None
-            })
-    
-    return resultado
+    return VinculosAcademicosService.obtener_matriz(db, anio_id)
+
+@router.get("/vínculos-academicos/{anio_id}/agrupado", response_model=schemas.VinculosAgrupadosResponse)
+def listar_vinculos_agrupados(anio_id: str, db: Session = Depends(get_db)):
+    """
+    Misma matriz en formato compacto: secciones con sus cursos y cada docente
+    una sola vez en 'docentes' (los cursos lo referencian por id_docente).
+    """
+    return VinculosAcademicosService.agrupar(anio_id, VinculosAcademicosService.obtener_matriz(db, anio_id))
 
 @router.get("/docentes-disponibles/", response_model=List[schemas.DocenteBasicoResponse])
 def listar_docentes_busqueda(db: Session = Depends(get_db)):
@@ -272,6 +251,10 @@ def eliminar_carga(carga_id: int, db: Session = Depends(get_db)):
     
     db.delete(db_carga)
     db.commit()
+    permisos_chat.invalidar()
+    cursos_alumno.invalidar()
+    ocupacion_horario.invalidar()
+    horarios_vista.invalidar()
     return None
 
 @router.patch("/carga/{carga_id}", response_model=schemas.CargaResponse)
@@ -287,6 +270,10 @@ def actualizar_carga(carga_id: int, data: schemas.CargaUpdate, db: Session = Dep
         setattr(db_carga, key, value)
     
     db.commit()
+    permisos_chat.invalidar()
+    cursos_alumno.invalidar()
+    ocupacion_horario.invalidar()
+    horarios_vista.invalidar()
     db.refresh(db_carga)
     return db_carga
 
@@ -425,88 +412,6 @@ def obtener_resumen_docente(id_usuario: int, db: Session = Depends(get_db)):
 
 @router.get("/notificaciones/{id_usuario}")
 def obtener_notificaciones(id_usuario: int, db: Session = Depends(get_db)):
-    # 1. Obtener año activo
-    anio_activo = db.query(models_ac.AnioEscolar).filter(models_ac.AnioEscolar.activo == True).first()
-    if not anio_activo:
-        return {"notificaciones": []}
-    
-    notificaciones = []
-    hoy = datetime.now()
-
-    # --- A. DOCENTE ---
-    docente = db.query(models_doc.Docente).filter(models_doc.Docente.id_usuario == id_usuario).first()
-    if docente:
-        entregas = db.query(models_vr.EntregaTarea).join(models_vr.Tarea).join(models_mn.CargaAcademica)\
-            .filter(
-                models_mn.CargaAcademica.id_docente == docente.id_docente,
-                models_mn.CargaAcademica.id_anio_escolar == anio_activo.id_anio_escolar
-            ).order_by(models_vr.EntregaTarea.fecha_envio.desc()).limit(5).all()
-        
-        for e in entregas:
-            notificaciones.append({
-                "tipo": "entrega",
-                "mensaje": f"Nueva entrega: {e.alumno.nombres} en {e.tarea.titulo}",
-                "fecha": e.fecha_envio.isoformat()
-            })
-
-    # --- B. ALUMNO ---
-    alumno = db.query(models_al.Alumno).filter(models_al.Alumno.id_usuario == id_usuario).first()
-    if alumno:
-        calificaciones = db.query(models_vr.EntregaTarea)\
-            .filter(models_vr.EntregaTarea.id_alumno == alumno.id_alumno, models_vr.EntregaTarea.calificacion != None)\
-            .order_by(models_vr.EntregaTarea.fecha_envio.desc()).limit(3).all()
-        
-        for c in calificaciones:
-            notificaciones.append({
-                "tipo": "nota",
-                "mensaje": f"Nota recibida en {c.tarea.titulo}: {c.calificacion}",
-                "fecha": c.fecha_envio.isoformat()
-            })
-            
-        deudas = db.query(models_fi.Pago).join(models_en.Matricula)\
-            .filter(
-                models_fi.Pago.id_alumno == alumno.id_alumno,
-                models_fi.Pago.estado == "PENDIENTE",
-                models_en.Matricula.id_anio_escolar == anio_activo.id_anio_escolar
-            ).all()
-        
-        for d in deudas:
-            notificaciones.append({
-                "tipo": "pago",
-                "mensaje": f"Pago pendiente: {d.concepto} (S/ {d.monto_total})",
-                "fecha": d.fecha_vencimiento.isoformat() if d.fecha_vencimiento else None
-            })
-
-        # Filtramos por el alumno, estado programado y que la fecha sea hoy
-        inicio_hoy = datetime.combine(date.today(), datetime.min.time())
-        fin_hoy = datetime.combine(date.today(), datetime.max.time())
-
-        citas_hoy = db.query(models_psi.CitaPsicologia).filter(
-            models_psi.CitaPsicologia.id_alumno == alumno.id_alumno,
-            models_psi.CitaPsicologia.estado == "PROGRAMADA",
-            models_psi.CitaPsicologia.fecha_cita >= inicio_hoy,
-            models_psi.CitaPsicologia.fecha_cita <= fin_hoy
-        ).all()
-
-        for cita in citas_hoy:
-            notificaciones.append({
-                "tipo": "cita",
-                "mensaje": f"Hoy tienes una cita de psicología: {cita.motivo} a las {cita.fecha_cita.strftime('%H:%M')}",
-                "fecha": cita.fecha_cita.isoformat()
-            })
-
-    # --- C. EVENTOS (Comunes para todos) ---
-    # Buscamos eventos activos que ocurran hoy o a futuro
-    eventos = db.query(models_web.Evento).filter(
-        models_web.Evento.activo == True,
-        models_web.Evento.fecha_inicio >= date.today() # O datetime.now() para mayor precisión
-    ).order_by(models_web.Evento.fecha_inicio.asc()).limit(3).all()
-    
-    for ev in eventos:
-        notificaciones.append({
-            "tipo": "evento",
-            "mensaje": f"Evento: {ev.titulo} - {ev.descripcion or ''}",
-            "fecha": ev.fecha_inicio.isoformat()
-        })
-
-    return {"notificaciones": notificaciones}
\ No newline at end of file
+    # Las fuentes (entregas, notas, pagos, citas) se consultan en paralelo y
+    # los próximos eventos salen de una caché compartida entre usuarios
+    return {"notificaciones": NotificacionesService.obtener(db, id_usuario)}
\ No newline at end of file
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, ConfigDict,Field, field_validator
 from decimal import Decimal
 from datetime import date, datetime
-from typing import Optional,Literal
+from typing import Optional,Literal, List, Dict
 
 # --- Schemas Carga Académica ---
 class CargaCreate(BaseModel):
@@ -66,6 +66,24 @@ class VinculoAcademicoResponse(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+# Formato compacto: cada docente viaja una sola vez y los cursos lo referencian por id
+class VinculoCursoCompacto(BaseModel):
+    id_curso: int
+    curso_nombre: str
+    id_carga_academica: Optional[int] = None
+    id_docente: Optional[int] = None
+
+class VinculoSeccionAgrupada(BaseModel):
+    id_seccion: int
+    seccion_nombre: str
+    grado_nombre: str
+    cursos: List[VinculoCursoCompacto]
+
+class VinculosAgrupadosResponse(BaseModel):
+    id_anio_escolar: str
+    docentes: Dict[int, DocenteBasicoResponse]
+    secciones: List[VinculoSeccionAgrupada]
+
 class CargaUpdate(BaseModel):
     id_docente: Optional[int] = Field(None, gt=0)
 
@@ -0,0 +1,301 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+from sqlalchemy.orm import Session, joinedload, contains_eager
+from app.modules.academic import models as models_ac
+from app.modules.users.alumno import models as models_al
+from app.modules.users.docente import models as models_doc
+from app.modules.enrollment import models as models_en
+from app.modules.virtual import models as models_vr
+from app.modules.finance import models as models_fi
+from app.modules.web import models as models_web
+from app.modules.behavior import models as models_psi
+from . import models
+
+
+# Hilos (por worker) para consultar las fuentes de notificaciones en paralelo; 1 = en serie.
+# Cada hilo usa una conexión del pool del engine (5 + 10 de overflow por defecto): debe
+# quedar por debajo de ese margen para no dejar sin conexión a los demás requests
+NOTIFICACIONES_HILOS = int(os.getenv("NOTIFICACIONES_HILOS", "4"))
+# Segundos que se comparte entre usuarios la lista de próximos eventos
+NOTIFICACIONES_TTL_EVENTOS = float(os.getenv("NOTIFICACIONES_TTL_EVENTOS", "60"))
+
+
+class EventosProximosCache:
+    """
+    Los próximos eventos son iguales para todos los usuarios, así que se
+    consultan una vez por TTL (y por día) en lugar de en cada sondeo.
+    Los endpoints de eventos de la web la invalidan al escribir.
+    """
+    LIMITE = 3
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entrada = None # (dia, instante, [notificaciones])
+
+    def invalidar(self):
+        with self._lock:
+            self._entrada = None
+
+    def obtener(self, db: Session):
+        hoy = date.today()
+        with self._lock:
+            entrada = self._entrada
+        if entrada and entrada[0] == hoy and time.monotonic() - entrada[1] <= self.ttl:
+            return entrada[2]
+
+        eventos = db.query(models_web.Evento).filter(
+            models_web.Evento.activo == True,
+            models_web.Evento.fecha_inicio >= hoy
+        ).order_by(models_web.Evento.fecha_inicio.asc()).limit(self.LIMITE).all()
+
+        items = [
+            {
+                "tipo": "evento",
+                "mensaje": f"Evento: {ev.titulo} - {ev.descripcion or ''}",
+                "fecha": ev.fecha_inicio.isoformat()
+            }
+            for ev in eventos
+        ]
+        with self._lock:
+            self._entrada = (hoy, time.monotonic(), items)
+        return items
+
+
+# Instancia única para ser importada en otros archivos
+eventos_proximos = EventosProximosCache(NOTIFICACIONES_TTL_EVENTOS)
+
+# Compartido por todos los requests: acota las conexiones extra a NOTIFICACIONES_HILOS
+_pool_notificaciones = ThreadPoolExecutor(
+    max_workers=max(NOTIFICACIONES_HILOS, 1), thread_name_prefix="notificaciones"
+)
+
+
+class NotificacionesService:
+    """
+    Cada fuente filtra directamente por id_usuario (join con Docente/Alumno) y
+    carga sus relaciones con joinedload: una consulta por fuente, sin depender
+    de las demás, así que pueden correr en paralelo en _pool_notificaciones.
+    """
+
+    @staticmethod
+    def entregas_docente(db: Session, id_usuario: int, id_anio: str):
+        entregas = db.query(models_vr.EntregaTarea)\
+            .join(models_vr.EntregaTarea.tarea)\
+            .join(models.CargaAcademica, models.CargaAcademica.id_carga_academica == models_vr.Tarea.id_carga_academica)\
+            .join(models_doc.Docente, models_doc.Docente.id_docente == models.CargaAcademica.id_docente)\
+            .options(contains_eager(models_vr.EntregaTarea.tarea), joinedload(models_vr.EntregaTarea.alumno))\
+            .filter(
+                models_doc.Docente.id_usuario == id_usuario,
+                models.CargaAcademica.id_anio_escolar == id_anio
+            ).order_by(models_vr.EntregaTarea.fecha_envio.desc()).limit(5).all()
+
+        return [
+            {
+                "tipo": "entrega",
+                "mensaje": f"Nueva entrega: {e.alumno.nombres} en {e.tarea.titulo}",
+                "fecha": e.fecha_envio.isoformat()
+            }
+            for e in entregas
+        ]
+
+    @staticmethod
+    def notas_alumno(db: Session, id_usuario: int, id_anio: str):
+        calificaciones = db.query(models_vr.EntregaTarea)\
+            .join(models_al.Alumno, models_al.Alumno.id_alumno == models_vr.EntregaTarea.id_alumno)\
+            .options(joinedload(models_vr.EntregaTarea.tarea))\
+            .filter(models_al.Alumno.id_usuario == id_usuario, models_vr.EntregaTarea.calificacion != None)\
+            .order_by(models_vr.EntregaTarea.fecha_envio.desc()).limit(3).all()
+
+        return [
+            {
+                "tipo": "nota",
+                "mensaje": f"Nota recibida en {c.tarea.titulo}: {c.calificacion}",
+                "fecha": c.fecha_envio.isoformat()
+            }
+            for c in calificaciones
+        ]
+
+    @staticmethod
+    def deudas_alumno(db: Session, id_usuario: int, id_anio: str):
+        deudas = db.query(models_fi.Pago)\
+            .join(models_en.Matricula, models_en.Matricula.id_matricula == models_fi.Pago.id_matricula)\
+            .join(models_al.Alumno, models_al.Alumno.id_alumno == models_fi.Pago.id_alumno)\
+            .filter(
+                models_al.Alumno.id_usuario == id_usuario,
+                models_fi.Pago.estado == "PENDIENTE",
+                models_en.Matricula.id_anio_escolar == id_anio
+            ).all()
+
+        return [
+            {
+                "tipo": "pago",
+                "mensaje": f"Pago pendiente: {d.concepto} (S/ {d.monto_total})",
+                "fecha": d.fecha_vencimiento.isoformat() if d.fecha_vencimiento else None
+            }
+            for d in deudas
+        ]
+
+    @staticmethod
+    def citas_alumno(db: Session, id_usuario: int, id_anio: str):
+        # Citas programadas para hoy
+        inicio_hoy = datetime.combine(date.today(), datetime.min.time())
+        fin_hoy = datetime.combine(date.today(), datetime.max.time())
+
+        citas_hoy = db.query(models_psi.CitaPsicologia)\
+            .join(models_al.Alumno, models_al.Alumno.id_alumno == models_psi.CitaPsicologia.id_alumno)\
+            .filter(
+                models_al.Alumno.id_usuario == id_usuario,
+                models_psi.CitaPsicologia.estado == "PROGRAMADA",
+                models_psi.CitaPsicologia.fecha_cita >= inicio_hoy,
+                models_psi.CitaPsicologia.fecha_cita <= fin_hoy
+            ).all()
+
+        return [
+            {
+                "tipo": "cita",
+                "mensaje": f"Hoy tienes una cita de psicología: {cita.motivo} a las {cita.fecha_cita.strftime('%H:%M')}",
+                "fecha": cita.fecha_cita.isoformat()
+            }
+            for cita in citas_hoy
+        ]
+
+    @staticmethod
+    def _en_sesion_propia(fuente, bind, id_usuario: int, id_anio: str):
+        # La Session no es thread-safe: cada hilo abre la suya sobre el mismo engine
+        db = Session(bind=bind)
+        try:
+            return fuente(db, id_usuario, id_anio)
+        finally:
+            db.close()
+
+    @staticmethod
+    def obtener(db: Session, id_usuario: int):
+        anio_activo = db.query(models_ac.AnioEscolar).filter(models_ac.AnioEscolar.activo == True).first()
+        if not anio_activo:
+            return []
+        id_anio = anio_activo.id_anio_escolar
+
+        # El orden de las fuentes es el orden en que se muestran
+        fuentes = [
+            NotificacionesService.entregas_docente,
+            NotificacionesService.notas_alumno,
+            NotificacionesService.deudas_alumno,
+            NotificacionesService.citas_alumno,
+        ]
+        eventos = eventos_proximos.obtener(db)
+
+        if NOTIFICACIONES_HILOS > 1:
+            # Cerramos la transacción de lectura para devolver la conexión del request al
+            # pool: mientras esperamos, solo los hilos (acotados) tienen conexiones tomadas
+            db.rollback()
+            bind = db.get_bind()
+            futuros = [
+                _pool_notificaciones.submit(NotificacionesService._en_sesion_propia, f, bind, id_usuario, id_anio)
+                for f in fuentes
+            ]
+            resultados = [f.result() for f in futuros]
+        else:
+            resultados = [f(db, id_usuario, id_anio) for f in fuentes]
+
+        notificaciones = []
+        for parcial in resultados:
+            notificaciones.extend(parcial)
+        notificaciones.extend(eventos)
+        return notificaciones
+
+
+class VinculosAcademicosService:
+    @staticmethod
+    def obtener_matriz(db: Session, anio_id: str):
+        """
+        Matriz sección × curso del año con su carga y docente, en una sola consulta:
+        seccion ⋈ grado ⋈ plan_estudio ⋈ curso ⟕ carga_academica ⟕ docente.
+        Devuelve filas planas en el formato de VinculoAcademicoResponse.
+        """
+        filas = db.query(
+            models_ac.Seccion.id_seccion,
+            models_ac.Seccion.nombre.label("seccion_nombre"),
+            models_ac.Grado.nombre.label("grado_nombre"),
+            models_ac.Curso.id_curso,
+            models_ac.Curso.nombre.label("curso_nombre"),
+            models.CargaAcademica.id_carga_academica,
+            models_doc.Docente.id_docente,
+            models_doc.Docente.nombres,
+            models_doc.Docente.apellidos,
+            models_doc.Docente.url_perfil
+        ).select_from(models_ac.Seccion)\
+            .join(models_ac.Grado, models_ac.Grado.id_grado == models_ac.Seccion.id_grado)\
+            .join(models_ac.PlanEstudio, models_ac.PlanEstudio.id_grado == models_ac.Seccion.id_grado)\
+            .join(models_ac.Curso, models_ac.Curso.id_curso == models_ac.PlanEstudio.id_curso)\
+            .outerjoin(models.CargaAcademica,
+                (models.CargaAcademica.id_seccion == models_ac.Seccion.id_seccion) &
+                (models.CargaAcademica.id_curso == models_ac.Curso.id_curso) &
+                (models.CargaAcademica.id_anio_escolar == anio_id)
+            )\
+            .outerjoin(models_doc.Docente, models_doc.Docente.id_docente == models.CargaAcademica.id_docente)\
+            .filter(models_ac.Seccion.id_anio_escolar == anio_id)\
+            .order_by(
+                models_ac.Seccion.id_seccion, models_ac.Curso.id_curso,
+                models.CargaAcademica.id_carga_academica
+            ).all()
+
+        resultado = []
+        vistos = set()
+        for f in filas:
+            # Si hubiera cargas duplicadas para la misma sección y curso, gana la primera
+            if (f.id_seccion, f.id_curso) in vistos:
+                continue
+            vistos.add((f.id_seccion, f.id_curso))
+
+            docente = None
+            if f.id_docente is not None:
+                docente = {
+                    "id_docente": f.id_docente,
+                    "nombres": f.nombres,
+                    "apellidos": f.apellidos,
+                    "url_perfil": f.url_perfil
+                }
+            resultado.append({
+                "id_seccion": f.id_seccion,
+                "seccion_nombre": f.seccion_nombre,
+                "grado_nombre": f.grado_nombre,
+                "id_curso": f.id_curso,
+                "curso_nombre": f.curso_nombre,
+                "id_carga_academica": f.id_carga_academica,
+                "docente": docente
+            })
+        return resultado
+
+    @staticmethod
+    def agrupar(anio_id: str, matriz: list):
+        """Agrupa la matriz por sección y deja los docentes en un diccionario aparte."""
+        docentes = {}
+        secciones = {}
+        for v in matriz:
+            seccion = secciones.get(v["id_seccion"])
+            if seccion is None:
+                seccion = secciones[v["id_seccion"]] = {
+                    "id_seccion": v["id_seccion"],
+                    "seccion_nombre": v["seccion_nombre"],
+                    "grado_nombre": v["grado_nombre"],
+                    "cursos": []
+                }
+            docente = v["docente"]
+            if docente:
+                docentes[docente["id_docente"]] = docente
+            seccion["cursos"].append({
+                "id_curso": v["id_curso"],
+                "curso_nombre": v["curso_nombre"],
+                "id_carga_academica": v["id_carga_academica"],
+                "id_docente": docente["id_docente"] if docente else None
+            })
+
+        return {
+            "id_anio_escolar": anio_id,
+            "docentes": docentes,
+            "secciones": list(secciones.values())
+        }
@@ -6,6 +6,7 @@ from . import models, schemas
 from app.modules.users.models import Usuario
 from app.modules.users.docente.models import Docente
 from app.core.util.password import get_password_hash
+from app.modules.virtual.service import permisos_chat
 
 router = APIRouter(prefix="/personal", tags=["Gestión de Personal"])
 
@@ -64,6 +65,7 @@ def crear_personal(tipo: str, personal: schemas.PersonalCreate, db: Session = De
     db.add(nuevo_perfil)
     db.commit()
     db.refresh(nuevo_perfil)
+    permisos_chat.invalidar()
     
     return to_response(nuevo_perfil, tipo)
 
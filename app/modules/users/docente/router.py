@@ -8,6 +8,8 @@ from typing import List
 from app.core.util.password import get_password_hash
 from sqlalchemy.orm import joinedload
 from sqlalchemy import or_
+from app.modules.virtual.service import permisos_chat, cursos_alumno
+from app.modules.horario.service import horarios_vista
 
 # Creamos el router. 'prefix' evita repetir "/docentes" en cada ruta.
 router = APIRouter(
@@ -42,6 +44,7 @@ def crear_docente(docente_in: DocenteCreate, db: Session = Depends(get_db)):
         db.add(db_docente)
         
         db.commit() # Si todo sale bien, guardamos ambos
+        permisos_chat.invalidar()
         db.refresh(db_docente)
         return db_docente
 
@@ -90,6 +93,8 @@ def actualizar_docente(id: int, docente_update: DocenteUpdate, db: Session = Dep
         setattr(db_docente, key, value)
     
     db.commit()
+    cursos_alumno.invalidar() # El dashboard muestra el nombre del docente
+    horarios_vista.invalidar()
     db.refresh(db_docente)
     return db_docente
 
@@ -4,6 +4,7 @@ from app.db.database import get_db
 from . import models, schemas
 from app.core.util.password import get_password_hash
 from app.core.util.password import verify_password
+from app.modules.virtual.service import permisos_chat
 
 router = APIRouter(prefix="/usuarios", tags=["Usuarios"])
 
@@ -17,6 +18,7 @@ def crear_usuario(usuario: schemas.UsuarioCreate, db: Session = Depends(get_db))
     )
     db.add(db_user)
     db.commit()
+    permisos_chat.invalidar()
     db.refresh(db_user)
     return db_user
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DECIMAL, ForeignKey, DateTime, Text, Boolean, Enum
+from sqlalchemy import Column, Integer, String, DECIMAL, ForeignKey, DateTime, Text, Boolean, Enum, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.database import Base
@@ -42,6 +42,11 @@ class Conversacion(Base):
 
 class Mensaje(Base):
     __tablename__ = "mensaje"
+    # Índice para la paginación del historial por (fecha_envio, id_mensaje).
+    # En MySQL: CREATE INDEX ix_mensaje_conversacion_fecha ON mensaje (id_conversacion, fecha_envio, id_mensaje);
+    __table_args__ = (
+        Index("ix_mensaje_conversacion_fecha", "id_conversacion", "fecha_envio", "id_mensaje"),
+    )
     id_mensaje = Column(Integer, primary_key=True)
     id_conversacion = Column(Integer, ForeignKey("conversacion.id_conversacion"))
     remitente_id = Column(Integer, ForeignKey("usuario.id_usuario"))
@@ -3,7 +3,7 @@ import uuid
 import shutil
 from datetime import datetime
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Form, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, Form, UploadFile, File, Query, Response
 from sqlalchemy.orm import Session
 from typing import List
 from sqlalchemy import or_
@@ -19,6 +19,10 @@ from app.modules.users.alumno import models as models_al
 from app.modules.users.docente import models as models_doc
 
 from . import models, schemas
+from .service import (
+    SabanaNotasService, NotasMasivasService, InboxService, HistorialService,
+    DashboardEstudianteService, permisos_chat
+)
 
 
 # 1. Obtenemos la ruta de este archivo (virtual)
@@ -55,70 +59,15 @@ async def enviar_mensaje(mensaje: schemas.MensajeCreate, db: Session = Depends(g
 
     receptor_id = conv.usuario2_id if mensaje.remitente_id == conv.usuario1_id else conv.usuario1_id
     
-    # 2. Obtener Roles y Perfiles Académicos
-    remitente = db.query(models_usuario.Usuario).filter(models_usuario.Usuario.id_usuario == mensaje.remitente_id).first()
-    receptor = db.query(models_usuario.Usuario).filter(models_usuario.Usuario.id_usuario == receptor_id).first()
-    
-    # Obtener el año escolar activo
-    anio_activo = db.query(models_ac.AnioEscolar).filter(models_ac.AnioEscolar.activo == 1).first()
-    if not anio_activo:
-        raise HTTPException(status_code=400, detail="No hay un año escolar activo configurado")
-
-    puede_enviar = False
-
-    # --- REGLA: DOCENTE ENVÍA ---
-    if remitente.rol == 'DOCENTE':
-        if receptor.rol == 'DOCENTE':
-            puede_enviar = True # Docentes hablan entre sí libremente
-        
-        elif receptor.rol == 'ALUMNO':
-            # Verificar si el docente dicta en la sección donde el alumno está matriculado
-            docente_perfil = db.query(models_doc.Docente).filter(models_doc.Docente.id_usuario == remitente.id_usuario).first()
-            alumno_perfil = db.query(models_al.Alumno).filter(models_al.Alumno.id_usuario == receptor.id_usuario).first()
-            
-            es_su_alumno = db.query(models_mn.CargaAcademica).join(
-                models_en.Matricula, models_en.Matricula.id_seccion == models_mn.CargaAcademica.id_seccion
-            ).filter(
-                models_mn.CargaAcademica.id_docente == docente_perfil.id_docente,
-                models_en.Matricula.id_alumno == alumno_perfil.id_alumno,
-                models_mn.CargaAcademica.id_anio_escolar == anio_activo.id_anio_escolar
-            ).first()
-            if es_su_alumno: puede_enviar = True
-
-    # --- REGLA: ALUMNO ENVÍA ---
-    elif remitente.rol == 'ALUMNO':
-        alumno_perfil = db.query(models_al.Alumno).filter(models_al.Alumno.id_usuario == remitente.id_usuario).first()
-        # Obtener matrícula del remitente para este año
-        matricula_remitente = db.query(models_en.Matricula).filter(
-            models_en.Matricula.id_alumno == alumno_perfil.id_alumno,
-            models_en.Matricula.id_anio_escolar == anio_activo.id_anio_escolar
-        ).first()
-
-        if not matricula_remitente:
-            raise HTTPException(status_code=403, detail="El alumno no tiene matrícula activa este año")
-
-        if receptor.rol == 'DOCENTE':
-            # Verificar si el docente receptor tiene carga en la sección del alumno
-            docente_receptor = db.query(models_doc.Docente).filter(models_doc.Docente.id_usuario == receptor.id_usuario).first()
-            le_ensenha = db.query(models_mn.CargaAcademica).filter(
-                models_mn.CargaAcademica.id_docente == docente_receptor.id_docente,
-                models_mn.CargaAcademica.id_seccion == matricula_remitente.id_seccion,
-                models_mn.CargaAcademica.id_anio_escolar == anio_activo.id_anio_escolar
-            ).first()
-            if le_ensenha: puede_enviar = True
-
-        elif receptor.rol == 'ALUMNO':
-            # Verificar si el receptor está en la misma sección y año
-            alumno_receptor = db.query(models_al.Alumno).filter(models_al.Alumno.id_usuario == receptor.id_usuario).first()
-            misma_seccion = db.query(models_en.Matricula).filter(
-                models_en.Matricula.id_alumno == alumno_receptor.id_alumno,
-                models_en.Matricula.id_seccion == matricula_remitente.id_seccion,
-                models_en.Matricula.id_anio_escolar == anio_activo.id_anio_escolar
-            ).first()
-            if misma_seccion: puede_enviar = True
+    # 2. Validar permisos contra el índice en memoria (docentes/alumnos por sección)
+    motivo = permisos_chat.verificar(db, mensaje.remitente_id, receptor_id)
 
     # 3. Respuesta Final
-    if not puede_enviar:
+    if motivo == "SIN_ANIO":
+        raise HTTPException(status_code=400, detail="No hay un año escolar activo configurado")
+    if motivo == "SIN_MATRICULA":
+        raise HTTPException(status_code=403, detail="El alumno no tiene matrícula activa este año")
+    if motivo:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Restricción académica: No puedes enviar mensajes a este usuario."
@@ -237,61 +186,35 @@ def buscar_contactos(id_usuario: int, query: str = None, db: Session = Depends(g
     return contactos_validos
 
 @router.get("/chat/conversaciones/{id_usuario}")
-def listar_conversaciones(id_usuario: int, db: Session = Depends(get_db)):
-    # 1. Busca conversaciones donde el usuario participa
-    convs = db.query(models.Conversacion).filter(
-        or_(models.Conversacion.usuario1_id == id_usuario, 
-            models.Conversacion.usuario2_id == id_usuario)
-    ).order_by(models.Conversacion.fecha_actualizacion.desc()).all()
-    
-    resultado = []
-    for c in convs:
-        # Identificar quién es el "otro"
-        otro_id = c.usuario2_id if c.usuario1_id == id_usuario else c.usuario1_id
-        otro_usuario = db.query(models_usuario.Usuario).get(otro_id)
-        
-        if not otro_usuario:
-            continue
+def listar_conversaciones(
+    id_usuario: int,
+    response: Response,
+    limite: Optional[int] = Query(None, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Bandeja de entrada del usuario con conteo de no leídos.
+    Si se envía 'limite', la respuesta se pagina y el cursor de la siguiente
+    página viene en la cabecera X-Next-Cursor.
+    """
+    try:
+        resultado, siguiente_cursor = InboxService.listar(db, id_usuario, limite, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
 
-        # 2. Lógica para obtener el nombre real desde Alumno o Docente
-        nombre_real = "Sin nombre"
-        apellidos_real = ""
-        
-        if otro_usuario.rol == 'DOCENTE':
-            perfil = db.query(models_doc.Docente).filter(models_doc.Docente.id_usuario == otro_id).first()
-            if perfil:
-                nombre_real = perfil.nombres
-                apellidos_real = perfil.apellidos
-        elif otro_usuario.rol == 'ALUMNO':
-            perfil = db.query(models_al.Alumno).filter(models_al.Alumno.id_usuario == otro_id).first()
-            if perfil:
-                nombre_real = perfil.nombres
-                apellidos_real = perfil.apellidos
-        else:
-            # Fallback por si es ADMIN o FAMILIAR
-            nombre_real = otro_usuario.username
-            apellidos_real = ""
-
-        # 3. Obtener último mensaje
-        ultimo_msj = db.query(models.Mensaje).filter(
-            models.Mensaje.id_conversacion == c.id_conversacion
-        ).order_by(models.Mensaje.fecha_envio.desc()).first()
-
-        resultado.append({
-            "id": c.id_conversacion,
-            "receptor_id": otro_id,
-            "nombre": f"{nombre_real} {apellidos_real}".strip(),
-            "rol": otro_usuario.rol,
-            "ultimoMensaje": ultimo_msj.contenido if ultimo_msj else "Empieza a chatear",
-            "hora": ultimo_msj.fecha_envio.strftime("%H:%M") if ultimo_msj else "",
-            "iniciales": (nombre_real[0] + (apellidos_real[0] if apellidos_real else "")).upper(),
-            "color": "bg-[#701C32]" if otro_usuario.rol == "DOCENTE" else "bg-blue-600",
-            "mensajes": [] 
-        })
-        
+    if siguiente_cursor:
+        response.headers["X-Next-Cursor"] = siguiente_cursor
     return resultado
 
 
+@router.patch("/chat/conversacion/{id_conversacion}/leer")
+def marcar_conversacion_leida(id_conversacion: int, id_usuario: int, db: Session = Depends(get_db)):
+    """Marca como leídos los mensajes recibidos por el usuario en la conversación."""
+    marcados = InboxService.marcar_leidos(db, id_conversacion, id_usuario)
+    return {"message": f"{marcados} mensajes marcados como leídos"}
+
+
 @router.post("/chat/conversacion/")
 def obtener_o_crear_conversacion(req: schemas.ConversacionCreate, db: Session = Depends(get_db)):
     # 1. Verificar si ya existe una conversación entre estos dos usuarios
@@ -318,20 +241,30 @@ def obtener_o_crear_conversacion(req: schemas.ConversacionCreate, db: Session =
 
 
 @router.get("/chat/historial/{id_conversacion}")
-def obtener_historial(id_conversacion: int, db: Session = Depends(get_db)):
-    mensajes = db.query(models.Mensaje).filter(
-        models.Mensaje.id_conversacion == id_conversacion
-    ).order_by(models.Mensaje.fecha_envio.asc()).all()
+def obtener_historial(
+    id_conversacion: int,
+    response: Response,
+    limite: int = Query(50, ge=1, le=200),
+    antes: Optional[str] = None,
+    desde: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Historial paginado (orden ascendente). Cada mensaje trae su 'cursor':
+    - ?antes=<cursor del mensaje más antiguo> para cargar mensajes anteriores.
+    - ?desde=<cursor del último mensaje recibido> para traer solo lo nuevo tras reconectar.
+    La cabecera X-Has-More indica si quedan más mensajes en esa dirección.
+    """
+    if antes and desde:
+        raise HTTPException(status_code=400, detail="Use 'antes' o 'desde', no ambos")
 
-    return [
-        {
-            "id": m.id_mensaje,
-            "texto": m.contenido,
-            "remitente_id": m.remitente_id,  # <--- Agregamos esto
-            "hora": m.fecha_envio.strftime("%H:%M")
-        }
-        for m in mensajes
-    ]
+    try:
+        mensajes, hay_mas = HistorialService.listar(db, id_conversacion, limite, antes, desde)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    response.headers["X-Has-More"] = "1" if hay_mas else "0"
+    return mensajes
 
 #--- Tareas
 @router.post("/tareas/", response_model=schemas.TareaResponse)
@@ -416,102 +349,22 @@ def obtener_sabana_notas(id_carga: int, bimestre: int, db: Session = Depends(get
     if not carga:
         raise HTTPException(status_code=404, detail="Carga académica no encontrada")
 
-    # 2. Obtener los alumnos matriculados
-    alumnos = db.query(models_al.Alumno).join(
-        models_en.Matricula, models_al.Alumno.id_alumno == models_en.Matricula.id_alumno
-    ).filter(
-        models_en.Matricula.id_seccion == carga.id_seccion,
-        models_en.Matricula.id_anio_escolar == carga.id_anio_escolar
-    ).order_by(models_al.Alumno.apellidos).all()
-
-    # 3. Obtener tareas
-    tareas = db.query(models.Tarea).filter(
-        models.Tarea.id_carga_academica == id_carga,
-        models.Tarea.bimestre == bimestre,
-        models.Tarea.estado == "ACTIVO"
-    ).order_by(models.Tarea.fecha_publicacion).all()
-
-    # --- NUEVA LÓGICA PARA EVALUACIONES ---
-    lista_evaluaciones = []
-    for t in tareas:
-        # Contar cuántos archivos se han subido para esta tarea
-        entregas_con_archivo = [e for e in t.entregas if e.archivo_url]
-        conteo_envios = len(entregas_con_archivo)
-
-        lista_evaluaciones.append({
-            "id_tarea": t.id_tarea,
-            "titulo": t.titulo,
-            "tipo": t.tipo_evaluacion,
-            "descripcion": t.descripcion,
-            "fecha_entrega": t.fecha_entrega,
-            "bimestre": t.bimestre,
-            "peso": t.peso,
-            "total_entregas": conteo_envios,
-            "editable_total": conteo_envios == 0,  
-            "archivo_adjunto_url": t.archivo_adjunto_url
-        })
-
-    # 4. Construir la respuesta de alumnos (Mantenemos tu lógica de promedios)
-    resultado_alumnos = []
-    for alumno in alumnos:
-        dict_notas = {}
-        promedio_final = 0.0
-
-        for tarea in tareas:
-            entrega = db.query(models.EntregaTarea).filter(
-                models.EntregaTarea.id_tarea == tarea.id_tarea,
-                models.EntregaTarea.id_alumno == alumno.id_alumno
-            ).first()
-
-            valor_nota = float(entrega.calificacion) if entrega and entrega.calificacion else 0.0
-            dict_notas[str(tarea.id_tarea)] = valor_nota
-            
-            # --- LÓGICA DE PESOS ---
-            # Si la tarea vale 20%, multiplicamos nota * 0.20
-            promedio_final += (valor_nota * (tarea.peso / 100.0))
-
-        resultado_alumnos.append({
-            "id_alumno": alumno.id_alumno,
-            "nombres_completos": f"{alumno.apellidos}, {alumno.nombres}",
-            "notas": dict_notas,
-            "promedio": round(promedio_final, 2)
-        })
+    # 2. Alumnos, evaluaciones y entregas se cargan en bloque y se pivotan en memoria
+    return SabanaNotasService.obtener_sabana(db, carga, bimestre)
 
-    return {
-        "evaluaciones": lista_evaluaciones,
-        "alumnos_notas": resultado_alumnos
-    }
-
-@router.post("/guardar-notas-masivo/")
+@router.post("/guardar-notas-masivo/", response_model=schemas.NotasMasivasResponse)
 def guardar_notas_masivo(payload: schemas.NotasMasivasCreate, db: Session = Depends(get_db)):
     """
     Se espera un payload como: 
     { "id_tarea": 10, "notas": { "id_alumno_1": 15, "id_alumno_2": 20 } }
+    Devuelve el resultado de cada fila (CREADO, ACTUALIZADO o ERROR).
     """
-    id_tarea = payload.id_tarea
-    notas = payload.notas
-
-    for id_alumno_str, calificacion in notas.items():
-        id_alumno = int(id_alumno_str)
-        # Buscar si ya existe una entrega para actualizarla, sino crearla
-        entrega = db.query(models.EntregaTarea).filter(
-            models.EntregaTarea.id_tarea == id_tarea,
-            models.EntregaTarea.id_alumno == int(id_alumno)
-        ).first()
+    tarea = db.query(models.Tarea).filter(models.Tarea.id_tarea == payload.id_tarea).first()
+    if not tarea:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
 
-        if entrega:
-            entrega.calificacion = calificacion
-            entrega.fecha_envio = datetime.now() # Opcional: marcar actualización
-        else:
-            nueva_entrega = models.EntregaTarea(
-                id_tarea=id_tarea,
-                id_alumno=int(id_alumno),
-                calificacion=calificacion
-            )
-            db.add(nueva_entrega)
-    
-    db.commit()
-    return {"message": "Notas actualizadas correctamente"}
+    resumen = NotasMasivasService.guardar_notas(db, tarea, payload.notas)
+    return {"message": "Notas actualizadas correctamente", **resumen}
 
 @router.put("/calificar-entrega/{id_entrega}")
 def calificar_entrega(id_entrega: int, calificacion: float, retroalimentacion: str = None, db: Session = Depends(get_db)):
@@ -795,70 +648,6 @@ def obtener_dashboard_estudiante(id_usuario: int, db: Session = Depends(get_db))
     if not alumno:
         raise HTTPException(status_code=404, detail="Alumno no encontrado")
 
-    # 2. Obtenemos los cursos usando el id_anio dinámico
-    cursos_query = (
-        db.query(
-            models_ac.Curso.id_curso,
-            models_ac.Curso.nombre.label("curso_nombre"),
-            models_mn.CargaAcademica.id_carga_academica,
-            models_doc.Docente.nombres.label("docente_nombres"),
-            models_doc.Docente.apellidos.label("docente_apellidos")
-        )
-        .select_from(models_en.Matricula)
-        .join(models_ac.Seccion, models_ac.Seccion.id_seccion == models_en.Matricula.id_seccion)
-        .join(models_ac.Grado, models_ac.Grado.id_grado == models_ac.Seccion.id_grado)
-        .join(models_ac.PlanEstudio, models_ac.PlanEstudio.id_grado == models_ac.Grado.id_grado)
-        .join(models_ac.Curso, models_ac.Curso.id_curso == models_ac.PlanEstudio.id_curso)
-        .outerjoin(models_mn.CargaAcademica, 
-            (models_mn.CargaAcademica.id_curso == models_ac.Curso.id_curso) & 
-            (models_mn.CargaAcademica.id_seccion == models_en.Matricula.id_seccion) &
-            (models_mn.CargaAcademica.id_anio_escolar == id_anio) # <--- Usamos el ID dinámico
-        )
-        .outerjoin(models_doc.Docente, models_mn.CargaAcademica.id_docente == models_doc.Docente.id_docente)
-        .filter(
-            models_en.Matricula.id_alumno == alumno.id_alumno, 
-            models_en.Matricula.id_anio_escolar == id_anio # <--- Usamos el ID dinámico
-        )
-        .all()
-    )
-
-    lista_cursos = []
-    lista_tareas = []
-
-    for c in cursos_query:
-        # A. Agregar al listado de cursos
-        lista_cursos.append({
-            "id_curso": c.id_curso,
-            "nombre": c.curso_nombre,
-            "docente": f"{c.docente_nombres or ''} {c.docente_apellidos or ''}".strip()
-        })
-
-        # B. Buscar tareas usando el id_carga_academica obtenido en la query
-        if c.id_carga_academica:
-            tareas = db.query(models.Tarea).filter(
-                models.Tarea.id_carga_academica == c.id_carga_academica,
-                models.Tarea.fecha_entrega >= datetime.now()
-            ).all()
-
-            for t in tareas:
-                # Verificar entrega
-                entrega = db.query(models.EntregaTarea).filter(
-                    models.EntregaTarea.id_tarea == t.id_tarea,
-                    models.EntregaTarea.id_alumno == alumno.id_alumno
-                ).first()
-                
-                if not entrega:
-                    lista_tareas.append({
-                        "id_tarea": t.id_tarea,
-                        "curso": c.curso_nombre,
-                        "titulo": t.titulo,
-                        "fecha_entrega": t.fecha_entrega
-                    })
-
-    return {
-        "nombre_completo": f"{alumno.nombres} {alumno.apellidos}",
-        "cursos": lista_cursos,
-        "tareas_pendientes": lista_tareas,
-        "anio_actual": anio_activo.id_anio_escolar
-    }
+    # 2. Cursos (cacheados por alumno y año) y tareas pendientes en una sola consulta
+    return DashboardEstudianteService.obtener(db, alumno, id_anio)
 
@@ -57,6 +57,19 @@ class NotasMasivasCreate(BaseModel):
             if not (0 <= nota <= 20):
                 raise ValueError(f"La nota {nota} para el alumno {alumno_id} está fuera de rango (0-20)")
         return v
+
+class ResultadoNotaAlumno(BaseModel):
+    id_alumno: str
+    estado: Literal["CREADO", "ACTUALIZADO", "ERROR"]
+    detalle: Optional[str] = None
+
+class NotasMasivasResponse(BaseModel):
+    message: str
+    creados: int
+    actualizados: int
+    errores: int
+    resultados: List[ResultadoNotaAlumno]
+
 # --- Esquemas de Chat ---
 class EntregaCreate(BaseModel):
     id_tarea: int
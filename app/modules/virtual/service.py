@@ -0,0 +1,624 @@
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import insert, update, case, or_, and_, func
+from sqlalchemy.orm import Session
+from app.modules.users import models as models_usuario
+from app.modules.academic import models as models_ac
+from app.modules.management import models as models_mn
+from app.modules.enrollment import models as models_en
+from app.modules.users.alumno import models as models_al
+from app.modules.users.docente import models as models_doc
+from . import models
+
+
+SEPARADOR_CURSOR = "_"
+
+
+def codificar_cursor(fecha: datetime, id_registro: int):
+    """Cursor opaco para paginación por (fecha, id): '2025-04-01T08:00:00_15'."""
+    return f"{fecha.isoformat()}{SEPARADOR_CURSOR}{id_registro}"
+
+
+def decodificar_cursor(cursor: str):
+    """Devuelve (fecha, id) o lanza ValueError si el cursor no es válido."""
+    fecha, id_registro = cursor.rsplit(SEPARADOR_CURSOR, 1)
+    return datetime.fromisoformat(fecha), int(id_registro)
+
+
+class SabanaNotasService:
+    @staticmethod
+    def construir_matriz(alumnos: list, tareas: list, entregas: list):
+        """
+        Pivota las entregas (id_tarea, id_alumno, calificacion) en una matriz
+        densa alumno x tarea. Las celdas sin entrega o sin nota quedan en 0.0.
+        """
+        fila_alumno = {a.id_alumno: i for i, a in enumerate(alumnos)}
+        col_tarea = {t.id_tarea: j for j, t in enumerate(tareas)}
+
+        matriz = [[0.0] * len(tareas) for _ in alumnos]
+        for e in entregas:
+            i = fila_alumno.get(e.id_alumno)
+            j = col_tarea.get(e.id_tarea)
+            # Entregas de alumnos que ya no están en la sección se ignoran
+            if i is None or j is None:
+                continue
+            matriz[i][j] = float(e.calificacion) if e.calificacion else 0.0
+        return matriz
+
+    @staticmethod
+    def calcular_promedios(matriz: list, pesos: list):
+        """
+        Promedio ponderado por fila: si la tarea vale 20%, se multiplica nota * 0.20.
+        """
+        factores = [(p or 0) / 100.0 for p in pesos]
+        return [
+            round(sum(nota * f for nota, f in zip(fila, factores)), 2)
+            for fila in matriz
+        ]
+
+    @staticmethod
+    def obtener_sabana(db: Session, carga: models_mn.CargaAcademica, bimestre: int):
+        """
+        Arma la sábana de notas de una carga/bimestre con un número fijo de
+        consultas (alumnos, tareas y todas las entregas), sin importar el tamaño
+        de la sección ni la cantidad de evaluaciones.
+        """
+        # 1. Alumnos matriculados en la sección de la carga
+        alumnos = db.query(models_al.Alumno).join(
+            models_en.Matricula, models_al.Alumno.id_alumno == models_en.Matricula.id_alumno
+        ).filter(
+            models_en.Matricula.id_seccion == carga.id_seccion,
+            models_en.Matricula.id_anio_escolar == carga.id_anio_escolar
+        ).order_by(models_al.Alumno.apellidos).all()
+
+        # 2. Evaluaciones activas del bimestre
+        tareas = db.query(models.Tarea).filter(
+            models.Tarea.id_carga_academica == carga.id_carga_academica,
+            models.Tarea.bimestre == bimestre,
+            models.Tarea.estado == "ACTIVO"
+        ).order_by(models.Tarea.fecha_publicacion).all()
+
+        # 3. Todas las entregas de esas tareas en una sola consulta (solo columnas)
+        entregas = []
+        if tareas:
+            entregas = db.query(
+                models.EntregaTarea.id_tarea,
+                models.EntregaTarea.id_alumno,
+                models.EntregaTarea.calificacion,
+                models.EntregaTarea.archivo_url
+            ).filter(
+                models.EntregaTarea.id_tarea.in_([t.id_tarea for t in tareas])
+            ).all()
+
+        # Cuántos archivos se han subido por tarea
+        conteo_envios = {t.id_tarea: 0 for t in tareas}
+        for e in entregas:
+            if e.archivo_url:
+                conteo_envios[e.id_tarea] += 1
+
+        lista_evaluaciones = [
+            {
+                "id_tarea": t.id_tarea,
+                "titulo": t.titulo,
+                "tipo": t.tipo_evaluacion,
+                "descripcion": t.descripcion,
+                "fecha_entrega": t.fecha_entrega,
+                "bimestre": t.bimestre,
+                "peso": t.peso,
+                "total_entregas": conteo_envios[t.id_tarea],
+                "editable_total": conteo_envios[t.id_tarea] == 0,
+                "archivo_adjunto_url": t.archivo_adjunto_url
+            }
+            for t in tareas
+        ]
+
+        # 4. Matriz alumno x tarea y promedios ponderados
+        matriz = SabanaNotasService.construir_matriz(alumnos, tareas, entregas)
+        promedios = SabanaNotasService.calcular_promedios(matriz, [t.peso for t in tareas])
+        claves = [str(t.id_tarea) for t in tareas]
+
+        resultado_alumnos = [
+            {
+                "id_alumno": alumno.id_alumno,
+                "nombres_completos": f"{alumno.apellidos}, {alumno.nombres}",
+                "notas": dict(zip(claves, fila)),
+                "promedio": promedio
+            }
+            for alumno, fila, promedio in zip(alumnos, matriz, promedios)
+        ]
+
+        return {
+            "evaluaciones": lista_evaluaciones,
+            "alumnos_notas": resultado_alumnos
+        }
+
+
+class NotasMasivasService:
+    @staticmethod
+    def guardar_notas(db: Session, tarea: models.Tarea, notas: dict):
+        """
+        Upsert masivo de calificaciones de una tarea.
+        Resuelve las entregas existentes en una sola consulta y escribe los cambios
+        con un executemany de UPDATE y otro de INSERT dentro de la misma transacción.
+        Devuelve el resultado por fila: CREADO, ACTUALIZADO o ERROR. Las claves se
+        comparan ya convertidas a entero ("15" y "015" son el mismo alumno): vale la
+        primera y las repetidas quedan en ERROR.
+        """
+        carga = db.query(models_mn.CargaAcademica).filter(
+            models_mn.CargaAcademica.id_carga_academica == tarea.id_carga_academica
+        ).first()
+
+        # 1. Alumnos que pueden recibir nota (matriculados en la sección de la carga)
+        alumnos_validos = set()
+        if carga:
+            alumnos_validos = {
+                fila.id_alumno for fila in db.query(models_en.Matricula.id_alumno).filter(
+                    models_en.Matricula.id_seccion == carga.id_seccion,
+                    models_en.Matricula.id_anio_escolar == carga.id_anio_escolar
+                ).all()
+            }
+
+        # 2. Entregas ya registradas para la tarea: id_alumno -> id_entrega
+        existentes = {
+            fila.id_alumno: fila.id_entrega for fila in db.query(
+                models.EntregaTarea.id_entrega, models.EntregaTarea.id_alumno
+            ).filter(models.EntregaTarea.id_tarea == tarea.id_tarea).all()
+        }
+
+        ahora = datetime.now()
+        actualizaciones = []
+        inserciones = []
+        resultados = []
+        vistos = set()
+
+        for id_alumno_str, calificacion in notas.items():
+            try:
+                id_alumno = int(id_alumno_str)
+            except (TypeError, ValueError):
+                resultados.append({"id_alumno": id_alumno_str, "estado": "ERROR", "detalle": "ID de alumno inválido"})
+                continue
+
+            if id_alumno in vistos:
+                resultados.append({"id_alumno": id_alumno_str, "estado": "ERROR", "detalle": "Nota repetida para el mismo alumno"})
+                continue
+            vistos.add(id_alumno)
+
+            if id_alumno not in alumnos_validos:
+                resultados.append({"id_alumno": id_alumno_str, "estado": "ERROR", "detalle": "El alumno no está matriculado en la sección"})
+                continue
+
+            if id_alumno in existentes:
+                actualizaciones.append({
+                    "id_entrega": existentes[id_alumno],
+                    "calificacion": calificacion,
+                    "fecha_envio": ahora
+                })
+                resultados.append({"id_alumno": id_alumno_str, "estado": "ACTUALIZADO", "detalle": None})
+            else:
+                inserciones.append({
+                    "id_tarea": tarea.id_tarea,
+                    "id_alumno": id_alumno,
+                    "calificacion": calificacion
+                })
+                resultados.append({"id_alumno": id_alumno_str, "estado": "CREADO", "detalle": None})
+
+        # 3. Escritura en bloque (UPDATE por clave primaria + INSERT, ambos executemany)
+        try:
+            if actualizaciones:
+                db.execute(update(models.EntregaTarea), actualizaciones)
+            if inserciones:
+                db.execute(insert(models.EntregaTarea), inserciones)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        return {
+            "actualizados": len(actualizaciones),
+            "creados": len(inserciones),
+            "errores": len(resultados) - len(actualizaciones) - len(inserciones),
+            "resultados": resultados
+        }
+
+
+class _SnapshotPermisos:
+    """Un índice ya construido; no se modifica, se reemplaza entero."""
+    __slots__ = ("construido_en", "id_anio_escolar", "rol_por_usuario", "seccion_por_alumno", "secciones_por_docente")
+
+    def __init__(self, id_anio_escolar, rol_por_usuario: dict, seccion_por_alumno: dict, secciones_por_docente: dict):
+        self.construido_en = time.monotonic()
+        self.id_anio_escolar = id_anio_escolar
+        self.rol_por_usuario = rol_por_usuario               # id_usuario -> 'DOCENTE' | 'ALUMNO'
+        self.seccion_por_alumno = seccion_por_alumno         # id_usuario (alumno) -> id_seccion
+        self.secciones_por_docente = secciones_por_docente   # id_usuario (docente) -> {id_seccion}
+
+    def edad(self):
+        return time.monotonic() - self.construido_en
+
+
+class PermisosChatIndex:
+    """
+    Índice en memoria de quién puede escribirle a quién en el año escolar activo.
+    Se construye con 4 consultas a partir de CargaAcademica y Matricula, y se
+    invalida explícitamente cuando cambian cargas, matrículas o usuarios.
+    Como red de seguridad expira cada TTL_SEGUNDOS y, ante una denegación con
+    un índice "viejo", se reconstruye una vez antes de responder (cubre las
+    matrículas que crea el trigger de MySQL al confirmar la vacante).
+    Cada reconstrucción arma un snapshot nuevo y lo publica de una vez bajo el
+    lock; quien verifica trabaja sobre el snapshot que obtuvo, aunque otro hilo
+    invalide o reconstruya mientras tanto.
+    """
+    TTL_SEGUNDOS = 600
+    EDAD_MIN_RECONSTRUCCION = 30
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidar(self):
+        with self._lock:
+            self._snapshot = None
+
+    @staticmethod
+    def _construir(db: Session):
+        anio_activo = db.query(models_ac.AnioEscolar).filter(models_ac.AnioEscolar.activo == True).first()
+        id_anio = anio_activo.id_anio_escolar if anio_activo else None
+
+        rol_por_usuario = {
+            u.id_usuario: u.rol for u in db.query(
+                models_usuario.Usuario.id_usuario, models_usuario.Usuario.rol
+            ).filter(models_usuario.Usuario.rol.in_(["DOCENTE", "ALUMNO"])).all()
+        }
+
+        seccion_por_alumno = {}
+        secciones_por_docente = {}
+        if id_anio:
+            matriculas = db.query(models_al.Alumno.id_usuario, models_en.Matricula.id_seccion).join(
+                models_en.Matricula, models_en.Matricula.id_alumno == models_al.Alumno.id_alumno
+            ).filter(models_en.Matricula.id_anio_escolar == id_anio).all()
+            for m in matriculas:
+                seccion_por_alumno[m.id_usuario] = m.id_seccion
+
+            cargas = db.query(models_doc.Docente.id_usuario, models_mn.CargaAcademica.id_seccion).join(
+                models_mn.CargaAcademica, models_mn.CargaAcademica.id_docente == models_doc.Docente.id_docente
+            ).filter(models_mn.CargaAcademica.id_anio_escolar == id_anio).all()
+            for c in cargas:
+                secciones_por_docente.setdefault(c.id_usuario, set()).add(c.id_seccion)
+
+        return _SnapshotPermisos(id_anio, rol_por_usuario, seccion_por_alumno, secciones_por_docente)
+
+    def _asegurar(self, db: Session, forzar: bool = False):
+        """Devuelve el snapshot vigente, reconstruyéndolo si hace falta."""
+        with self._lock:
+            if forzar or self._snapshot is None or self._snapshot.edad() > self.TTL_SEGUNDOS:
+                self._snapshot = self._construir(db)
+            return self._snapshot
+
+    @staticmethod
+    def _evaluar(indice: _SnapshotPermisos, remitente_id: int, receptor_id: int):
+        if not indice.id_anio_escolar:
+            return "SIN_ANIO"
+
+        rol_remitente = indice.rol_por_usuario.get(remitente_id)
+        rol_receptor = indice.rol_por_usuario.get(receptor_id)
+
+        # --- REGLA: DOCENTE ENVÍA ---
+        if rol_remitente == "DOCENTE":
+            if rol_receptor == "DOCENTE":
+                return None # Docentes hablan entre sí libremente
+            if rol_receptor == "ALUMNO":
+                # El docente dicta en la sección donde el alumno está matriculado
+                if indice.seccion_por_alumno.get(receptor_id) in indice.secciones_por_docente.get(remitente_id, ()):
+                    return None
+
+        # --- REGLA: ALUMNO ENVÍA ---
+        elif rol_remitente == "ALUMNO":
+            if remitente_id not in indice.seccion_por_alumno:
+                return "SIN_MATRICULA"
+            seccion = indice.seccion_por_alumno[remitente_id]
+            if rol_receptor == "DOCENTE" and seccion in indice.secciones_por_docente.get(receptor_id, ()):
+                return None
+            # Compañeros: misma sección en el año activo
+            if rol_receptor == "ALUMNO" and seccion is not None and indice.seccion_por_alumno.get(receptor_id) == seccion:
+                return None
+
+        return "RESTRINGIDO"
+
+    def verificar(self, db: Session, remitente_id: int, receptor_id: int):
+        """
+        Devuelve None si el mensaje está permitido, o el motivo del rechazo:
+        'SIN_ANIO', 'SIN_MATRICULA' o 'RESTRINGIDO'.
+        """
+        indice = self._asegurar(db)
+        motivo = self._evaluar(indice, remitente_id, receptor_id)
+
+        # Ante un rechazo, si el índice no es reciente lo reconstruimos una vez
+        if motivo and indice.edad() > self.EDAD_MIN_RECONSTRUCCION:
+            indice = self._asegurar(db, forzar=True)
+            motivo = self._evaluar(indice, remitente_id, receptor_id)
+        return motivo
+
+
+# Instancia única para ser importada en otros archivos
+permisos_chat = PermisosChatIndex()
+
+
+class InboxService:
+    @staticmethod
+    def listar(db: Session, id_usuario: int, limite: int = None, cursor: str = None):
+        """
+        Bandeja de conversaciones del usuario en 2 consultas:
+        1. Conversaciones + perfil del otro participante (Docente/Alumno) en un solo JOIN,
+           usando el último mensaje y la fecha ya denormalizados en Conversacion.
+        2. Conteo de no leídos agrupado por conversación.
+        Paginación por cursor sobre (fecha_actualizacion, id_conversacion) descendente.
+        Devuelve (items, siguiente_cursor).
+        """
+        C = models.Conversacion
+        otro_id = case((C.usuario1_id == id_usuario, C.usuario2_id), else_=C.usuario1_id)
+
+        query = db.query(
+            C.id_conversacion,
+            C.ultimo_mensaje,
+            C.fecha_actualizacion,
+            otro_id.label("otro_id"),
+            models_usuario.Usuario.rol,
+            models_usuario.Usuario.username,
+            models_doc.Docente.nombres.label("docente_nombres"),
+            models_doc.Docente.apellidos.label("docente_apellidos"),
+            models_al.Alumno.nombres.label("alumno_nombres"),
+            models_al.Alumno.apellidos.label("alumno_apellidos")
+        ).join(
+            models_usuario.Usuario, models_usuario.Usuario.id_usuario == otro_id
+        ).outerjoin(
+            models_doc.Docente, models_doc.Docente.id_usuario == models_usuario.Usuario.id_usuario
+        ).outerjoin(
+            models_al.Alumno, models_al.Alumno.id_usuario == models_usuario.Usuario.id_usuario
+        ).filter(
+            or_(C.usuario1_id == id_usuario, C.usuario2_id == id_usuario)
+        )
+
+        if cursor:
+            fecha_cursor, id_cursor = decodificar_cursor(cursor)
+            query = query.filter(or_(
+                C.fecha_actualizacion < fecha_cursor,
+                and_(C.fecha_actualizacion == fecha_cursor, C.id_conversacion < id_cursor)
+            ))
+
+        query = query.order_by(C.fecha_actualizacion.desc(), C.id_conversacion.desc())
+        if limite:
+            # Pedimos uno extra para saber si hay una página siguiente
+            filas = query.limit(limite + 1).all()
+            hay_mas = len(filas) > limite
+            filas = filas[:limite]
+        else:
+            filas = query.all()
+            hay_mas = False
+
+        # 2. Mensajes no leídos enviados por el otro participante
+        no_leidos = {}
+        if filas:
+            no_leidos = dict(db.query(
+                models.Mensaje.id_conversacion, func.count(models.Mensaje.id_mensaje)
+            ).filter(
+                models.Mensaje.id_conversacion.in_([f.id_conversacion for f in filas]),
+                models.Mensaje.remitente_id != id_usuario,
+                models.Mensaje.leido == False
+            ).group_by(models.Mensaje.id_conversacion).all())
+
+        resultado = []
+        for f in filas:
+            # Nombre real desde Alumno o Docente
+            nombre_real = "Sin nombre"
+            apellidos_real = ""
+            if f.rol == 'DOCENTE':
+                if f.docente_nombres:
+                    nombre_real, apellidos_real = f.docente_nombres, f.docente_apellidos
+            elif f.rol == 'ALUMNO':
+                if f.alumno_nombres:
+                    nombre_real, apellidos_real = f.alumno_nombres, f.alumno_apellidos
+            else:
+                # Fallback por si es ADMIN o FAMILIAR
+                nombre_real = f.username
+
+            resultado.append({
+                "id": f.id_conversacion,
+                "receptor_id": f.otro_id,
+                "nombre": f"{nombre_real} {apellidos_real}".strip(),
+                "rol": f.rol,
+                "ultimoMensaje": f.ultimo_mensaje if f.ultimo_mensaje else "Empieza a chatear",
+                "hora": f.fecha_actualizacion.strftime("%H:%M") if f.ultimo_mensaje and f.fecha_actualizacion else "",
+                "iniciales": (nombre_real[0] + (apellidos_real[0] if apellidos_real else "")).upper(),
+                "color": "bg-[#701C32]" if f.rol == "DOCENTE" else "bg-blue-600",
+                "no_leidos": no_leidos.get(f.id_conversacion, 0),
+                "mensajes": []
+            })
+
+        siguiente_cursor = None
+        if hay_mas and filas:
+            ultima = filas[-1]
+            siguiente_cursor = codificar_cursor(ultima.fecha_actualizacion, ultima.id_conversacion)
+
+        return resultado, siguiente_cursor
+
+    @staticmethod
+    def marcar_leidos(db: Session, id_conversacion: int, id_usuario: int):
+        """Marca como leídos los mensajes que el otro participante le envió al usuario."""
+        afectados = db.query(models.Mensaje).filter(
+            models.Mensaje.id_conversacion == id_conversacion,
+            models.Mensaje.remitente_id != id_usuario,
+            models.Mensaje.leido == False
+        ).update({models.Mensaje.leido: True}, synchronize_session=False)
+        db.commit()
+        return afectados
+
+
+class HistorialService:
+    @staticmethod
+    def listar(db: Session, id_conversacion: int, limite: int, antes: str = None, desde: str = None):
+        """
+        Historial paginado por keyset sobre (fecha_envio, id_mensaje), apoyado en
+        el índice compuesto mensaje(id_conversacion, fecha_envio, id_mensaje).
+        - Sin cursores: los 'limite' mensajes más recientes.
+        - antes: página de mensajes anteriores al cursor (scroll hacia arriba).
+        - desde: mensajes posteriores al cursor (sincronización tras reconectar).
+        Siempre devuelve los mensajes en orden ascendente. Devuelve (items, hay_mas).
+        """
+        M = models.Mensaje
+        query = db.query(M).filter(M.id_conversacion == id_conversacion)
+
+        if desde:
+            fecha, id_mensaje = decodificar_cursor(desde)
+            query = query.filter(or_(
+                M.fecha_envio > fecha,
+                and_(M.fecha_envio == fecha, M.id_mensaje > id_mensaje)
+            )).order_by(M.fecha_envio.asc(), M.id_mensaje.asc())
+        else:
+            if antes:
+                fecha, id_mensaje = decodificar_cursor(antes)
+                query = query.filter(or_(
+                    M.fecha_envio < fecha,
+                    and_(M.fecha_envio == fecha, M.id_mensaje < id_mensaje)
+                ))
+            query = query.order_by(M.fecha_envio.desc(), M.id_mensaje.desc())
+
+        # Pedimos uno extra para saber si quedan más en esa dirección
+        mensajes = query.limit(limite + 1).all()
+        hay_mas = len(mensajes) > limite
+        mensajes = mensajes[:limite]
+        if not desde:
+            mensajes.reverse()
+
+        return [
+            {
+                "id": m.id_mensaje,
+                "texto": m.contenido,
+                "remitente_id": m.remitente_id,
+                "hora": m.fecha_envio.strftime("%H:%M"),
+                "cursor": codificar_cursor(m.fecha_envio, m.id_mensaje)
+            }
+            for m in mensajes
+        ], hay_mas
+
+
+class CursosAlumnoCache:
+    """
+    Lista de cursos (con su carga y docente) por (id_alumno, id_anio_escolar).
+    Solo cambia cuando se tocan cargas, matrículas o el plan de estudios, así
+    que se invalida completa desde esos endpoints; TTL_SEGUNDOS es la red de
+    seguridad para cambios que no pasan por la API (triggers, SQL manual).
+    """
+    TTL_SEGUNDOS = 600
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = {} # (id_alumno, id_anio) -> (instante, [cursos])
+
+    def invalidar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def _consultar(self, db: Session, id_alumno: int, id_anio: str):
+        filas = (
+            db.query(
+                models_ac.Curso.id_curso,
+                models_ac.Curso.nombre.label("curso_nombre"),
+                models_mn.CargaAcademica.id_carga_academica,
+                models_doc.Docente.nombres.label("docente_nombres"),
+                models_doc.Docente.apellidos.label("docente_apellidos")
+            )
+            .select_from(models_en.Matricula)
+            .join(models_ac.Seccion, models_ac.Seccion.id_seccion == models_en.Matricula.id_seccion)
+            .join(models_ac.PlanEstudio, models_ac.PlanEstudio.id_grado == models_ac.Seccion.id_grado)
+            .join(models_ac.Curso, models_ac.Curso.id_curso == models_ac.PlanEstudio.id_curso)
+            .outerjoin(models_mn.CargaAcademica,
+                (models_mn.CargaAcademica.id_curso == models_ac.Curso.id_curso) &
+                (models_mn.CargaAcademica.id_seccion == models_en.Matricula.id_seccion) &
+                (models_mn.CargaAcademica.id_anio_escolar == id_anio)
+            )
+            .outerjoin(models_doc.Docente, models_mn.CargaAcademica.id_docente == models_doc.Docente.id_docente)
+            .filter(
+                models_en.Matricula.id_alumno == id_alumno,
+                models_en.Matricula.id_anio_escolar == id_anio
+            )
+            .all()
+        )
+        return [
+            {
+                "id_curso": f.id_curso,
+                "nombre": f.curso_nombre,
+                "docente": f"{f.docente_nombres or ''} {f.docente_apellidos or ''}".strip(),
+                "id_carga_academica": f.id_carga_academica
+            }
+            for f in filas
+        ]
+
+    def obtener(self, db: Session, id_alumno: int, id_anio: str):
+        clave = (id_alumno, id_anio)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada and time.monotonic() - entrada[0] <= self.TTL_SEGUNDOS:
+                return entrada[1]
+
+        cursos = self._consultar(db, id_alumno, id_anio)
+        with self._lock:
+            self._entradas[clave] = (time.monotonic(), cursos)
+        return cursos
+
+
+# Instancia única para ser importada en otros archivos
+cursos_alumno = CursosAlumnoCache()
+
+
+class DashboardEstudianteService:
+    @staticmethod
+    def tareas_pendientes(db: Session, id_alumno: int, cursos: list):
+        """
+        Tareas por vencer de todas las cargas del alumno que aún no entregó,
+        en una sola consulta con anti-join (NOT EXISTS) contra entrega_tarea.
+        """
+        curso_por_carga = {
+            c["id_carga_academica"]: c["nombre"] for c in cursos if c["id_carga_academica"]
+        }
+        if not curso_por_carga:
+            return []
+
+        entregada = db.query(models.EntregaTarea.id_entrega).filter(
+            models.EntregaTarea.id_tarea == models.Tarea.id_tarea,
+            models.EntregaTarea.id_alumno == id_alumno
+        ).exists()
+
+        tareas = db.query(
+            models.Tarea.id_tarea,
+            models.Tarea.id_carga_academica,
+            models.Tarea.titulo,
+            models.Tarea.fecha_entrega
+        ).filter(
+            models.Tarea.id_carga_academica.in_(curso_por_carga.keys()),
+            models.Tarea.fecha_entrega >= datetime.now(),
+            ~entregada
+        ).order_by(models.Tarea.fecha_entrega.asc(), models.Tarea.id_tarea.asc()).all()
+
+        return [
+            {
+                "id_tarea": t.id_tarea,
+                "curso": curso_por_carga[t.id_carga_academica],
+                "titulo": t.titulo,
+                "fecha_entrega": t.fecha_entrega
+            }
+            for t in tareas
+        ]
+
+    @staticmethod
+    def obtener(db: Session, alumno: models_al.Alumno, id_anio: str):
+        cursos = cursos_alumno.obtener(db, alumno.id_alumno, id_anio)
+        return {
+            "nombre_completo": f"{alumno.nombres} {alumno.apellidos}",
+            "cursos": [
+                {"id_curso": c["id_curso"], "nombre": c["nombre"], "docente": c["docente"]}
+                for c in cursos
+            ],
+            "tareas_pendientes": DashboardEstudianteService.tareas_pendientes(db, alumno.id_alumno, cursos),
+            "anio_actual": id_anio
+        }
@@ -6,6 +6,7 @@ from . import models, schemas
 from sqlalchemy import or_
 from datetime import datetime,date
 from sqlalchemy import extract,desc,asc
+from app.modules.management.service import eventos_proximos
 
 router = APIRouter(prefix="/web", tags=["Web Institucional"])
 
@@ -79,6 +80,7 @@ def crear_evento(evento: schemas.EventoCreate, db: Session = Depends(get_db)):
     nueva = models.Evento(**evento.model_dump())
     db.add(nueva)
     db.commit()
+    eventos_proximos.invalidar()
     db.refresh(nueva)
     return nueva
 
@@ -110,6 +112,7 @@ def actualizar_evento(evento_id: int, evento_update: schemas.EventoCreate, db: S
         setattr(db_evento, key, value)
     
     db.commit()
+    eventos_proximos.invalidar()
     db.refresh(db_evento)
     return db_evento
 
@@ -122,6 +125,7 @@ def eliminar_evento(evento_id: int, db: Session = Depends(get_db)):
     # "Soft delete" lógico (igual que hiciste con noticias)
     db_evento.activo = False
     db.commit()
+    eventos_proximos.invalidar()
     return {"message": "Evento desactivado correctamente"}
 
 
@@ -1,29 +1,52 @@
 import os
+import time
+import asyncio
+import importlib
 from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 from sqlalchemy import text  # Para escribir SQL puro
 from app.db.database import get_db # Ajusta la ruta según tu carpeta
-from app.modules.users import router as usuario_router 
-from app.modules.users.alumno import router as alumno_router
-from app.modules.users.familiar import router as familiar_router
-from app.modules.users.docente import router as docente_router
-from app.modules.chatbot import router as chatbot_router
+from app.core.socket_manager import socket_manager, WS_PING_INTERVALO
+
+# --- Reporte de arranque ---
+# Cada router se importa midiendo cuánto tarda. Lo que comparten varios módulos
+# (modelos, SQLAlchemy, etc.) se le cuenta al primero que lo importa.
+# REPORTE_ARRANQUE=1 lo imprime al iniciar; también queda en GET /metricas/arranque.
+TIEMPOS_IMPORT_MS = {}
+
+def _importar(modulo: str):
+    inicio = time.perf_counter()
+    importado = importlib.import_module(modulo)
+    TIEMPOS_IMPORT_MS[modulo] = round((time.perf_counter() - inicio) * 1000, 1)
+    return importado
+
+usuario_router = _importar("app.modules.users.router")
+alumno_router = _importar("app.modules.users.alumno.router")
+familiar_router = _importar("app.modules.users.familiar.router")
+docente_router = _importar("app.modules.users.docente.router")
+chatbot_router = _importar("app.modules.chatbot.router")
 # Resto de módulos
-from app.modules.perfil import router as perfil_router
-from app.modules.academic import router as academic_router
-from app.modules.enrollment import router as enrollment_router
-from app.modules.finance import router as finance_router
-from app.modules.management import router as management_router
-from app.modules.virtual import router as virtual_router
-from app.modules.behavior import router as behavior_router
-from app.modules.web import router as web_router
-from app.modules.admision import router as admision_router
-from app.modules.horario import router as horario_router
-from app.modules.pagina_principal import router as pagina_web_router
-from app.modules.personal import router as personal_router
-from app.core.socket_manager import socket_manager
+perfil_router = _importar("app.modules.perfil.router")
+academic_router = _importar("app.modules.academic.router")
+enrollment_router = _importar("app.modules.enrollment.router")
+finance_router = _importar("app.modules.finance.router")
+management_router = _importar("app.modules.management.router")
+virtual_router = _importar("app.modules.virtual.router")
+behavior_router = _importar("app.modules.behavior.router")
+web_router = _importar("app.modules.web.router")
+admision_router = _importar("app.modules.admision.router")
+horario_router = _importar("app.modules.horario.router")
+pagina_web_router = _importar("app.modules.pagina_principal.router")
+personal_router = _importar("app.modules.personal.router")
+from app.modules.chatbot.recursos import recursos_chatbot, CHATBOT_PRECALENTAR
+
+if os.getenv("REPORTE_ARRANQUE", "0") == "1":
+    print("⏱️ Tiempo de import por módulo:")
+    for modulo, ms in sorted(TIEMPOS_IMPORT_MS.items(), key=lambda x: -x[1]):
+        print(f"   {ms:>8.1f} ms  {modulo}")
+    print(f"   {sum(TIEMPOS_IMPORT_MS.values()):>8.1f} ms  total")
 
 
 app = FastAPI()
@@ -40,6 +63,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],              # Permite todos los métodos (GET, POST, etc.)
     allow_headers=["*"],              # Permite todos los encabezados
+    # Paginación del chat (bandeja e historial): el front tiene que poder leer estas cabeceras
+    expose_headers=["X-Next-Cursor", "X-Has-More"],
 )
 
 # 1. Esto detecta la carpeta 'Backend' (donde está main.py)
@@ -78,22 +103,62 @@ app.include_router(personal_router.router)
 
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
-    # 1. Conectar al usuario
-    await socket_manager.connect(user_id, websocket)
+    # 1. Conectar al usuario (cada pestaña tiene su propia cola de salida)
+    conexion = await socket_manager.connect(user_id, websocket)
     try:
-        while True:
-            # Mantener la conexión abierta escuchando mensajes (opcional)
-            # data = await websocket.receive_text() 
-            
-            # Recibir JSON si necesitas señales como "está escribiendo" o "leído"
-            data = await websocket.receive_json()
+        # Si el escritor descartó la conexión (envío fallido o lento) ya la cerró: dejamos de leer
+        while not conexion.cerrada:
+            # Recibir JSON si necesitas señales como "está escribiendo" o "leído".
+            # Si no llega nada en WS_PING_INTERVALO, enviamos PING (el front responde {"tipo": "PONG"})
+            try:
+                data = await asyncio.wait_for(websocket.receive_json(), timeout=WS_PING_INTERVALO)
+            except asyncio.TimeoutError:
+                if conexion.cerrada:
+                    break
+                if not socket_manager.latido(conexion):
+                    await websocket.close(code=1001)
+                    break
+                continue
+            socket_manager.registrar_actividad(conexion, data)
             
     except WebSocketDisconnect:
         # 2. Desconectar al usuario si cierra la pestaña o pierde internet
-        socket_manager.disconnect(user_id)
+        pass
     except Exception as e:
         print(f"Error en socket para usuario {user_id}: {e}")
-        socket_manager.disconnect(user_id)
+    finally:
+        socket_manager.disconnect(user_id, websocket)
+
+@app.get("/ws/metricas")
+def metricas_websocket():
+    """Conexiones activas y profundidad de las colas de salida en este worker."""
+    return socket_manager.metricas()
+
+@app.get("/metricas/arranque")
+def metricas_arranque():
+    """Costo de import de cada router y qué dependencias pesadas del chatbot ya se cargaron."""
+    return {
+        "imports_ms": TIEMPOS_IMPORT_MS,
+        "total_ms": round(sum(TIEMPOS_IMPORT_MS.values()), 1),
+        "chatbot": recursos_chatbot.cargados()
+    }
+
+@app.on_event("startup")
+async def precalentar_chatbot():
+    # Opcional (CHATBOT_PRECALENTAR=1): carga el modelo en segundo plano sin demorar el arranque
+    if CHATBOT_PRECALENTAR:
+        asyncio.create_task(recursos_chatbot.precalentar_en_segundo_plano())
+
+@app.on_event("startup")
+async def vigilar_ingestas_chatbot():
+    # Retoma las ingestas que dejó a medias un worker caído o reiniciado
+    from app.db.database import engine
+    asyncio.create_task(chatbot_router.cola_ingesta.vigilar(engine))
+
+@app.on_event("shutdown")
+async def cerrar_socket_manager():
+    # Libera el backend pub/sub (p. ej. el socket Unix de este worker)
+    await socket_manager.close()
 
 @app.get("/")
 def check_db_connection(db: Session = Depends(get_db)):